@@ -5,19 +5,23 @@ Create an analyses tool for geo parquet files
 '''
 
 import argparse
+import collections
+import concurrent.futures
 import csv
 import io
 import os
 import sys
 import time
 
-import pyarrow
+import pyarrow as pa
 import pyarrow.parquet as pq
 import pandas as pd
+import shapely
 import geopandas as gpd
 from shapely import wkb, wkt
 from shapely.geometry import box
-import dask.dataframe as dd
+import external_sort
+import geoparquet
 
 # pylint: disable=unnecessary-lambda
 
@@ -33,6 +37,31 @@ def sort_by_panda(file_path:str, output_path:str):
         schema_version='1.1.0',
         row_group_size=69390)   #120587) # parrow flag
 
+def sort_by_curve(args:argparse.Namespace):
+    '''
+    Sort by a Hilbert or Morton key from the center of each envelope without loading everything,
+    sorted runs are spilled next to the output and merged back into one GeoParquet file.
+    '''
+    mark_start = int(time.time() * 1000)
+
+    def keyed(table):
+        table = geoparquet.prepare(table, encoding=args.encoding)
+        return table, external_sort.center_key(table, args.curve, args.order)
+
+    writer = None
+    for table in external_sort.external_sort(args.parquet, keyed, args.run_rows,
+        directory=os.path.dirname(os.path.abspath(args.out))):
+        if writer is None:
+            writer = geoparquet.GeoParquetWriter(args.out, table.schema, args.row_group_size,
+                **output_options(args))
+        writer.write(table)
+    if writer is None:
+        return "No rows to sort"
+    writer.close()
+
+    mark_stop = int(time.time() * 1000)
+    return f"Sorted {writer.rows} rows by {args.curve} in {mark_stop-mark_start}ms"
+
 def add_bbox(file_path:str, output_path:str):
     parquet = gpd.read_parquet(file_path, memory_map=True)
     parquet.to_parquet(output_path,
@@ -53,74 +82,62 @@ def process_file(file):
         gdf = gdf.drop(columns=['bbox'])
     return gdf
 
-def add_bbox_lots(file_path: str, output_path: str):
+def bbox_row_group(file_path:str, index:int, tolerance:float = None,
+    method:str = 'simplify', encoding:str = 'WKB', split:bool = False) -> pa.Table:
+    '''
+    Worker task, read one row group and give it WKB or GeoArrow geometry and a bbox column, and when
+    a tolerance is given the coarse geometry and vertex count columns too. With split, shapes
+    marked as crossing the antimeridian are cut in two there.
+    '''
+    table = pq.ParquetFile(file_path).read_row_group(index)
+    if split:
+        geometry = geoparquet.split_antimeridian(geoparquet.to_geometry(table.column('geometry')),
+            geoparquet.crossing_of(table))
+        table = table.set_column(table.schema.get_field_index('geometry'), 'geometry',
+            pa.array(shapely.to_wkb(geometry), type=pa.binary()))
+    table = geoparquet.prepare(table, encoding=encoding)
+    if tolerance is not None:
+        table = geoparquet.add_coarse(table, tolerance, method)
+    return table
+
+def add_bbox_lots(file_path:str, output_path:str, row_group_size:int = 120950,
+    workers:int = None, tolerance:float = None, method:str = 'simplify', encoding:str = 'WKB',
+    options:dict = None, split:bool = False):
+    '''
+    Add a bbox column to a large file. Row groups are converted in parallel by worker processes
+    and written straight into one file in their original order, only a few row groups are held in
+    memory at a time. With a tolerance the coarse geometry columns are added as well, and with split
+    shapes over the antimeridian are cut in two. options are passed on to the writer, zstd
+    compression when not given.
+    '''
+    options = options or {'compression': 'zstd'}
     parquet_file = pq.ParquetFile(file_path)
-    temp_files = []
+    groups = parquet_file.num_row_groups
+    workers = workers or os.cpu_count()
 
     mark_start = int(time.time() * 1000)
-    for i in range(parquet_file.num_row_groups):
-        temp_file = f"{output_path}_temp_{i}.parquet"
-
-        if os.path.exists(temp_file):
-            print(f"Temporary file already exists: {temp_file}")
-            temp_files.append(temp_file)
-            continue
-
-        print(f"Processing row group {i}")
-        table = parquet_file.read_row_group(i)
-        data = table.to_pandas()
-        data['geometry'] = data['geometry'].apply(safe_wkt_load)
-        parquet = gpd.GeoDataFrame(data, geometry='geometry')
-
-        print(f"Writing row group to temporary file: {temp_file}")
-
-        parquet.to_parquet(temp_file,
-                           write_covering_bbox=True,
-                           schema_version='1.1.0',
-                           row_group_size=120950) #121793
-        temp_files.append(temp_file)
-
-    #print("Combining temporary files")
-    #combined_gdf = None
-    #for temp_file in temp_files:
-    #    gdf = gpd.read_parquet(temp_file)
-    #    if combined_gdf is None:
-    #        combined_gdf = gdf
-    #    else:
-    #        combined_gdf = combined_gdf._append(gdf, ignore_index=True)
-    #    combined_gdf = combined_gdf.set_geometry('geometry')
-
-    print("Combining temporary files with dask")
-    # Use Dask to read and concatenate the parquet files
-    ddf = dd.read_parquet(temp_files)
-
-    # Compute the result in chunks
-    chunk_size = 100000  # Adjust this value based on your available memory
-    combined_gdf = gpd.GeoDataFrame()
-
-    for chunk in ddf.partitions:
-        chunk_pd = chunk.compute()
-
-        #if 'bbox' in chunk_pd.columns:
-        #    chunk_pd['bbox'] = chunk_pd.drop(columns=['bbox'])
-
-        chunk_gdf = gpd.GeoDataFrame(chunk_pd, geometry='geometry')
-
-        combined_gdf = combined_gdf._append(chunk_gdf, ignore_index=True)
-        combined_gdf = combined_gdf.set_geometry('geometry')
-
-    print(f"Writing combined data to {output_path}")
-    combined_gdf.to_parquet(output_path,
-                        #write_covering_bbox=True,
-                        schema_version='1.1.0',
-                        row_group_size=120950)
-
-    # Clean up temporary files
-    for temp_file in temp_files:
-        os.remove(temp_file)
+    writer = None
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        in_flight = collections.deque()
+        next_group = 0
+        written = 0
+        while in_flight or next_group < groups:
+            while next_group < groups and len(in_flight) < workers * 2:
+                in_flight.append(pool.submit(bbox_row_group, file_path, next_group,
+                    tolerance, method, encoding, split))
+                next_group += 1
+            table = in_flight.popleft().result()
+            if writer is None:
+                writer = geoparquet.GeoParquetWriter(output_path, table.schema, row_group_size,
+                    **options)
+            writer.write(table)
+            written += 1
+            print(f"Wrote row group {written} of {groups}")
+    if writer is not None:
+        writer.close()
 
     mark_stop = int(time.time() * 1000)
-    print(f"Process completed in {mark_stop-mark_start}s")
+    print(f"Process completed in {mark_stop-mark_start}ms")
 
 def update_by_panda_broken(file_path:str, output_path:str):
     print(f"updating {file_path} to test2.parquet")
@@ -139,6 +156,10 @@ def update_by_panda_broken(file_path:str, output_path:str):
 
 # ################################################################################################ #
 
+def output_options(args:argparse.Namespace) -> dict:
+    ''' Writer options from --writer-config and --compression. '''
+    return geoparquet.writer_options(args.writer_config, compression=args.compression)
+
 def row(name:str, input, function, help_text:str) -> dict:
     ''' shorten the creation of one row of the runner dictioanry '''
     return {'name': name, 'input': input, 'function': function, 'help': help_text}
@@ -146,8 +167,20 @@ def row(name:str, input, function, help_text:str) -> dict:
 runner = {
     'sort': row('Transform', 'geopanda', lambda x, y : sort_by_panda(x, y), "Update"),
     'add-bbox': row('Add BBox','geopanda',  lambda x, y : add_bbox(x, y), "Add BBox"),
-    'add-bbox-lots': row('Add BBox Lots','geopanda',
-        lambda x, y : add_bbox_lots(x, y), "Add Lots of BBox"),
+    'add-bbox-lots': row('Add BBox Lots', 'args',
+        lambda x : add_bbox_lots(x.parquet, x.out, x.row_group_size, x.workers,
+            encoding=x.encoding, options=output_options(x)),
+        "Add Lots of BBox, streaming row groups through --workers processes"),
+    'add-coarse': row('Add Coarse Geometry', 'args',
+        lambda x : add_bbox_lots(x.parquet, x.out, x.row_group_size, x.workers, x.tolerance,
+            x.coarse, x.encoding, output_options(x)),
+        "Add bbox plus a coarse geometry that covers each shape and a vertex count, see --coarse"),
+    'split-antimeridian': row('Split at the Antimeridian', 'args',
+        lambda x : add_bbox_lots(x.parquet, x.out, x.row_group_size, x.workers,
+            encoding=x.encoding, options=output_options(x), split=True),
+        "Add bbox after cutting shapes marked MBRCrossesAntimeridian in two at the date line"),
+    'sort-curve': row('Sort by curve', 'args', lambda x : sort_by_curve(x),
+        "Out of core sort by a Hilbert or Morton key of envelope centers, see --curve"),
 }
 
 def what():
@@ -168,6 +201,8 @@ def run(args: argparse.Namespace):
                     print(runner[act]['function'](args.parquet, args.out))
                 case 'geopanda':
                     print(runner[act]['function'](args.parquet, args.out))
+                case 'args':
+                    print(runner[act]['function'](args))
                 case 'panda':
                     parquet = pd.read_parquet(args.parquet, engine='pyarrow')
                     print(runner[act]['function'](parquet, args.out))
@@ -182,13 +217,33 @@ def handle_args() -> argparse.Namespace:
     # Add command-line arguments
     parser.add_argument("parquet", help='Path to parquet file.')
     parser.add_argument("-a", "--actions",
-        choices=['add-bbox', 'add-bbox-lots', 'sort'],
+        choices=['add-bbox', 'add-bbox-lots', 'add-coarse', 'sort', 'sort-curve',
+            'split-antimeridian'],
         nargs="+",
         help='Name of the csv file to write out.')
     parser.add_argument("-o", "--out",
         default='output.parquet',
         help='optional output file name for action')
     parser.add_argument("-w", "--what", action='store_true', help='List all the options')
+    parser.add_argument("-c", "--curve", default='hilbert', choices=['hilbert', 'morton'],
+        help='Space filling curve for sort-curve.')
+    parser.add_argument("--order", default=16, type=int,
+        help='Bits per axis for the curve, 16 is about 600m cells.')
+    parser.add_argument("-r", "--row-group-size", default=100_000, type=int,
+        help='Rows in each row group of the output.')
+    parser.add_argument("-j", "--workers", type=int,
+        help='Processes to use for add-bbox-lots, default is one per core.')
+    parser.add_argument("--run-rows", default=2_000_000, type=int,
+        help='Rows sorted in memory at a time before being spilled to disk.')
+    parser.add_argument("--compression", default='zstd', help='Parquet compression for output.')
+    parser.add_argument("--writer-config",
+        help='JSON writer config, such as from `tune.py -a compression`, over --compression.')
+    parser.add_argument("--encoding", default='WKB', choices=['WKB', 'geoarrow'],
+        help='Geometry encoding of the output, geoarrow needs one geometry family per file.')
+    parser.add_argument("--coarse", default='simplify', choices=['simplify', 'hull'],
+        help='How add-coarse makes the coarse geometry, grow and simplify or convex hull.')
+    parser.add_argument("--tolerance", default=0.05, type=float,
+        help='Degrees the coarse geometry is grown and then simplified by.')
 
     # Parse arguments
     args = parser.parse_args()
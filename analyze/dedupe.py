@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+'''
+Build a one row per granule dataset. The harvester writes a row for each part of a complex shape,
+so a granule with an island and a hole has three rows. Here the parts of each granule are put back
+together: polygons become one MultiPolygon, where a part covered by another part is taken to be a
+hole in it, and points or lines become a MultiPoint or MultiLineString. The other columns come from
+the row of the largest part and the MBR columns are worked out again to cover every part.
+
+Input must be sorted on the key, across files as well as inside them, such as the output of
+`merge.py -k GranuleUR`. Files are streamed a batch at a time, and with --workers each file is done
+by its own process. A granule cut across a file boundary is finished by the process of the file it
+starts in, which reads just those rows from the next file.
+
+example run:
+
+ ./dedupe.py '../data/merged/*.parquet' -o ../data/granules -k GranuleUR -j 4
+'''
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely
+
+import geoparquet
+import merge
+
+MBR = ['MBRWest', 'MBRSouth', 'MBREast', 'MBRNorth']
+
+# ################################################################################################ #
+# Mark: - Functions
+
+def assemble(parts:np.ndarray):
+    '''
+    One geometry from the parts of a granule. Polygons are nested from the largest down, a polygon
+    covered by an earlier one is a hole in it, unless it is inside one of that polygon's holes in
+    which case it is an island of its own. Polygons which overlap without one covering the other
+    are merged into one.
+    '''
+    parts = shapely.get_parts(parts[~shapely.is_missing(parts)])
+    # the same part twice would otherwise be a hole the size of its own shell
+    _, first = np.unique(shapely.to_wkb(parts), return_index=True)
+    parts = parts[np.sort(first)]
+    if len(parts) == 0:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    kinds = set(shapely.get_type_id(parts).tolist())
+    if kinds == {shapely.GeometryType.POINT}:
+        return shapely.multipoints(parts)
+    if kinds == {shapely.GeometryType.LINESTRING}:
+        return shapely.multilinestrings(parts)
+    if kinds != {shapely.GeometryType.POLYGON}:
+        return shapely.geometrycollections(parts)
+
+    shells = []
+    for part in parts[np.argsort(-shapely.area(parts), kind='stable')]:
+        owner = next((shell for shell in reversed(shells) if shell[0].covers(part)), None)
+        if owner is not None and not any(hole.covers(part) for hole in owner[1]):
+            owner[1].append(part)
+        else:
+            shells.append((part, []))
+    polygons = [shapely.Polygon(shell.exterior, [*shell.interiors, *(hole.exterior for hole in holes)])
+        for shell, holes in shells]
+    out = polygons[0] if len(polygons) == 1 else shapely.multipolygons(polygons)
+    if not out.is_valid:
+        # a MultiPolygon with overlapping members is invalid, union them instead
+        out = shapely.union_all(shapely.make_valid(np.array(polygons)))
+    return out
+
+def whole_granules(tables, key:str):
+    '''
+    Regroup a stream of sorted tables so no granule is split between two of them, the rows of the
+    last key in each table are held back and put in front of the next one.
+    '''
+    held = None
+    for table in tables:
+        if held is not None and held.num_rows:
+            table = pa.concat_tables([held, table])
+        if table.num_rows == 0:
+            continue
+        keys = table.column(key).combine_chunks()
+        if table.num_rows > 1:
+            backwards = pc.less(keys.slice(1), keys.slice(0, len(keys) - 1))
+            if pc.any(pc.fill_null(backwards, False)).as_py():
+                raise ValueError(f"Input is not sorted on {key}")
+        last = pc.fill_null(pc.equal(keys, keys[-1]), False).to_numpy(zero_copy_only=False)
+        others = np.flatnonzero(~last)
+        if not keys[-1].is_valid:
+            cut = len(keys)
+        else:
+            cut = others[-1] + 1 if len(others) else 0
+        if cut:
+            yield table.slice(0, cut)
+        held = table.slice(cut)
+    if held is not None and held.num_rows:
+        yield held
+
+def group_starts(keys:pa.Array) -> np.ndarray:
+    ''' Index of the first row of each run of equal keys, rows with no key are each their own run. '''
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    same = pc.fill_null(pc.equal(keys.slice(1), keys.slice(0, len(keys) - 1)), False)
+    return np.flatnonzero(np.concatenate([[True], ~same.to_numpy(zero_copy_only=False)]))
+
+def covering_mbr(table:pa.Table, starts:np.ndarray) -> dict:
+    '''
+    MBR columns covering every part of each granule. When a part crosses the antimeridian its west
+    is east of its east, so the parts of that granule are unwrapped to run from 0 to 360 before
+    their west and east are taken, then wrapped back. A granule whose parts cover every longitude
+    gets -180 to 180 and no longer crosses.
+    '''
+    values = {name: table.column(name).to_numpy() for name in MBR}
+    crossing = np.zeros(table.num_rows, dtype=bool)
+    if 'MBRCrossesAntimeridian' in table.column_names:
+        crossing = pc.fill_null(table.column('MBRCrossesAntimeridian'), False).to_numpy()
+    crosses = np.logical_or.reduceat(crossing, starts)
+    west = np.fmin.reduceat(values['MBRWest'], starts)
+    east = np.fmax.reduceat(values['MBREast'], starts)
+    # parts wholly in the western hemisphere move 360 east, crossing parts only move their east
+    shift = np.where(values['MBREast'] < 0, 360.0, 0.0)
+    wide_west = np.fmin.reduceat(values['MBRWest'] + np.where(crossing, 0.0, shift), starts)
+    wide_east = np.fmax.reduceat(values['MBREast'] + np.where(crossing, 360.0, shift), starts)
+    around = wide_east - wide_west >= 360.0
+    wide_west = np.where(around, -180.0, np.where(wide_west > 180.0, wide_west - 360.0, wide_west))
+    wide_east = np.where(around, 180.0, np.where(wide_east > 180.0, wide_east - 360.0, wide_east))
+    out = {
+        'MBRWest': np.where(crosses, wide_west, west),
+        'MBRSouth': np.fmin.reduceat(values['MBRSouth'], starts),
+        'MBREast': np.where(crosses, wide_east, east),
+        'MBRNorth': np.fmax.reduceat(values['MBRNorth'], starts),
+    }
+    if 'MBRCrossesAntimeridian' in table.column_names:
+        out['MBRCrossesAntimeridian'] = crosses & ~around
+    return out
+
+def dedupe_table(table:pa.Table, key:str) -> pa.Table:
+    ''' One row for each granule of a table sorted on key, geometry is left as WKB. '''
+    starts = group_starts(table.column(key).combine_chunks())
+    sizes = np.diff(np.append(starts, table.num_rows))
+    geometry = geoparquet.to_geometry(table.column('geometry'))
+    area = np.nan_to_num(shapely.area(geometry), nan=-1.0)
+    group = np.repeat(np.arange(len(starts)), sizes)
+    base = np.lexsort((-area, group))[starts]
+
+    merged = geometry[base]
+    for index in np.flatnonzero(sizes > 1):
+        merged[index] = assemble(geometry[starts[index]:starts[index] + sizes[index]])
+    out = table.take(base)
+    out = out.set_column(out.schema.get_field_index('geometry'), 'geometry',
+        pa.array(shapely.to_wkb(merged), type=pa.binary()))
+    if all(name in table.column_names for name in MBR):
+        for name, values in covering_mbr(table, starts).items():
+            field = out.schema.field(name)
+            out = out.set_column(out.schema.get_field_index(name), field,
+                pa.array(values, type=field.type))
+    return out
+
+def key_bounds(path:str, key:str) -> tuple:
+    ''' First and last key of a sorted file, from the footer statistics when there are any. '''
+    metadata = pq.read_metadata(path)
+    items = merge.key_statistics(metadata, key)
+    if items:
+        return min(item[1] for item in items), max(item[2] for item in items)
+    keys = pc.drop_null(pq.read_table(path, columns=[key]).column(key))
+    if len(keys) == 0:
+        return None, None
+    return keys[0].as_py(), keys[-1].as_py()
+
+def job_tables(path:str, followers:list[str], skip, tail, args:argparse.Namespace):
+    '''
+    The tables one process works on: its file without the leading granule a previous file started,
+    then the rows of its last granule which run on into the following files.
+    '''
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=args.batch_rows):
+        table = pa.Table.from_batches([batch])
+        if skip is not None:
+            keys = table.column(args.key)
+            table = table.filter(pc.fill_null(pc.not_equal(keys,
+                pa.scalar(skip, type=keys.type)), True))
+        yield table
+    for follower in followers:
+        for batch in pq.ParquetFile(follower).iter_batches(batch_size=args.batch_rows):
+            table = pa.Table.from_batches([batch])
+            keys = table.column(args.key)
+            same = pc.fill_null(pc.equal(keys, pa.scalar(tail, type=keys.type)), False)
+            yield table.filter(same)
+            if not pc.all(same).as_py():
+                return
+
+def dedupe_file(path:str, followers:list[str], skip, tail, args:argparse.Namespace,
+    prefix:str) -> tuple:
+    ''' Write one row per granule for the granules starting in a file, returns (rows read, files). '''
+    files = merge.OutputFiles(args.output, prefix, args.target_rows, args.row_group_size,
+        **geoparquet.writer_options(args.writer_config, compression=args.compression))
+    rows = 0
+    for table in whole_granules(job_tables(path, followers, skip, tail, args), args.key):
+        rows += table.num_rows
+        files.write(geoparquet.prepare(dedupe_table(table, args.key), encoding=args.encoding))
+    files.close()
+    return rows, files.files
+
+def plan(paths:list[str], key:str) -> list[tuple]:
+    '''
+    (path, followers, skip, tail) for each file in key order. skip is a key the previous file
+    already finished and followers are the next files holding more rows of this file's last key.
+    Raises ValueError if the files overlap, as a granule could then be anywhere.
+    '''
+    bounds = sorted(((key_bounds(path, key), path) for path in paths),
+        key=lambda item: (item[0][0] is None, item[0]))
+    bounds = [item for item in bounds if item[0][0] is not None]
+    for ((_, high), path), ((low, _), after) in zip(bounds, bounds[1:]):
+        if high > low:
+            raise ValueError(f"{path} and {after} overlap on {key}, merge them with merge.py first")
+    jobs = []
+    for index, ((low, high), path) in enumerate(bounds):
+        skip = bounds[index - 1][0][1] if index and bounds[index - 1][0][1] == low else None
+        followers = []
+        # a file holding nothing but the previous file's last granule has no granule of its own
+        for (next_low, next_high), after in bounds[index + 1:] if skip != high else []:
+            if next_low != high:
+                break
+            followers.append(after)
+            if next_high != high:
+                break
+        jobs.append((path, followers, skip, high))
+    return jobs
+
+def dedupe(args:argparse.Namespace) -> str:
+    ''' Write one row per granule for all the inputs and report how many rows that saved. '''
+    mark_start = time.time()
+    paths = merge.find_inputs(args.inputs)
+    if not paths:
+        return "No parquet files found."
+    os.makedirs(args.output, exist_ok=True)
+    try:
+        jobs = plan(paths, args.key)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return "Input must be sorted on the key."
+
+    results = []
+    if args.workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+            futures = [pool.submit(dedupe_file, *job, args, f"part_{index:05d}")
+                for index, job in enumerate(jobs)]
+            results = [future.result() for future in futures]
+    else:
+        results = [dedupe_file(*job, args, f"part_{index:05d}") for index, job in enumerate(jobs)]
+
+    read = sum(rows for rows, _ in results)
+    written = [path for _, files in results for path in files]
+    rows = sum(pq.read_metadata(path).num_rows for path in written)
+    return (f"Read {read} rows and wrote {rows} granules ({read / max(rows, 1):.2f} rows each) "
+        f"into {len(written)} files in {args.output} in {time.time() - mark_start:.1f}s")
+
+# ################################################################################################ #
+# testing
+
+def dedupe_test():
+    ''' Parts come back together as one row per granule, holes as holes, across file boundaries. '''
+    import tempfile
+    outer = shapely.box(0, 0, 10, 10)
+    hole = shapely.box(2, 2, 4, 4)
+    island = shapely.box(2.5, 2.5, 3, 3)
+    other = shapely.box(20, 0, 21, 1)
+    whole = assemble(np.array([hole, outer, island, other]))
+    assert whole.geom_type == 'MultiPolygon' and len(whole.geoms) == 3
+    assert abs(whole.area - (100 - 4 + 0.25 + 1)) < 1e-9
+    merged = assemble(np.array([outer, shapely.box(8, 8, 12, 12)]))
+    assert merged.is_valid and abs(merged.area - 112) < 1e-9
+
+    parts = pa.table({'MBRWest': [170.0, 100.0, 10.0, -20.0], 'MBRSouth': [0.0] * 4,
+        'MBREast': [-170.0, 110.0, -10.0, 15.0], 'MBRNorth': [1.0] * 4,
+        'MBRCrossesAntimeridian': [True, False, True, False]})
+    mbr = covering_mbr(parts, np.array([0, 2]))
+    assert mbr['MBRWest'].tolist() == [100.0, -180.0]
+    assert mbr['MBREast'].tolist() == [-170.0, 180.0]
+    assert mbr['MBRCrossesAntimeridian'].tolist() == [True, False]
+
+    def table(names, shapes, wests):
+        return pa.table({'GranuleUR': names,
+            'geometry': pa.array(shapely.to_wkb(np.array(shapes)), type=pa.binary()),
+            'MBRWest': wests, 'MBRSouth': [0.0] * len(names), 'MBREast': [w + 1 for w in wests],
+            'MBRNorth': [1.0] * len(names), 'MBRCrossesAntimeridian': [False] * len(names)})
+    with tempfile.TemporaryDirectory() as temp:
+        inputs = [os.path.join(temp, name) for name in ['a.parquet', 'b.parquet', 'c.parquet']]
+        pq.write_table(table(['g1', 'g2', 'g2'], [other, outer, hole], [20.0, 0.0, 2.0]), inputs[0])
+        pq.write_table(table(['g2', 'g2'], [island, other], [2.5, 20.0]), inputs[1])
+        pq.write_table(table(['g2', 'g3'], [other, outer], [30.0, 0.0]), inputs[2])
+        for workers in [1, 2]:
+            args = argparse.Namespace(inputs=inputs, output=os.path.join(temp, f"out{workers}"),
+                key='GranuleUR', batch_rows=2, row_group_size=10, target_rows=100,
+                workers=workers, compression='zstd', writer_config=None, encoding='WKB')
+            dedupe(args)
+            out = pa.concat_tables(pq.read_table(os.path.join(args.output, name))
+                for name in sorted(os.listdir(args.output)))
+            assert out.column('GranuleUR').to_pylist() == ['g1', 'g2', 'g3']
+            granule = shapely.from_wkb(out.column('geometry')[1].as_py())
+            assert len(granule.geoms) == 3 and len(granule.geoms[0].interiors) == 1
+            assert out.column('MBRWest')[1].as_py() == 0.0
+            assert out.column('MBREast')[1].as_py() == 31.0
+
+#dedupe_test()
+
+# ################################################################################################ #
+# Mark: - Command functions
+
+def handle_args() -> argparse.Namespace:
+    ''' Process all the command line arguments and return an argparse Namespace object. '''
+    parser = argparse.ArgumentParser(description="One row per granule with the parts reassembled")
+
+    # Add command-line arguments
+    parser.add_argument("inputs", nargs='+', help='Parquet files, directories, or globs, sorted '
+        'on the key.')
+    parser.add_argument("-o", "--output", required=True, help='Directory for the granule files.')
+    parser.add_argument("-k", "--key", default='GranuleUR',
+        help='Column naming the granule, such as GranuleUR or ConceptId.')
+    parser.add_argument("--target-rows", default=1_000_000, type=int,
+        help='Rows in each output file.')
+    parser.add_argument("-r", "--row-group-size", default=100_000, type=int,
+        help='Rows in each row group.')
+    parser.add_argument("--batch-rows", default=64 * 1024, type=int,
+        help='Rows read at a time.')
+    parser.add_argument("-j", "--workers", default=1, type=int,
+        help='Processes to work on files in.')
+    parser.add_argument("--compression", default='zstd', help='Parquet compression.')
+    parser.add_argument("--writer-config",
+        help='JSON writer config, such as from `tune.py -a compression`, over --compression.')
+    parser.add_argument("--encoding", default='WKB', choices=['WKB', 'geoarrow'],
+        help='Geometry encoding of the output, geoarrow needs one geometry family.')
+
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+def main():
+    ''' Be a command line app. '''
+    args = handle_args()
+    print(dedupe(args))
+
+if __name__ == "__main__":
+    main()
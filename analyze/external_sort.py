@@ -0,0 +1,196 @@
+'''
+Sort parquet data that does not fit in memory. Rows are read in batches, given a sort key, and
+written out as sorted runs to a temporary directory. The runs are then merged back together a batch
+at a time, so memory only needs to hold one batch from each run.
+
+Spatial keys come from the center of each envelope, put on a 2^order by 2^order grid over the world,
+and then numbered along a Hilbert or Morton (Z order) curve. Nearby keys are nearby on the ground so
+sorting by them clusters each row group into a small area.
+'''
+
+import os
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import geoparquet
+
+KEY = '_sort_key'
+
+# ################################################################################################ #
+# Mark: - Functions
+
+def grid(x:np.ndarray, y:np.ndarray, order:int, extent:tuple = (-180.0, -90.0, 180.0, 90.0)):
+    ''' Place points on a 2^order square grid over the extent, missing values go to cell 0. '''
+    side = 1 << order
+    cells = []
+    for values, low, high in [(x, extent[0], extent[2]), (y, extent[1], extent[3])]:
+        scaled = np.nan_to_num((values - low) / (high - low) * side, nan=0.0)
+        cells.append(np.clip(scaled, 0, side - 1).astype(np.uint64))
+    return cells[0], cells[1]
+
+def hilbert_key(x:np.ndarray, y:np.ndarray, order:int = 16) -> np.ndarray:
+    ''' Distance along a Hilbert curve for each point, done one bit at a time for all points. '''
+    xi, yi = grid(x, y, order)
+    side = np.uint64(1 << order)
+    key = np.zeros(len(xi), dtype=np.uint64)
+    s = side >> np.uint64(1)
+    while s > 0:
+        rx = (xi & s) > 0
+        ry = (yi & s) > 0
+        key += s * s * ((3 * rx.astype(np.uint64)) ^ ry.astype(np.uint64))
+        # rotate the quadrant so the curve lines up with the next level
+        flip = ~ry & rx
+        xi = np.where(flip, side - np.uint64(1) - xi, xi)
+        yi = np.where(flip, side - np.uint64(1) - yi, yi)
+        swap = ~ry
+        xi, yi = np.where(swap, yi, xi), np.where(swap, xi, yi)
+        s = s >> np.uint64(1)
+    return key
+
+def _spread(values:np.ndarray) -> np.ndarray:
+    ''' Put a zero bit between each of the low 32 bits. '''
+    values = values & np.uint64(0x00000000FFFFFFFF)
+    for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+        (2, 0x3333333333333333), (1, 0x5555555555555555)]:
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+def morton_key(x:np.ndarray, y:np.ndarray, order:int = 16) -> np.ndarray:
+    ''' Z order key, the bits of the x and y grid cells interleaved. '''
+    xi, yi = grid(x, y, order)
+    return _spread(xi) | (_spread(yi) << np.uint64(1))
+
+CURVES = {'hilbert': hilbert_key, 'morton': morton_key}
+
+def center_key(table:pa.Table, curve:str = 'hilbert', order:int = 16) -> np.ndarray:
+    ''' Curve key from the center of each envelope in the bbox column. '''
+    bbox = table.column('bbox')
+    parts = {}
+    for name in ['xmin', 'ymin', 'xmax', 'ymax']:
+        parts[name] = pc.struct_field(bbox, name).to_numpy(zero_copy_only=False).astype(np.float64)
+    x = geoparquet.center_x(parts['xmin'], parts['xmax'])
+    y = (parts['ymin'] + parts['ymax']) / 2
+    return CURVES[curve](x, y, order)
+
+def write_runs(batches, key_function, run_rows:int, directory:str) -> list[str]:
+    '''
+    Collect batches until run_rows, sort them by the key, and write each run out. key_function is
+    given a table and returns a key array, the table it gives back is what gets stored.
+    Returns the paths of the runs.
+    '''
+    runs = []
+    pending = []
+    pending_rows = 0
+
+    def spill():
+        table = pa.concat_tables(pending)
+        table = table.take(pc.sort_indices(table, sort_keys=[(KEY, 'ascending')]))
+        path = os.path.join(directory, f"run_{len(runs):05d}.parquet")
+        pq.write_table(table, path, row_group_size=64 * 1024, compression='lz4')
+        runs.append(path)
+
+    for batch in batches:
+        table, keys = key_function(pa.Table.from_batches([batch]) if isinstance(batch,
+            pa.RecordBatch) else batch)
+        pending.append(table.append_column(KEY, pa.array(keys)))
+        pending_rows += table.num_rows
+        if pending_rows >= run_rows:
+            spill()
+            pending, pending_rows = [], 0
+    if pending:
+        spill()
+    return runs
+
+def merge_sorted(sources:list, key:str = KEY):
+    '''
+    Generator of tables in key order from sources, each an iterator of tables already sorted by the
+    key column. Each round takes the smallest last key of the tables in hand, everything at or below
+    it can safely go out as no unread row is smaller. Memory holds about one table per source.
+    '''
+    sources = [iter(source) for source in sources]
+    heads = [None] * len(sources)
+
+    def refill(index):
+        while heads[index] is None or heads[index].num_rows == 0:
+            table = next(sources[index], None)
+            if table is None:
+                heads[index] = None
+                return
+            if table.column(key).null_count:
+                raise ValueError(f"Can not merge on {key}, it has null values.")
+            heads[index] = table
+
+    for index in range(len(sources)):
+        refill(index)
+    while any(head is not None for head in heads):
+        live = [index for index, head in enumerate(heads) if head is not None]
+        limit = min(heads[index].column(key).slice(heads[index].num_rows - 1).to_numpy()[0]
+            for index in live)
+        taken = []
+        for index in live:
+            keys = heads[index].column(key).to_numpy()
+            cut = int(np.searchsorted(keys, limit, side='right'))
+            if cut > 0:
+                taken.append(heads[index].slice(0, cut))
+                heads[index] = heads[index].slice(cut)
+                refill(index)
+        table = pa.concat_tables(taken)
+        yield table.take(pc.sort_indices(table, sort_keys=[(key, 'ascending')]))
+
+def merge_runs(runs:list[str], batch_rows:int = 64 * 1024):
+    ''' Generator of tables in key order from sorted run files. '''
+    sources = []
+    for path in runs:
+        batches = pq.ParquetFile(path).iter_batches(batch_size=batch_rows)
+        sources.append(pa.Table.from_batches([batch]) for batch in batches)
+    yield from merge_sorted(sources)
+
+def external_sort(source:str, key_function, run_rows:int = 2_000_000,
+    batch_rows:int = 64 * 1024, directory:str = None):
+    '''
+    Sort a parquet file or directory of files by key, yielding tables in order with the key column
+    removed. Runs are kept in a temporary directory which is removed at the end.
+    '''
+    with tempfile.TemporaryDirectory(dir=directory, prefix='sort_runs_') as temp:
+        batches = ds.dataset(source, format='parquet').to_batches(batch_size=batch_rows)
+        runs = write_runs(batches, key_function, run_rows, temp)
+        for table in merge_runs(runs, batch_rows):
+            yield table.drop_columns([KEY])
+
+# ################################################################################################ #
+# testing
+
+def curve_test():
+    ''' Keys fill the grid once each and neighbors on the Hilbert curve are neighbors on the grid. '''
+    order = 3
+    side = 1 << order
+    cell = 360 / side, 180 / side
+    xs, ys = np.meshgrid(np.arange(side), np.arange(side))
+    x = -180 + (xs.ravel() + 0.5) * cell[0]
+    y = -90 + (ys.ravel() + 0.5) * cell[1]
+    for function in CURVES.values():
+        keys = function(x, y, order)
+        assert sorted(keys.tolist()) == list(range(side * side))
+    keys = hilbert_key(x, y, order)
+    path = np.argsort(keys)
+    steps = np.abs(np.diff(xs.ravel()[path])) + np.abs(np.diff(ys.ravel()[path]))
+    assert (steps == 1).all()
+
+def sort_test():
+    ''' Merged runs come out in key order with nothing lost. '''
+    values = (np.arange(10_000) * 7919) % 10007
+    table = pa.table({'value': values})
+    with tempfile.TemporaryDirectory() as temp:
+        runs = write_runs(table.to_batches(max_chunksize=1000),
+            lambda t: (t, t.column('value').to_numpy()), 3000, temp)
+        assert len(runs) == 4
+        merged = pa.concat_tables(merge_runs(runs, batch_rows=700))
+    assert merged.column(KEY).to_pylist() == sorted(values.tolist())
+
+#curve_test()
+#sort_test()
@@ -0,0 +1,95 @@
+'''
+Read the parquet footers of a whole dataset, which can be a file, a directory, a glob, or an S3
+prefix. Footers are read by a pool of threads since most of the time is spent waiting on storage,
+and each parsed footer is kept in a cache directory under a fingerprint of the path, size, and
+modification time, so a file is only read again after it changes.
+'''
+
+import concurrent.futures
+import fnmatch
+import glob
+import hashlib
+import os
+
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+# ################################################################################################ #
+# Mark: - Functions
+
+def filesystem_for(path:str, endpoint:str = None) -> tuple[pafs.FileSystem, str]:
+    ''' The filesystem for a path and the path as that filesystem wants it. '''
+    if path.startswith('s3://'):
+        options = {}
+        if endpoint:
+            # an S3 compatible server such as tester/util/s3_local.py, which ignores the keys
+            options = {'endpoint_override': endpoint, 'scheme': 'http', 'access_key': 'bigstac',
+                'secret_key': 'bigstac', 'region': 'us-east-1'}
+        return pafs.S3FileSystem(**options), path[len('s3://'):]
+    return pafs.LocalFileSystem(), os.path.abspath(os.path.expanduser(path))
+
+def expand(path:str, endpoint:str = None) -> tuple[pafs.FileSystem, list[pafs.FileInfo]]:
+    ''' Every parquet file for a file, directory, or glob, local or on S3. '''
+    filesystem, where = filesystem_for(path, endpoint)
+    if isinstance(filesystem, pafs.LocalFileSystem) and glob.has_magic(where):
+        infos = filesystem.get_file_info(sorted(glob.glob(where, recursive=True)))
+    elif glob.has_magic(where):
+        # list from the part of the path before the first wild card and then match
+        prefix = where[:min(where.find(char) for char in '*?[' if char in where)]
+        base = prefix.rsplit('/', 1)[0]
+        selector = pafs.FileSelector(base, recursive=True)
+        infos = [info for info in filesystem.get_file_info(selector)
+            if fnmatch.fnmatch(info.path, where)]
+    else:
+        info = filesystem.get_file_info(where)
+        if info.type == pafs.FileType.Directory:
+            selector = pafs.FileSelector(where, recursive=True)
+            infos = [item for item in filesystem.get_file_info(selector)
+                if item.path.endswith('.parquet')]
+        else:
+            infos = [info]
+    infos = [info for info in infos if info.type == pafs.FileType.File]
+    return filesystem, sorted(infos, key=lambda info: info.path)
+
+def fingerprint(info:pafs.FileInfo) -> str:
+    ''' Key for the cache, any change to the file changes its size or time. '''
+    return f"{info.path}|{info.size}|{info.mtime_ns}"
+
+def read_footer(filesystem:pafs.FileSystem, info:pafs.FileInfo, cache:str = None):
+    ''' The FileMetaData of one file, from the cache when there is a copy for this fingerprint. '''
+    cached = None
+    if cache:
+        name = hashlib.sha1(fingerprint(info).encode('utf-8')).hexdigest()
+        cached = os.path.join(cache, f"{name}.footer")
+        if os.path.exists(cached):
+            return pq.read_metadata(cached)
+    metadata = pq.read_metadata(info.path, filesystem=filesystem)
+    if cached:
+        temp = f"{cached}.{os.getpid()}.tmp"
+        metadata.write_metadata_file(temp)
+        os.replace(temp, cached)
+    return metadata
+
+def read_footers(path:str, workers:int = 16, cache:str = None, endpoint:str = None) -> dict:
+    ''' Footers of every file in a dataset, keyed by file path and in path order. '''
+    filesystem, infos = expand(path, endpoint)
+    if cache:
+        os.makedirs(cache, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        found = pool.map(lambda info: read_footer(filesystem, info, cache), infos)
+        return {info.path: metadata for info, metadata in zip(infos, found)}
+
+def summarize(footers:dict) -> dict:
+    ''' Totals over a dataset. '''
+    group_rows = [meta.row_group(i).num_rows for meta in footers.values()
+        for i in range(meta.num_row_groups)]
+    group_rows.sort()
+    return {'files': len(footers),
+        'rows': sum(meta.num_rows for meta in footers.values()),
+        'row_groups': len(group_rows),
+        'bytes': sum(meta.row_group(i).total_byte_size for meta in footers.values()
+            for i in range(meta.num_row_groups)),
+        'footer_bytes': sum(meta.serialized_size for meta in footers.values()),
+        'group_rows_min': group_rows[0] if group_rows else 0,
+        'group_rows_median': group_rows[len(group_rows) // 2] if group_rows else 0,
+        'group_rows_max': group_rows[-1] if group_rows else 0}
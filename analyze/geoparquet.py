@@ -0,0 +1,368 @@
+'''
+Shared helpers for the tools that rewrite geo parquet files. Geometry is handled as whole columns with
+the vectorized shapely 2 functions, never one row at a time, and files are written with GeoParquet
+1.1 metadata, a bbox covering column, and row groups of exactly the size asked for.
+
+Geometry is stored as WKB or as GeoArrow native coordinates (the 'geoarrow' encoding), which keeps x
+and y in their own float columns inside nested lists so readers do not have to parse WKB. Native
+columns here always use the multi type of the geometry family, multipolygon for example, so every
+batch of a file has the same schema.
+'''
+
+import json
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import shapely
+
+COARSE = 'geometry_coarse'
+VERTICES = 'vertex_count'
+
+BBOX_TYPE = pa.struct([('xmin', pa.float64()), ('ymin', pa.float64()), ('xmax', pa.float64()),
+    ('ymax', pa.float64())])
+
+# ################################################################################################ #
+# Mark: - Functions
+
+# GeoArrow multi encodings by how deeply the coordinates are nested in lists
+NATIVE = {1: 'multipoint', 2: 'multilinestring', 3: 'multipolygon'}
+NATIVE_TYPES = {'multipoint': shapely.GeometryType.MULTIPOINT,
+    'multilinestring': shapely.GeometryType.MULTILINESTRING,
+    'multipolygon': shapely.GeometryType.MULTIPOLYGON}
+# type id of each single and multi geometry to its multi encoding
+FAMILIES = {0: 'multipoint', 4: 'multipoint', 1: 'multilinestring', 5: 'multilinestring',
+    3: 'multipolygon', 6: 'multipolygon'}
+CHILDREN = {'multipoint': ['points'], 'multilinestring': ['linestrings', 'vertices'],
+    'multipolygon': ['polygons', 'rings', 'vertices']}
+
+def list_depth(data_type:pa.DataType) -> int:
+    ''' How many lists wrap the values of a type. '''
+    depth = 0
+    while pa.types.is_list(data_type) or pa.types.is_large_list(data_type):
+        data_type = data_type.value_type
+        depth += 1
+    return depth
+
+def encoding_of(data_type:pa.DataType) -> str:
+    ''' GeoParquet encoding name for a geometry column type. '''
+    if pa.types.is_binary(data_type) or pa.types.is_large_binary(data_type):
+        return 'WKB'
+    return NATIVE[list_depth(data_type)]
+
+def to_geoarrow(geometry:np.ndarray) -> pa.Array:
+    '''
+    GeoArrow native array for geometry of one family, single types are promoted to the multi type.
+    Mixed families, like points with polygons, can not be stored natively and raise ValueError.
+    '''
+    missing = shapely.is_missing(geometry)
+    kinds = np.unique(shapely.get_type_id(geometry[~missing]))
+    families = {FAMILIES.get(int(item)) for item in kinds}
+    if None in families or len(families) > 1:
+        raise ValueError(f"GeoArrow needs one geometry family, found {sorted(map(str, families))}")
+    encoding = families.pop() if families else 'multipolygon'
+    target = NATIVE_TYPES[encoding]
+    promote = ~missing & (shapely.get_type_id(geometry) != target)
+    geometry = geometry.copy()
+    if promote.any():
+        make = {'multipoint': shapely.multipoints, 'multilinestring': shapely.multilinestrings,
+            'multipolygon': shapely.multipolygons}[encoding]
+        geometry[promote] = make(geometry[promote], indices=np.arange(np.count_nonzero(promote)))
+    geometry[missing] = shapely.from_wkt(f"{encoding.upper()} EMPTY")
+    _, coords, offsets = shapely.to_ragged_array(geometry, include_z=False)
+    array = pa.StructArray.from_arrays([pa.array(coords[:, 0]), pa.array(coords[:, 1])],
+        names=['x', 'y'])
+    names = CHILDREN[encoding]
+    for depth, offset in enumerate(offsets):
+        name = names[len(names) - 1 - depth]
+        mask = pa.array(missing) if depth == len(offsets) - 1 else None
+        array = pa.ListArray.from_arrays(pa.array(offset, type=pa.int32()), array,
+            type=pa.list_(pa.field(name, array.type, nullable=False)), mask=mask)
+    return array
+
+def from_geoarrow(column:pa.Array) -> np.ndarray:
+    ''' Shapely geometry array from a GeoArrow native multi type column. '''
+    encoding = encoding_of(column.type)
+    offsets = []
+    values = column
+    for _ in range(list_depth(column.type)):
+        # flatten only keeps the children this (maybe sliced) array uses, so offsets start at 0
+        found = values.offsets.to_numpy()
+        offsets.append(found - found[0])
+        values = values.flatten()
+    coords = np.column_stack([values.field('x').to_numpy(zero_copy_only=False),
+        values.field('y').to_numpy(zero_copy_only=False)])
+    geometry = shapely.from_ragged_array(NATIVE_TYPES[encoding], coords, tuple(reversed(offsets)))
+    geometry[column.is_null().to_numpy(zero_copy_only=False)] = None
+    return geometry
+
+def to_geometry(column:pa.Array|pa.ChunkedArray) -> np.ndarray:
+    ''' Shapely geometry array from a WKB (binary), WKT (string), or GeoArrow arrow column. '''
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if list_depth(column.type):
+        return from_geoarrow(column)
+    values = column.to_numpy(zero_copy_only=False)
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return shapely.from_wkt(values, on_invalid='ignore')
+    return shapely.from_wkb(values, on_invalid='ignore')
+
+def crossing_of(table:pa.Table) -> np.ndarray:
+    ''' Rows the harvester marked as crossing the antimeridian, None if the table does not say. '''
+    if 'MBRCrossesAntimeridian' not in table.column_names:
+        return None
+    return pc.fill_null(table.column('MBRCrossesAntimeridian'), False).to_numpy()
+
+def unwrap(geometry:np.ndarray) -> np.ndarray:
+    ''' Move the western hemisphere 360 degrees east so shapes over the antimeridian are whole. '''
+    return shapely.transform(geometry,
+        lambda coords: np.column_stack([np.where(coords[:, 0] < 0, coords[:, 0] + 360.0,
+            coords[:, 0]), coords[:, 1]]))
+
+def around_globe(geometry:np.ndarray) -> np.ndarray:
+    '''
+    Mask of shapes whose parts between them cover every longitude, such as a polar cap from -180 to
+    180. Unwrapping one of these folds it onto itself, so it is left as it is. The parts of a shape
+    already cut by split_antimeridian() touch both -180 and 180 but leave a gap, so they are not.
+    '''
+    parts, index = shapely.get_parts(geometry, return_index=True)
+    bounds = shapely.bounds(parts)
+    order = np.lexsort((bounds[:, 0], index))
+    index, west, east = index[order], bounds[order, 0], bounds[order, 2]
+    # furthest east reached so far in each shape, shifted so one shape never reaches into the next
+    shift = index * 1000.0
+    reach = np.maximum.accumulate(east + shift) - shift
+    first = np.r_[True, index[1:] != index[:-1]]
+    last = np.r_[index[1:] != index[:-1], True]
+    gap = np.r_[False, west[1:] > reach[:-1]] & ~first
+    out = np.zeros(len(geometry), dtype=bool)
+    out[index[first]] = west[first] <= -180.0
+    out[index[last]] &= reach[last] >= 180.0
+    out &= np.bincount(index, weights=gap, minlength=len(geometry)) == 0
+    return out
+
+def unwrappable(geometry:np.ndarray, crossing:np.ndarray) -> np.ndarray:
+    ''' Index of the crossing rows which can be unwrapped, those not going around the globe. '''
+    rows = np.flatnonzero(crossing)
+    return rows[~around_globe(geometry[rows])]
+
+def split_antimeridian(geometry:np.ndarray, crossing:np.ndarray) -> np.ndarray:
+    '''
+    Cut the crossing shapes at the antimeridian into a part on each side. The harvester wraps their
+    longitudes, which in planar terms makes a Pacific swath a band around the whole globe. Shapes
+    going all the way around the globe are kept whole.
+    '''
+    out = geometry.copy()
+    if crossing is None or not crossing.any():
+        return out
+    rows = unwrappable(geometry, crossing)
+    whole = unwrap(geometry[rows])
+    east = shapely.intersection(whole, shapely.box(-180.0, -90.0, 180.0, 90.0))
+    west = shapely.transform(shapely.intersection(whole, shapely.box(180.0, -90.0, 540.0, 90.0)),
+        lambda coords: coords - [360.0, 0.0])
+    out[rows] = shapely.union(east, west)
+    return out
+
+def envelopes(geometry:np.ndarray, crossing:np.ndarray = None) -> np.ndarray:
+    '''
+    xmin, ymin, xmax, ymax for each geometry as an n by 4 array, NaN for missing geometry. Rows in
+    crossing get xmin > xmax as GeoParquet allows for the antimeridian, so their envelope only spans
+    the two sides of the date line and not the whole globe, unless the shape goes all the way round.
+    '''
+    bounds = shapely.bounds(geometry)
+    if crossing is None or not crossing.any():
+        return bounds
+    rows = unwrappable(geometry, crossing)
+    wide = shapely.bounds(unwrap(geometry[rows]))
+    wide[:, [0, 2]] = np.where(wide[:, [0, 2]] > 180.0, wide[:, [0, 2]] - 360.0, wide[:, [0, 2]])
+    bounds[rows] = wide
+    return bounds
+
+def center_x(xmin:np.ndarray, xmax:np.ndarray) -> np.ndarray:
+    ''' Longitude half way across each envelope, taking xmin > xmax to cross the antimeridian. '''
+    center = (xmin + np.where(xmin > xmax, xmax + 360.0, xmax)) / 2
+    return np.where(center > 180.0, center - 360.0, center)
+
+def bbox_struct(bounds:np.ndarray) -> pa.StructArray:
+    ''' A GeoParquet 1.1 bbox covering column from an n by 4 bounds array. '''
+    missing = np.isnan(bounds[:, 0])
+    fields = [pa.array(bounds[:, index], mask=missing) for index in range(4)]
+    return pa.StructArray.from_arrays(fields, fields=list(BBOX_TYPE), mask=pa.array(missing))
+
+def geo_metadata(geometry_types:list = None, covering:bool = True, encoding:str = 'WKB',
+    others:list = None) -> bytes:
+    '''
+    GeoParquet 1.1 file metadata for a geometry column, the CRS is left off which means OGC:CRS84.
+    An empty geometry_types list is allowed by the spec and means the types are not known. others
+    are the names of any more WKB geometry columns, such as the coarse column.
+    '''
+    column = {'encoding': encoding, 'geometry_types': sorted(geometry_types or [])}
+    if covering:
+        column['covering'] = {'bbox': {name: ['bbox', name] for name in BBOX_TYPE.names}}
+    geo = {'version': '1.1.0', 'primary_column': 'geometry', 'columns': {'geometry': column}}
+    for name in others or []:
+        geo['columns'][name] = {'encoding': 'WKB', 'geometry_types': []}
+    return json.dumps(geo).encode('utf-8')
+
+def prepare(table:pa.Table, covering:bool = True, encoding:str = 'WKB') -> pa.Table:
+    '''
+    Make a table ready to write as GeoParquet, geometry becomes WKB, or GeoArrow native when
+    encoding is 'geoarrow', and the bbox column is rebuilt from the geometry, with xmin > xmax for
+    rows marked as crossing the antimeridian. Rows keep their order.
+    '''
+    geometry = to_geometry(table.column('geometry'))
+    if encoding == 'geoarrow':
+        stored = to_geoarrow(geometry)
+    else:
+        stored = pa.array(shapely.to_wkb(geometry), type=pa.binary())
+    table = table.set_column(table.schema.get_field_index('geometry'), 'geometry', stored)
+    if 'bbox' in table.column_names:
+        table = table.drop_columns(['bbox'])
+    if covering:
+        table = table.append_column('bbox', bbox_struct(envelopes(geometry, crossing_of(table))))
+    return table
+
+def coarsen(geometry:np.ndarray, tolerance:float = 0.05, method:str = 'simplify') -> np.ndarray:
+    '''
+    A cheap stand in for each geometry which is sure to cover it, so anything missing the coarse
+    shape also misses the real one. simplify grows the shape by tolerance and then simplifies by the
+    same amount, hull is the convex hull. Any result that does not cover the original is replaced by
+    the convex hull, and the original is kept when that still fails, as it can for invalid shapes, or
+    when the coarse shape would not have fewer vertices.
+    '''
+    if method == 'hull':
+        coarse = shapely.convex_hull(geometry)
+    else:
+        grown = shapely.buffer(geometry, tolerance, quad_segs=2, join_style='mitre')
+        coarse = shapely.simplify(grown, tolerance, preserve_topology=True)
+    missed = ~shapely.covers(coarse, geometry)
+    coarse[missed] = shapely.convex_hull(geometry[missed])
+    keep = ~shapely.covers(coarse, geometry)
+    keep |= shapely.get_num_coordinates(coarse) >= shapely.get_num_coordinates(geometry)
+    return np.where(keep, geometry, coarse)
+
+def add_coarse(table:pa.Table, tolerance:float = 0.05, method:str = 'simplify') -> pa.Table:
+    ''' Add or replace the coarse geometry column and the vertex count of the full geometry. '''
+    geometry = to_geometry(table.column('geometry'))
+    table = table.drop_columns([name for name in [COARSE, VERTICES] if name in table.column_names])
+    coarse = coarsen(geometry, tolerance, method)
+    table = table.append_column(COARSE, pa.array(shapely.to_wkb(coarse), type=pa.binary()))
+    counts = shapely.get_num_coordinates(geometry).astype(np.int32)
+    return table.append_column(VERTICES, pa.array(counts, mask=shapely.is_missing(geometry)))
+
+WRITER_KEYS = ['compression', 'compression_level', 'use_dictionary', 'column_encoding',
+    'use_byte_stream_split', 'data_page_size', 'write_page_index', 'write_statistics']
+
+def writer_options(path:str = None, **defaults) -> dict:
+    '''
+    ParquetWriter options from a JSON writer config, like the one made by `tune.py -a compression`,
+    over the defaults given. The config keys are ParquetWriter arguments, so per column choices are
+    given the way pyarrow takes them, such as {"column_encoding": {"MBRWest": "BYTE_STREAM_SPLIT"}}.
+    '''
+    options = dict(defaults)
+    if path:
+        with open(path, 'r', encoding='utf-8') as file:
+            config = json.load(file)
+        unknown = set(config) - set(WRITER_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown writer config keys {sorted(unknown)} in {path}")
+        options.update(config)
+    return options
+
+class GeoParquetWriter():
+    '''
+    Wrap a ParquetWriter so every row group has exactly row_group_size rows, except the last, no
+    matter how the tables given to write() are sized. GeoParquet metadata is put in the schema up
+    front as readers do not look at metadata added after the file is opened.
+    '''
+
+    def __init__(self, path:str, schema:pa.Schema, row_group_size:int = 100_000,
+        geometry_types:list = None, covering:bool = True, **options):
+        '''
+        options are passed on to pyarrow.parquet.ParquetWriter, like compression. A page index is
+        written unless write_page_index=False is given, so readers can skip pages inside a row group.
+        '''
+        options.setdefault('write_page_index', True)
+        metadata = dict(schema.metadata or {})
+        others = [name for name in [COARSE] if name in schema.names]
+        encoding = encoding_of(schema.field('geometry').type)
+        metadata[b'geo'] = geo_metadata(geometry_types, covering, encoding, others)
+        self.schema = schema.with_metadata(metadata)
+        self.row_group_size = row_group_size
+        self.writer = pq.ParquetWriter(path, self.schema, **options)
+        self.pending = []
+        self.pending_rows = 0
+        self.rows = 0
+
+    def write(self, table:pa.Table):
+        ''' Buffer rows and write out every full row group. '''
+        self.pending.append(table.replace_schema_metadata(self.schema.metadata))
+        self.pending_rows += table.num_rows
+        if self.pending_rows >= self.row_group_size:
+            buffered = pa.concat_tables(self.pending)
+            full = (buffered.num_rows // self.row_group_size) * self.row_group_size
+            self.writer.write_table(buffered.slice(0, full), row_group_size=self.row_group_size)
+            self.pending = [buffered.slice(full)]
+            self.pending_rows = buffered.num_rows - full
+            self.rows += full
+
+    def close(self):
+        ''' Write any remaining rows as the last row group and close the file. '''
+        if self.pending_rows > 0:
+            self.writer.write_table(pa.concat_tables(self.pending),
+                row_group_size=self.row_group_size)
+            self.rows += self.pending_rows
+        self.pending = []
+        self.pending_rows = 0
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def rewrite(source:str, output:str, row_group_size:int, batch_rows:int = 64 * 1024,
+    covering:bool = True, encoding:str = 'WKB', **options) -> int:
+    '''
+    Copy a file, or directory of files, to one file with aligned row groups and GeoParquet
+    metadata, returns rows written. options are passed on to pyarrow.parquet.ParquetWriter.
+    '''
+    schema = None
+    writer = None
+    for batch in ds.dataset(source, format='parquet').to_batches(batch_size=batch_rows):
+        table = prepare(pa.Table.from_batches([batch]), covering, encoding)
+        if writer is None:
+            schema = table.schema
+            writer = GeoParquetWriter(output, schema, row_group_size, covering=covering, **options)
+        writer.write(table)
+    if writer is None:
+        return 0
+    writer.close()
+    return writer.rows
+
+# ################################################################################################ #
+# testing
+
+def antimeridian_test():
+    ''' Split swaths keep a narrow envelope over the date line and polar caps stay whole. '''
+    swath = shapely.from_wkt('POLYGON ((170 10, -170 10, -170 20, 170 20, 170 10))')
+    cap = shapely.from_wkt('POLYGON ((-180 60, 0 60, 180 60, 180 90, -180 90, -180 60))')
+    pair = shapely.from_wkt('MULTIPOLYGON (((170 0, 180 0, 180 5, 170 5, 170 0)), '
+        '((100 0, 110 0, 110 5, 100 5, 100 0)))')
+    geometry = np.array([swath, cap, pair, None])
+    crossing = np.array([True, True, True, False])
+    assert around_globe(geometry).tolist() == [False, True, False, False]
+    split = split_antimeridian(geometry, crossing)
+    assert shapely.get_num_geometries(split[0]) == 2
+    assert shapely.equals(split[1], cap)
+    for shapes in [geometry, split]:
+        bounds = envelopes(shapes, crossing)
+        assert bounds[0].tolist() == [170.0, 10.0, -170.0, 20.0]
+        assert bounds[1].tolist() == [-180.0, 60.0, 180.0, 90.0]
+        assert np.isnan(bounds[3]).all()
+    assert not around_globe(split[:1]).any()
+
+#antimeridian_test()
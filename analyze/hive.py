@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+'''
+Repartition a dataset into a hive style directory layout, such as
+provider=LPCLOUD/collection=C123-LPCLOUD/year=2020/month=01/part-0.parquet, so a reader given
+hive_partitioning can skip every directory a query's collection or time range rules out.
+
+The layout is a comma list of name=column or name=column:format, where format is a strftime pattern
+taken from a time column (StartTime can be a timestamp or an ISO string). The same layout can be
+given to the tester as the hive_partitioning setting of a suite so it can add partition predicates.
+
+The data is read in two passes. The first reads only the layout columns to count the rows in each
+partition, which sets the rows in each file so no partition gets more than --max-files files. The
+second streams batches through pyarrow's dataset writer, which writes row groups of
+--row-group-size rows. The writer closes a file when it has --max-open open and starts another if
+that partition gets more rows, so when there are more partitions than --max-open they are written
+--max-open at a time, each group in its own pass over the input. Columns used as plain levels are
+filtered in the scan so a pass only reads the files which can hold its partitions.
+
+Readers given hive_partitioning get the partition columns, such as provider and year, as extra
+columns, the tester leaves them out of SELECT * so results match the same data unpartitioned.
+
+example run:
+
+ ./hive.py '../data/*.parquet' -o ../data/hive --max-files 4 --target-rows 1000000
+'''
+
+import argparse
+import collections
+import json
+import math
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+import geoparquet
+import merge
+
+DEFAULT_LAYOUT = ('provider=ProviderId,collection=CollectionConceptId,year=StartTime:%Y,'
+    'month=StartTime:%m')
+
+# ################################################################################################ #
+# Mark: - Functions
+
+def parse_layout(text:str) -> list[tuple]:
+    ''' (name, column, format) for each level of a layout, format is None for plain columns. '''
+    levels = []
+    for item in text.split(','):
+        name, _, source = item.strip().partition('=')
+        column, _, pattern = source.partition(':')
+        levels.append((name, column or name, pattern or None))
+    return levels
+
+def as_time(column:pa.Array) -> pa.Array:
+    ''' A timestamp array from a timestamp or ISO 8601 string column. '''
+    if pa.types.is_timestamp(column.type) or pa.types.is_date(column.type):
+        return column
+    # the first 19 characters, YYYY-MM-DDTHH:MM:SS, cast without caring about zones or fractions
+    return pc.cast(pc.utf8_slice_codeunits(column, 0, 19), pa.timestamp('s'))
+
+def partition_values(table:pa.Table, levels:list[tuple]) -> dict:
+    ''' The value of each level for each row as string arrays. '''
+    out = {}
+    for name, column, pattern in levels:
+        values = table.column(column)
+        if pattern:
+            out[name] = pc.strftime(as_time(values), format=pattern)
+        else:
+            out[name] = pc.cast(values, pa.string())
+    return out
+
+def partition_keys(values:dict) -> pa.Array:
+    ''' One string for each row naming its partition, the level values joined by /. '''
+    return pc.binary_join_element_wise(*values.values(), '/', null_handling='replace')
+
+def count_partitions(source:list[str], levels:list[tuple]) -> collections.Counter:
+    ''' Rows in each partition, reading only the columns the layout needs. '''
+    columns = sorted({column for _, column, _ in levels})
+    counts = collections.Counter()
+    for batch in ds.dataset(source, format='parquet').to_batches(columns=columns):
+        values = partition_values(pa.Table.from_batches([batch]), levels)
+        keys = pa.table(values).group_by(list(values)).aggregate([([], 'count_all')])
+        for item in keys.to_pylist():
+            counts[tuple(item[name] for name, _, _ in levels)] += item['count_all']
+    return counts
+
+def group_filter(levels:list[tuple], group:list[tuple]) -> ds.Expression:
+    ''' Scan filter on the plain column levels which keeps every row of a group of partitions. '''
+    found = None
+    for index, (_, column, pattern) in enumerate(levels):
+        if pattern is None:
+            test = ds.field(column).isin(sorted({key[index] for key in group}))
+            found = test if found is None else found & test
+    return found
+
+def partitioned_batches(source:list[str], levels:list[tuple], args:argparse.Namespace,
+    group:list[tuple] = None):
+    '''
+    Batches ready to write, with the partition columns added on. With a group of partition keys
+    only the rows in those partitions are given.
+    '''
+    scan = ds.dataset(source, format='parquet')
+    wanted = None
+    where = None
+    if group is not None:
+        wanted = pa.array(['/'.join(item or '' for item in key) for key in group])
+        where = group_filter(levels, group)
+    for batch in scan.to_batches(batch_size=args.batch_rows, filter=where):
+        table = pa.Table.from_batches([batch])
+        values = partition_values(table, levels)
+        if wanted is not None:
+            keep = pc.is_in(partition_keys(values), value_set=wanted)
+            table = table.filter(keep)
+            values = {name: item.filter(keep) for name, item in values.items()}
+        if table.num_rows == 0:
+            continue
+        table = geoparquet.prepare(table, encoding=args.encoding)
+        for name, item in values.items():
+            table = table.append_column(name, item)
+        yield from table.to_batches()
+
+def repartition(args:argparse.Namespace) -> str:
+    ''' Write the input as a hive layout and report what was written. '''
+    mark_start = time.time()
+    source = merge.find_inputs([args.source])
+    if not source:
+        return f"No parquet files found at {args.source}."
+    levels = parse_layout(args.layout)
+    counts = count_partitions(source, levels)
+    if not counts:
+        return "No rows found."
+    file_rows = max(args.target_rows, math.ceil(max(counts.values()) / args.max_files))
+    file_rows = math.ceil(file_rows / args.row_group_size) * args.row_group_size
+
+    names = [name for name, _, _ in levels]
+    partitioning = ds.partitioning(pa.schema([(name, pa.string()) for name in names]),
+        flavor='hive')
+    options = geoparquet.writer_options(args.writer_config, compression=args.compression)
+    file_format = ds.ParquetFileFormat()
+    written = []
+
+    def remember(found):
+        written.append(found.path)
+
+    # a pass for every --max-open partitions, so the writer never has to close a file early
+    keys = sorted(counts, key=lambda key: tuple(item or '' for item in key))
+    groups = [None]
+    if len(keys) > args.max_open:
+        groups = [keys[start:start + args.max_open] for start in range(0, len(keys), args.max_open)]
+    for group in groups:
+        batches = partitioned_batches(source, levels, args, group)
+        first = next(batches, None)
+        if first is None:
+            continue
+        metadata = dict(first.schema.metadata or {})
+        metadata[b'geo'] = geoparquet.geo_metadata(
+            encoding=geoparquet.encoding_of(first.schema.field('geometry').type))
+        schema = first.schema.with_metadata(metadata)
+        ds.write_dataset(
+            (batch.replace_schema_metadata(metadata) for batch in [first, *batches]),
+            args.output, schema=schema, format=file_format,
+            file_options=file_format.make_write_options(**options),
+            partitioning=partitioning, basename_template='part-{i}.parquet',
+            max_rows_per_file=file_rows, min_rows_per_group=args.row_group_size,
+            max_rows_per_group=args.row_group_size, max_open_files=args.max_open,
+            max_partitions=max(1024, len(counts)),
+            existing_data_behavior='overwrite_or_ignore', file_visitor=remember)
+
+    with open(f"{args.output}/_layout.json", 'w', encoding='utf-8') as file:
+        json.dump({name: f"{column}:{pattern}" if pattern else column
+            for name, column, pattern in levels}, file, indent=2)
+    per_partition = collections.Counter(path.rsplit('/', 1)[0] for path in written)
+    most = max(per_partition.values())
+    report = (f"Wrote {sum(counts.values())} rows into {len(counts)} partitions and "
+        f"{len(written)} files (at most {most} in one partition, {file_rows} rows per file) in "
+        f"{len(groups)} passes and {time.time() - mark_start:.1f}s")
+    if most > args.max_files:
+        over = sum(1 for found in per_partition.values() if found > args.max_files)
+        report += f"\nWARNING: {over} partitions have more than --max-files {args.max_files} files"
+    return report
+
+# ################################################################################################ #
+# Mark: - Command functions
+
+def handle_args() -> argparse.Namespace:
+    ''' Process all the command line arguments and return an argparse Namespace object. '''
+    parser = argparse.ArgumentParser(description="Repartition parquet into a hive layout")
+
+    # Add command-line arguments
+    parser.add_argument("source", help='Parquet file, directory, or glob to repartition.')
+    parser.add_argument("-o", "--output", required=True, help='Directory for the hive layout.')
+    parser.add_argument("-l", "--layout", default=DEFAULT_LAYOUT,
+        help='Comma list of name=column or name=column:strftime levels.')
+    parser.add_argument("--max-files", default=8, type=int,
+        help='Most files to write in any one partition.')
+    parser.add_argument("--target-rows", default=1_000_000, type=int,
+        help='Rows in each file, raised if a partition would need more than --max-files.')
+    parser.add_argument("-r", "--row-group-size", default=100_000, type=int,
+        help='Rows in each row group.')
+    parser.add_argument("--batch-rows", default=64 * 1024, type=int,
+        help='Rows read at a time.')
+    parser.add_argument("--max-open", default=512, type=int,
+        help='Most files open at once, more partitions than this are written in several passes.')
+    parser.add_argument("--compression", default='zstd', help='Parquet compression.')
+    parser.add_argument("--writer-config",
+        help='JSON writer config, such as from `tune.py -a compression`, over --compression.')
+    parser.add_argument("--encoding", default='WKB', choices=['WKB', 'geoarrow'],
+        help='Geometry encoding of the output, geoarrow needs one geometry family.')
+
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+def main():
+    ''' Be a command line app. '''
+    args = handle_args()
+    print(repartition(args))
+
+if __name__ == "__main__":
+    main()
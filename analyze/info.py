@@ -7,8 +7,10 @@ Create an analyses tool for geo parquet files
 import argparse
 import csv
 import io
+import os
 import sys
 
+import numpy as np
 import pyarrow
 import pyarrow.parquet as pq
 import pandas as pd
@@ -16,16 +18,17 @@ import geopandas as gpd
 from shapely import wkb, wkt
 from shapely.geometry import box
 
+import footers
+import geoparquet
+
 # pylint: disable=unnecessary-lambda
 
-def get_parquet_group_stats(file_path):
+def get_parquet_group_stats(file_path, metadata:pq.FileMetaData = None):
     ''' Get statistics for each row group in a Parquet file. '''
 
-    # Open the Parquet file
-    parquet_file = pq.ParquetFile(file_path)
-
-    # Get metadata
-    metadata = parquet_file.metadata
+    # Get metadata, opening the Parquet file if it was not already read
+    if metadata is None:
+        metadata = pq.ParquetFile(file_path).metadata
 
     # Initialize a dictionary to store results
     group_stats = {}
@@ -51,9 +54,15 @@ def get_parquet_group_stats(file_path):
 
     return group_stats
 
-def report_row_group_stats(file_path:str) -> str:
-    ''' build a report fo the row group stats '''
-    stats = get_parquet_group_stats(file_path)
+def report_row_group_stats(file_path:str, footer_list:dict = None) -> str:
+    ''' build a report fo the row group stats, for one file or for every file in footer_list '''
+    if footer_list is None:
+        stats = get_parquet_group_stats(file_path)
+    else:
+        stats = {}
+        for path, metadata in footer_list.items():
+            for group, values in get_parquet_group_stats(path, metadata).items():
+                stats[f"{os.path.basename(path)}:{group}"] = values
     df_stats = pd.DataFrame.from_dict({(i,j): stats[i][j]
         for i in stats.keys()
         for j in stats[i].keys()},
@@ -122,6 +131,117 @@ def shape(parquet:pd.DataFrame):
 
 # ################################################################################################ #
 
+ENVELOPE_COLUMNS = [['bbox.xmin', 'bbox.ymin', 'bbox.xmax', 'bbox.ymax'],
+    ['MBRWest', 'MBRSouth', 'MBREast', 'MBRNorth']]
+
+def group_envelopes(file_path:str) -> tuple[np.ndarray, np.ndarray, list]:
+    '''
+    The true extent of each row group as an n by 4 array of xmin, ymin, xmax, ymax along with the
+    rows in each group. Taken from the statistics of the bbox or MBR columns when they exist and
+    every group has them, otherwise the geometry of each group is read and measured.
+    '''
+    metadata = pq.ParquetFile(file_path).metadata
+    paths = [metadata.row_group(0).column(i).path_in_schema
+        for i in range(metadata.row_group(0).num_columns)] if metadata.num_row_groups else []
+    rows = np.array([metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)])
+    for names in ENVELOPE_COLUMNS:
+        if not all(name in paths for name in names):
+            continue
+        found = [[metadata.row_group(i).column(paths.index(name)).statistics for name in names]
+            for i in range(metadata.num_row_groups)]
+        if any(stats is None or not stats.has_min_max for group in found for stats in group):
+            continue # written without statistics, try the next columns
+        out = np.array([[stats.min if j < 2 else stats.max for j, stats in enumerate(group)]
+            for group in found], dtype=np.float64).reshape(-1, 4)
+        return out, rows, names
+    parquet = pq.ParquetFile(file_path)
+    out = np.zeros((metadata.num_row_groups, 4))
+    for i in range(metadata.num_row_groups):
+        bounds = geoparquet.envelopes(geoparquet.to_geometry(
+            parquet.read_row_group(i, columns=['geometry']).column('geometry')))
+        out[i] = [np.nanmin(bounds[:, 0]), np.nanmin(bounds[:, 1]), np.nanmax(bounds[:, 2]),
+            np.nanmax(bounds[:, 3])]
+    return out, rows, ['geometry']
+
+def intersects(boxes:np.ndarray, other:np.ndarray) -> np.ndarray:
+    ''' Matrix of which boxes touch which others, boxes by other. '''
+    return ((boxes[:, None, 0] <= other[None, :, 2]) & (boxes[:, None, 2] >= other[None, :, 0])
+        & (boxes[:, None, 1] <= other[None, :, 3]) & (boxes[:, None, 3] >= other[None, :, 1]))
+
+def cluster_report(file_path:str, query_sizes:tuple = (1.0, 10.0), queries:int = 1000) -> str:
+    '''
+    How well the rows are clustered in space. For each row group, its envelope and how much of it is
+    shared with other groups, then for the whole file:
+    * overlap, total area shared between pairs of groups over the total group area, 0 is best
+    * inflation, total group area over the area of the whole file, near 1 is a tiling of the data
+    * touched, average share of row groups a query box of each size would have to read, query boxes
+      are centered on rows picked at random so they follow the data
+    '''
+    envelopes, rows, source = group_envelopes(file_path)
+    count = len(envelopes)
+    if count < 1:
+        return 'No row groups'
+    area = (envelopes[:, 2] - envelopes[:, 0]) * (envelopes[:, 3] - envelopes[:, 1])
+    width = (np.minimum(envelopes[:, None, 2], envelopes[None, :, 2])
+        - np.maximum(envelopes[:, None, 0], envelopes[None, :, 0])).clip(min=0)
+    height = (np.minimum(envelopes[:, None, 3], envelopes[None, :, 3])
+        - np.maximum(envelopes[:, None, 1], envelopes[None, :, 1])).clip(min=0)
+    shared = width * height
+    np.fill_diagonal(shared, 0)
+    total = ((envelopes[:, 2].max() - envelopes[:, 0].min())
+        * (envelopes[:, 3].max() - envelopes[:, 1].min()))
+
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['group', 'rows', 'xmin', 'ymin', 'xmax', 'ymax', 'area', 'shared'])
+    for i in range(count):
+        writer.writerow([i, rows[i], *envelopes[i], area[i], shared[i].sum()])
+
+    # query centers from the envelopes of rows in a few random row groups
+    rng = np.random.default_rng(42)
+    if source == ['geometry']:
+        # no envelope columns to sample, so use a random point inside the group envelopes
+        picked = rng.choice(count, size=queries, p=rows / rows.sum())
+        x = rng.uniform(envelopes[picked, 0], envelopes[picked, 2])
+        y = rng.uniform(envelopes[picked, 1], envelopes[picked, 3])
+    else:
+        picked = np.unique(rng.choice(count, size=min(count, 20), p=rows / rows.sum()))
+        columns = sorted({name.split('.')[0] for name in source})
+        table = pq.ParquetFile(file_path).read_row_groups(picked.tolist(), columns=columns)
+        flat = table.flatten() if '.' in source[0] else table
+        values = np.column_stack([flat.column(name).to_numpy() for name in source])
+        chosen = values[rng.integers(len(values), size=queries)]
+        x = (chosen[:, 0] + chosen[:, 2]) / 2
+        y = (chosen[:, 1] + chosen[:, 3]) / 2
+
+    summary = {'row_groups': count,
+        'envelopes_from': ','.join(source),
+        'overlap': np.triu(shared, 1).sum() / area.sum() if area.sum() else 0, # each pair once
+        'inflation': area.sum() / total if total else 0}
+    for size in query_sizes:
+        half = size / 2
+        boxes = np.column_stack([x - half, y - half, x + half, y + half])
+        summary[f"touched_{size:g}deg"] = intersects(boxes, envelopes).sum(axis=1).mean() / count
+    out.write('\n')
+    for key, value in summary.items():
+        out.write(f"{key}: {value}\n")
+    return out.getvalue()
+
+def dataset_report(args:argparse.Namespace) -> str:
+    ''' Rows, row groups, and sizes for each file in a dataset and then totals for all of them. '''
+    found = footers.read_footers(args.parquet, args.workers, args.cache, args.s3_endpoint)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['file', 'rows', 'row_groups', 'bytes', 'footer_bytes', 'columns'])
+    for path, metadata in found.items():
+        writer.writerow([path, metadata.num_rows, metadata.num_row_groups,
+            sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups)),
+            metadata.serialized_size, metadata.num_columns])
+    out.write('\n')
+    for key, value in footers.summarize(found).items():
+        out.write(f"{key}: {value}\n")
+    return out.getvalue()
+
 def row(name:str, input, function, help_text:str) -> dict:
     ''' shorten the creation of one row of the runner dictioanry '''
     return {'name': name, 'input': input, 'function': function, 'help': help_text}
@@ -201,12 +321,18 @@ runner = {'info':
         "Print a summary of the DataFrame including the data types of the columns."),
     'shape': row("Shape", 'panda', lambda x : shape(x), 'Dimentions of the DataFrame.'),
 
-    'group-stats': row('Group Stats','parquet',  lambda x : report_row_group_stats(x),
-        "row group statistics"),
+    'group-stats': row('Group Stats', 'args', lambda x : report_row_group_stats(x.parquet,
+            footers.read_footers(x.parquet, x.workers, x.cache, x.s3_endpoint)),
+        "row group statistics, for a file, directory, glob, or S3 prefix"),
+    'dataset': row('Dataset', 'args', lambda x : dataset_report(x),
+        "Rows, row groups, and sizes of every file in a directory, glob, or S3 prefix."),
     'meta': row('Meta', 'parquet', lambda x : read_parquet_meta(x),
         "Read the parquet meta data and schema."),
     'group-csv': row('Group CSV', 'parquet', lambda x : groups_to_csv(x),
         "Dump Groups as CSV file."),
+    'cluster': row('Cluster', 'parquet', lambda x : cluster_report(x),
+        "Spatial extent of each row group, overlap, area inflation, and row groups touched by "
+        "sample queries."),
 }
 
 def what():
@@ -225,6 +351,8 @@ def run(args: argparse.Namespace):
             match thing_to_run['input']:
                 case 'parquet':
                     print(runner[rep]['function'](args.parquet))
+                case 'args':
+                    print(runner[rep]['function'](args))
                 case 'geopanda':
                     print(runner[rep]['function'](args.parquet))
                 case 'panda':
@@ -239,13 +367,18 @@ def handle_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Report on details of a parquet file")
 
     # Add command-line arguments
-    parser.add_argument("parquet", help='Path to parquet file.')
+    parser.add_argument("parquet",
+        help='Path to parquet file, some reports also take a directory, glob, or s3:// path.')
     parser.add_argument("-r", "--reports",
         choices=['dtypes', 'info', 'describe', 'shape', 'head', 'foot', 'group-stats', 'meta',
-            'group-csv'],
+            'group-csv', 'cluster', 'dataset'],
         nargs="+",
         help='Name of the csv file to write out.')
     parser.add_argument("-w", "--what", action='store_true', help='List all the options')
+    parser.add_argument("-j", "--workers", default=16, type=int,
+        help='Threads used to read footers.')
+    parser.add_argument("-c", "--cache", help='Directory to cache parsed footers in.')
+    parser.add_argument("--s3-endpoint", help='host:port of an S3 compatible server.')
 
     # Parse arguments
     args = parser.parse_args()
@@ -1,33 +1,290 @@
 #!/usr/bin/env python3
 
+'''
+Merge harvest files which are each already sorted on the same key into one sorted set of files. The
+inputs are streamed a batch at a time through a k-way merge so memory holds about one batch per
+input, no matter how large the files are. Output is split into files of a target size, each with
+aligned row groups and GeoParquet metadata.
+
+The key is a column, like StartTime or GranuleUR, or a spatial key (hilbert or morton) made from the
+center of each envelope, in which case the inputs must have been sorted with the same curve and
+order, such as by `change.py -a sort-curve`.
+
+When the key is a column with statistics in the footers, the key space can be cut into ranges of
+about the same number of rows and each range merged by its own process with --workers. A range only
+reads the row groups whose min and max overlap it, and output file names sort in key order.
+
+example run:
+
+ ./merge.py '../data/sorted/*.parquet' -o ../data/merged -k GranuleUR --target-rows 2000000 -j 4
+'''
+
 import argparse
-import csv
-import io
+import concurrent.futures
 import os
 import sys
 import time
 
-import dask.dataframe as dd
-import dask_geopandas as dgp
-from dask.distributed import LocalCluster
-import pandas as pd
-import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import external_sort
+import footers
+import geoparquet
+
+# ################################################################################################ #
+# Mark: - Functions
+
+def find_inputs(paths:list[str]) -> list[str]:
+    ''' Every local parquet file from a list of files, directories, and globs. '''
+    found = []
+    for path in paths:
+        _, infos = footers.expand(path)
+        found.extend(info.path for info in infos)
+    return found
+
+def merge_column(key:str) -> str:
+    ''' The column the merge compares, spatial keys are put in a column of their own. '''
+    return external_sort.KEY if key in external_sort.CURVES else key
+
+def key_statistics(metadata:pq.FileMetaData, key:str) -> list[tuple]:
+    ''' (row group, min, max, rows) for each row group, or None if any group has no statistics. '''
+    names = [metadata.schema.column(i).path for i in range(metadata.num_columns)]
+    if key not in names:
+        return None
+    column = names.index(key)
+    out = []
+    for index in range(metadata.num_row_groups):
+        group = metadata.row_group(index)
+        found = group.column(column).statistics
+        if found is None or not found.has_min_max:
+            return None
+        out.append((index, found.min, found.max, group.num_rows))
+    return out
+
+def key_ranges(statistics:dict, parts:int) -> list[tuple]:
+    '''
+    Cut the key space into about parts ranges with about the same number of rows, using the row
+    group minimums as the cut points. Ranges are (low, high) with low included and high not, None
+    means open ended.
+    '''
+    groups = sorted((item for items in statistics.values() for item in items),
+        key=lambda item: item[1])
+    total = sum(item[3] for item in groups)
+    cuts = []
+    seen = 0
+    for _, low, _, rows in groups:
+        if seen >= total * (len(cuts) + 1) / parts and (not cuts or low > cuts[-1]):
+            cuts.append(low)
+        seen += rows
+    cuts = [cut for cut in cuts if cut > groups[0][1]]
+    bounds = [None] + cuts + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def groups_in_range(items:list[tuple], low, high) -> list[int]:
+    ''' Row groups whose min and max could hold keys in the range. '''
+    return [index for index, least, most, _ in items
+        if (low is None or most >= low) and (high is None or least < high)]
+
+def source(path:str, args:argparse.Namespace, row_groups:list[int] = None, low=None, high=None):
+    '''
+    Tables from one sorted file, ready to write and limited to the key range. Spatial keys are
+    worked out here from the rebuilt bbox column.
+    '''
+    column = merge_column(args.key)
+    parquet = pq.ParquetFile(path)
+    for batch in parquet.iter_batches(batch_size=args.batch_rows, row_groups=row_groups):
+        table = geoparquet.prepare(pa.Table.from_batches([batch]), encoding=args.encoding)
+        if args.key in external_sort.CURVES:
+            keys = external_sort.center_key(table, args.key, args.order)
+            table = table.append_column(column, pa.array(keys))
+        keys = table.column(column)
+        if low is not None:
+            table = table.filter(pc.greater_equal(keys, pa.scalar(low, type=keys.type)))
+            keys = table.column(column)
+        if high is not None:
+            table = table.filter(pc.less(keys, pa.scalar(high, type=keys.type)))
+        if table.num_rows:
+            yield table
+
+class OutputFiles():
+    '''
+    Write tables to a series of files of at most file_rows each, where file_rows is a whole number of
+    row groups so every file's row groups are aligned.
+    '''
+
+    def __init__(self, directory:str, prefix:str, file_rows:int, row_group_size:int, **options):
+        ''' options are passed on to GeoParquetWriter, like compression. '''
+        self.directory = directory
+        self.prefix = prefix
+        self.row_group_size = row_group_size
+        self.file_rows = max(1, file_rows // row_group_size) * row_group_size
+        self.options = options
+        self.writer = None
+        self.written = 0
+        self.files = []
+
+    def write(self, table:pa.Table):
+        ''' Fill the current file, starting new ones as each one is full. '''
+        while table.num_rows:
+            if self.writer is None:
+                path = os.path.join(self.directory, f"{self.prefix}_{len(self.files):05d}.parquet")
+                self.writer = geoparquet.GeoParquetWriter(path, table.schema, self.row_group_size,
+                    **self.options)
+                self.files.append(path)
+                self.written = 0
+            room = self.file_rows - self.written
+            self.writer.write(table.slice(0, room))
+            self.written += min(room, table.num_rows)
+            table = table.slice(room)
+            if self.written >= self.file_rows:
+                self.writer.close()
+                self.writer = None
+
+    def close(self):
+        ''' Close the file being written, if any. '''
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+def merge_range(paths:list[str], args:argparse.Namespace, prefix:str, file_rows:int,
+    row_groups:dict = None, low=None, high=None) -> list[str]:
+    ''' Merge one key range of the inputs into output files, returns the files written. '''
+    row_groups = row_groups or {}
+    sources = [source(path, args, row_groups.get(path), low, high) for path in paths
+        if row_groups.get(path) is None or len(row_groups[path]) > 0]
+    files = OutputFiles(args.output, prefix, file_rows, args.row_group_size,
+        **geoparquet.writer_options(args.writer_config, compression=args.compression))
+    column = merge_column(args.key)
+    for table in external_sort.merge_sorted(sources, column):
+        if args.key in external_sort.CURVES:
+            table = table.drop_columns([column])
+        files.write(table)
+    files.close()
+    return files.files
+
+def rows_per_file(metadata:dict, args:argparse.Namespace) -> int:
+    ''' Rows in each output file, from --target-rows or from --target-mb and the input row size. '''
+    if args.target_rows:
+        return args.target_rows
+    rows = sum(meta.num_rows for meta in metadata.values())
+    size = sum(meta.row_group(i).total_byte_size for meta in metadata.values()
+        for i in range(meta.num_row_groups))
+    per_row = size / rows if rows else 1
+    return int(args.target_mb * 1024 * 1024 / per_row)
+
+def merge(args:argparse.Namespace) -> str:
+    ''' Merge the inputs, by key range across processes when the footers allow it. '''
+    mark_start = time.time()
+    paths = find_inputs(args.inputs)
+    if not paths:
+        return "No parquet files found."
+    os.makedirs(args.output, exist_ok=True)
+    metadata = {path: pq.read_metadata(path) for path in paths}
+    file_rows = rows_per_file(metadata, args)
+
+    statistics = None
+    if args.workers > 1 and args.key not in external_sort.CURVES:
+        statistics = {path: key_statistics(meta, args.key) for path, meta in metadata.items()}
+        if any(items is None for items in statistics.values()):
+            print(f"No statistics for {args.key} in every file, merging in one process.",
+                file=sys.stderr)
+            statistics = None
+
+    if statistics is None:
+        written = merge_range(paths, args, 'part_000', file_rows)
+    else:
+        ranges = key_ranges(statistics, args.workers)
+        written = []
+        with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+            jobs = []
+            for index, (low, high) in enumerate(ranges):
+                groups = {path: groups_in_range(items, low, high)
+                    for path, items in statistics.items()}
+                jobs.append(pool.submit(merge_range, paths, args, f"part_{index:03d}", file_rows,
+                    groups, low, high))
+            for job in jobs:
+                written.extend(job.result())
+
+    rows = sum(pq.read_metadata(path).num_rows for path in written)
+    expected = sum(meta.num_rows for meta in metadata.values())
+    if rows != expected:
+        print(f"Merged {rows} rows but the inputs have {expected}, check {args.key} for nulls.",
+            file=sys.stderr)
+    return (f"Merged {len(paths)} files, {rows} rows, on {args.key} into {len(written)} files in "
+        f"{args.output} in {time.time() - mark_start:.1f}s")
+
+# ################################################################################################ #
+# testing
+
+def merge_test():
+    ''' Merging sorted files, in one range or several, comes out in order with nothing lost. '''
+    import tempfile
+    import numpy as np
+    import shapely
+    values = (np.arange(3000) * 7919) % 10007
+    geometry = shapely.to_wkb(shapely.points(np.zeros(3000), np.zeros(3000)))
+    with tempfile.TemporaryDirectory() as temp:
+        inputs = []
+        for part in range(3):
+            chunk = np.sort(values[part::3])
+            table = pa.table({'value': chunk, 'geometry': pa.array(geometry[:len(chunk)])})
+            inputs.append(os.path.join(temp, f"in_{part}.parquet"))
+            pq.write_table(table, inputs[-1], row_group_size=100)
+        for workers in [1, 3]:
+            args = argparse.Namespace(inputs=inputs, output=os.path.join(temp, f"out{workers}"),
+                key='value', order=16, batch_rows=128, row_group_size=250, target_rows=1000,
+                target_mb=None, workers=workers, compression='zstd',
+                writer_config=None, encoding='WKB')
+            merge(args)
+            names = sorted(os.listdir(args.output))
+            merged = pa.concat_tables(pq.read_table(os.path.join(args.output, name))
+                for name in names)
+            assert merged.column('value').to_pylist() == sorted(values.tolist())
+            groups = [pq.read_metadata(os.path.join(args.output, name)).row_group(0).num_rows
+                for name in names]
+            assert max(groups) == 250
+
+#merge_test()
+
+# ################################################################################################ #
+# Mark: - Command functions
 
-cluster = LocalCluster(n_workers=1,
-    threads_per_worker=1,
-    processes=False,
-    dashboard_address=':8787',
-    memory_limit="2GiB")
-client = cluster.get_client()
+def handle_args() -> argparse.Namespace:
+    ''' Process all the command line arguments and return an argparse Namespace object. '''
+    parser = argparse.ArgumentParser(description="k-way merge of sorted parquet files")
 
-print("start")
-ddf = dgp.read_parquet('polygons_30m.parquet', gather_spatial_partitions=False)
-#ddf.compute()
-#ddf.persist()
+    # Add command-line arguments
+    parser.add_argument("inputs", nargs='+', help='Sorted parquet files, directories, or globs.')
+    parser.add_argument("-o", "--output", required=True, help='Directory for the merged files.')
+    parser.add_argument("-k", "--key", default='StartTime',
+        help='Column the inputs are sorted on, or hilbert or morton for a spatial key.')
+    parser.add_argument("--order", default=16, type=int,
+        help='Bits per axis for a spatial key, must match how the inputs were sorted.')
+    parser.add_argument("--target-rows", type=int, help='Rows in each output file.')
+    parser.add_argument("--target-mb", default=512, type=float,
+        help='Size of each output file, estimated from the inputs, when --target-rows is not set.')
+    parser.add_argument("-r", "--row-group-size", default=100_000, type=int,
+        help='Rows in each row group.')
+    parser.add_argument("--batch-rows", default=64 * 1024, type=int,
+        help='Rows read from each input at a time.')
+    parser.add_argument("-j", "--workers", default=1, type=int,
+        help='Processes to merge key ranges in, needs key statistics in the footers.')
+    parser.add_argument("--compression", default='zstd', help='Parquet compression.')
+    parser.add_argument("--writer-config",
+        help='JSON writer config, such as from `tune.py -a compression`, over --compression.')
+    parser.add_argument("--encoding", default='WKB', choices=['WKB', 'geoarrow'],
+        help='Geometry encoding of the output, geoarrow needs one geometry family.')
 
-ddf['bbox'] = ddf.geometry.apply(lambda geom: geom.bounds, meta=('bbox', 'object'))
+    # Parse arguments
+    args = parser.parse_args()
+    return args
 
-print('write')
-ddf.to_parquet('polygons_30m_bbox.parquet', write_index=False, row_group_size=120950)
+def main():
+    ''' Be a command line app. '''
+    args = handle_args()
+    print(merge(args))
 
-print("done")
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,8 @@ import geopandas as gpd
 from shapely import wkb, wkt
 from shapely.geometry import box
 
+import footers
+
 # pylint: disable=unnecessary-lambda
 
 def shape(parquet:pd.DataFrame):
@@ -26,10 +28,14 @@ def shape(parquet:pd.DataFrame):
     #print('Columns')
     #print(parquet.columns)
 
-def big_shape(parquet_path:str):
-    parquet_obj = pq.ParquetFile(parquet_path)
-    print(str(type(parquet_obj)))
-    print(parquet_obj.metadata.row_group(0).num_rows)
+def big_shape(parquet_path:str, workers:int = 16, cache:str = None, endpoint:str = None):
+    ''' rows and columns of a file or whole dataset from the footers alone '''
+    found = footers.read_footers(parquet_path, workers, cache, endpoint)
+    summary = footers.summarize(found)
+    columns = {meta.num_columns for meta in found.values()}
+    print(f"({summary['rows']}, {','.join(str(item) for item in sorted(columns))})")
+    for key, value in summary.items():
+        print(f"{key}: {value}")
 
 # ################################################################################################ #
 
@@ -43,7 +49,7 @@ def run(args: argparse.Namespace):
                 parquet = pd.read_parquet(args.parquet, engine='pyarrow', memory_map=True)
                 shape(parquet)
             elif rep =='shape-big':
-                big_shape(args.parquet)
+                big_shape(args.parquet, args.workers, args.cache, args.s3_endpoint)
 
 # ################################################################################################ #
 # Mark: - Command functions
@@ -53,11 +59,16 @@ def handle_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Report on details of a parquet file")
 
     # Add command-line arguments
-    parser.add_argument("parquet", help='Path to parquet file.')
+    parser.add_argument("parquet",
+        help='Path to parquet file, shape-big also takes a directory, glob, or s3:// path.')
     parser.add_argument("-r", "--reports",
         choices=['shape', 'shape-big'],
         nargs="+",
         help='Name of the csv file to write out.')
+    parser.add_argument("-j", "--workers", default=16, type=int,
+        help='Threads used to read footers for shape-big.')
+    parser.add_argument("-c", "--cache", help='Directory to cache parsed footers in.')
+    parser.add_argument("--s3-endpoint", help='host:port of an S3 compatible server.')
 
     # Parse arguments
     args = parser.parse_args()
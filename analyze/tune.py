@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+
+'''
+Tune how parquet files are written by rewriting a sample dataset several ways and running the same
+queries against each version. Choices such as row group size are then made from measurements of the
+actual data instead of numbers carried over from earlier runs.
+
+Queries come from a CSV written by tester/create_sql.py, where {data} is swapped with the path of
+each candidate file.
+
+The page-index action writes the sample with and without column and offset indexes at several page
+sizes and times narrow StartTime and MBR queries in DuckDB and pyarrow.
+
+The encoding action writes the sample with WKB and with GeoArrow native geometry and times reading,
+decoding, and intersecting the geometry with a set of boxes in pyarrow and shapely, and in DuckDB
+when the spatial extension can be loaded.
+
+example run:
+
+ ./tune.py ../data/sample -a row-groups --queries ../tester/out.csv --sizes 25000,100000,250000
+
+To also count S3 requests, serve the work directory with `../tester/util/s3_local.py --root work` and
+give its address with --s3-endpoint.
+'''
+
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import statistics
+import struct
+import sys
+import time
+
+import duckdb
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import shapely
+
+import geoparquet
+import stats
+
+# ################################################################################################ #
+# Mark: - Functions
+
+def footer_size(path:str) -> int:
+    ''' Bytes in the parquet footer, the 4 bytes before the closing magic number hold the length. '''
+    with open(path, 'rb') as file:
+        file.seek(-8, os.SEEK_END)
+        return struct.unpack('<i', file.read(4))[0]
+
+def read_queries(path:str) -> list[dict]:
+    ''' Rows from a create_sql.py CSV, setup and cleanup rows are skipped. '''
+    with open(path, 'r', encoding='utf-8') as file:
+        rows = list(csv.DictReader(file))
+    out = []
+    for item in rows:
+        if item['name'] == 'life-cycle-event':
+            continue
+        out.append({'name': f"{item['name']}-{item['action']}",
+            'sql': item['sql'].replace('\\n', '\n')})
+    return out
+
+def connect(args:argparse.Namespace) -> duckdb.DuckDBPyConnection:
+    ''' A duckdb connection, pointed at an S3 compatible server if one is given. '''
+    connection = duckdb.connect()
+    if args.s3_endpoint:
+        connection.execute(f'''CREATE OR REPLACE SECRET tune_s3(TYPE S3, KEY_ID 'tune',
+            SECRET 'tune', REGION 'us-east-1', ENDPOINT '{args.s3_endpoint}',
+            URL_STYLE 'path', USE_SSL false)''')
+        connection.execute("SET enable_http_metadata_cache = false")
+    return connection
+
+def where_clause(sql:str) -> str:
+    ''' The WHERE clause of a query as made by create_sql.py, or None if there is not one. '''
+    found = re.search(r'\bWHERE\b(.*?)(?=\bORDER\s+BY\b|\bLIMIT\b|\Z)', sql,
+        re.DOTALL | re.IGNORECASE)
+    return found.group(1) if found else None
+
+def groups_touched(connection:duckdb.DuckDBPyConnection, sql:str, location:str,
+    row_group_size:int) -> int:
+    '''
+    Number of row groups holding at least one matching row. Any other row group could be skipped by
+    a reader using the statistics, so this is the best pruning the layout allows for a query, not
+    what a reader really skipped, --s3-endpoint measures that in bytes.
+    '''
+    where = where_clause(sql)
+    if where is None:
+        return None
+    return connection.sql(f"""SELECT count(DISTINCT file_row_number // {row_group_size})
+        FROM read_parquet('{location}', file_row_number=true) WHERE {where}""").fetchone()[0]
+
+def http_counts(connection:duckdb.DuckDBPyConnection, sql:str) -> dict:
+    ''' HEAD and GET counts along with MiB read for a query over S3. '''
+    details = str(connection.sql(f"EXPLAIN ANALYZE {sql}").fetchall())
+    return stats.parse_http_stats(details)
+
+def measure(connection, location:str, queries:list[dict], meta:pq.FileMetaData,
+    args:argparse.Namespace) -> dict:
+    ''' Run every query against one candidate file and collect the numbers. '''
+    times = []
+    touched = []
+    requests = {'HEAD': 0, 'GET': 0, 'in': 0}
+    row_group_size = meta.row_group(0).num_rows if meta.num_row_groups else 1
+    for query in queries:
+        sql = query['sql'].replace('{data}', f"'{location}'")
+        runs = []
+        for _ in range(args.tries):
+            mark_start = time.perf_counter_ns()
+            connection.sql(sql).fetchall()
+            runs.append((time.perf_counter_ns() - mark_start) / 1_000_000)
+        times.append(statistics.median(runs))
+        found = groups_touched(connection, sql, location, row_group_size)
+        touched.append(meta.num_row_groups if found is None else found)
+        if args.s3_endpoint:
+            for key, value in (http_counts(connection, sql) or {}).items():
+                if key in requests:
+                    requests[key] += value
+    possible = meta.num_row_groups * len(queries)
+    result = {'scan_ms': sum(times),
+        'worst_ms': max(times) if times else 0,
+        'prunable': 1 - sum(touched) / possible if possible else 0}
+    if args.s3_endpoint:
+        result.update({'s3_head': requests['HEAD'], 's3_get': requests['GET'],
+            's3_mib': requests['in']})
+    return result
+
+def candidates(args:argparse.Namespace) -> list[dict]:
+    ''' Every row group size and page size pair to try. '''
+    out = []
+    for size in [int(item) for item in args.sizes.split(',')]:
+        for page in [int(item) for item in args.page_sizes.split(',')]:
+            out.append({'row_group_size': size, 'page_size': page,
+                'file': f"rg{size}_page{page}.parquet"})
+    return out
+
+def recommend(results:list[dict]) -> dict:
+    ''' Fastest total time wins, a smaller footer breaks a close call (within 5%). '''
+    best = min(item['scan_ms'] for item in results)
+    close = [item for item in results if item['scan_ms'] <= best * 1.05]
+    return min(close, key=lambda item: (item['footer_bytes'], item['scan_ms']))
+
+def tune_row_groups(args:argparse.Namespace) -> str:
+    '''
+    Rewrite the sample with each row group and page size, run the queries against every version,
+    and report scan time, the share of row groups with no matches (prunable, what statistics could
+    skip at best), footer size, and S3 requests and MiB read when an endpoint is given.
+    '''
+    queries = read_queries(args.queries) if args.queries else []
+    if not queries:
+        return f"No queries found in {args.queries}, row-groups needs --queries."
+    os.makedirs(args.work, exist_ok=True)
+    connection = connect(args)
+    results = []
+    for candidate in candidates(args):
+        path = os.path.join(args.work, candidate['file'])
+        geoparquet.rewrite(args.parquet, path, candidate['row_group_size'],
+            compression=args.compression, data_page_size=candidate['page_size'])
+        meta = pq.ParquetFile(path).metadata
+        location = path
+        if args.s3_endpoint:
+            location = f"s3://{args.s3_bucket}/{candidate['file']}"
+        item = {'row_group_size': candidate['row_group_size'],
+            'page_size': candidate['page_size'],
+            'row_groups': meta.num_row_groups,
+            'file_bytes': os.path.getsize(path),
+            'footer_bytes': footer_size(path)}
+        item.update(measure(connection, location, queries, meta, args))
+        results.append(item)
+        print(f"{candidate['file']}: {item['scan_ms']:.1f}ms, prunable {item['prunable']:.1%}",
+            file=sys.stderr)
+        if not args.keep:
+            os.remove(path)
+
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(results[0].keys()))
+    writer.writeheader()
+    writer.writerows(results)
+    best = recommend(results)
+    out.write(f"\nRecommended: row group size {best['row_group_size']}, page size "
+        f"{best['page_size']} ({best['scan_ms']:.1f}ms over {len(queries)} queries)\n")
+    return out.getvalue()
+
+def median_ms(function, tries:int) -> tuple[float, object]:
+    ''' Median time of calling function in ms along with the last result. '''
+    runs = []
+    result = None
+    for _ in range(tries):
+        mark_start = time.perf_counter_ns()
+        result = function()
+        runs.append((time.perf_counter_ns() - mark_start) / 1_000_000)
+    return statistics.median(runs), result
+
+def write_encodings(args:argparse.Namespace) -> tuple[dict, int, int]:
+    '''
+    Write the sample once per geometry encoding. GeoArrow holds one geometry family, so only rows
+    of the most common family are kept, in both files so they can be compared. Returns the paths,
+    the rows kept, and the rows dropped.
+    '''
+    dataset = ds.dataset(args.parquet, format='parquet')
+    column = dataset.to_table(columns=['geometry']).column('geometry')
+    families = np.array([geoparquet.FAMILIES.get(int(kind), '')
+        for kind in shapely.get_type_id(geoparquet.to_geometry(column))])
+    names, counts = np.unique(families[families != ''], return_counts=True)
+    family = names[np.argmax(counts)]
+    paths = {name: os.path.join(args.work, f"encoding_{name}.parquet")
+        for name in ['WKB', 'geoarrow']}
+    writers = {}
+    kept = 0
+    for batch in dataset.to_batches(batch_size=64 * 1024):
+        table = pa.Table.from_batches([batch])
+        kinds = shapely.get_type_id(geoparquet.to_geometry(table.column('geometry')))
+        table = table.filter(pa.array([geoparquet.FAMILIES.get(int(kind)) == family
+            for kind in kinds]))
+        kept += table.num_rows
+        for name, path in paths.items():
+            ready = geoparquet.prepare(table, encoding=name)
+            if name not in writers:
+                writers[name] = geoparquet.GeoParquetWriter(path, ready.schema,
+                    args.row_group_size, compression=args.compression)
+            writers[name].write(ready)
+    for writer in writers.values():
+        writer.close()
+    return paths, kept, len(families) - kept
+
+def query_boxes(path:str, count:int, size:float, seed:int = 42) -> list[tuple]:
+    ''' Boxes of size degrees around the centers of randomly picked rows. '''
+    bbox = pq.read_table(path, columns=['bbox']).column('bbox').combine_chunks()
+    x = geoparquet.center_x(bbox.field('xmin').to_numpy(zero_copy_only=False),
+        bbox.field('xmax').to_numpy(zero_copy_only=False))
+    y = (bbox.field('ymin').to_numpy(zero_copy_only=False)
+        + bbox.field('ymax').to_numpy(zero_copy_only=False)) / 2
+    picks = np.random.default_rng(seed).integers(len(x), size=count)
+    half = size / 2
+    return [(max(-180.0, x[i] - half), max(-90.0, y[i] - half), min(180.0, x[i] + half),
+        min(90.0, y[i] + half)) for i in picks]
+
+def duckdb_intersects(connection, path:str, boxes:list[tuple]) -> int:
+    ''' Rows intersecting each box, summed, found by DuckDB. '''
+    found = 0
+    for box in boxes:
+        envelope = ', '.join(str(value) for value in box)
+        found += connection.sql(f"SELECT count(*) FROM read_parquet('{path}') "
+            f"WHERE st_intersects(geometry, ST_MakeEnvelope({envelope}))").fetchone()[0]
+    return found
+
+def tune_encoding(args:argparse.Namespace) -> str:
+    '''
+    Compare WKB with GeoArrow native geometry: file size, then the time to read the geometry column,
+    decode it to shapely, and intersect it with --boxes boxes of --box-size degrees, and the same
+    search in DuckDB. Counts from each encoding are checked against each other.
+    '''
+    os.makedirs(args.work, exist_ok=True)
+    paths, kept, dropped = write_encodings(args)
+    bounds = query_boxes(paths['WKB'], args.boxes, args.box_size)
+    boxes = [shapely.box(*box) for box in bounds]
+    connection = duckdb.connect()
+    try:
+        connection.load_extension('spatial')
+    except duckdb.Error:
+        connection = None
+        print("DuckDB spatial extension not found, skipping DuckDB timing.", file=sys.stderr)
+
+    results = []
+    for name, path in paths.items():
+        read_ms, table = median_ms(lambda: pq.read_table(path, columns=['geometry']), args.tries)
+        decode_ms, geometry = median_ms(lambda: geoparquet.to_geometry(table.column('geometry')),
+            args.tries)
+        intersect_ms, found = median_ms(lambda: sum(int(np.count_nonzero(
+            shapely.intersects(geometry, box))) for box in boxes), args.tries)
+        total = read_ms + decode_ms + intersect_ms
+        item = {'encoding': name, 'rows': kept, 'file_bytes': os.path.getsize(path),
+            'read_ms': read_ms, 'decode_ms': decode_ms, 'intersect_ms': intersect_ms,
+            'rows_per_s': kept / total * 1000 if total else 0, 'found': found}
+        if connection is not None:
+            try:
+                item['duckdb_ms'], item['duckdb_found'] = median_ms(
+                    lambda: duckdb_intersects(connection, path, bounds), args.tries)
+            except duckdb.Error as error:
+                print(f"DuckDB could not search {name}: {error}", file=sys.stderr)
+                item['duckdb_ms'], item['duckdb_found'] = None, None
+        results.append(item)
+        if not args.keep:
+            os.remove(path)
+
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(results[0].keys()))
+    writer.writeheader()
+    writer.writerows(results)
+    if dropped:
+        out.write(f"\nKept {kept} rows of one geometry family, dropped {dropped} others.\n")
+    if len({item['found'] for item in results}) > 1:
+        out.write("\nWarning: the encodings found different rows.\n")
+    best = max(results, key=lambda item: item['rows_per_s'])
+    out.write(f"\nFastest in pyarrow: {best['encoding']} at {best['rows_per_s']:,.0f} rows/s\n")
+    return out.getvalue()
+
+def codec_options(codec:str) -> dict:
+    ''' Writer options for a codec given as name or name:level, like zstd:9. '''
+    name, _, level = codec.partition(':')
+    options = {'compression': name}
+    if level:
+        options['compression_level'] = int(level)
+    return options
+
+def column_kinds(meta:pq.FileMetaData) -> dict:
+    ''' Physical type of every leaf column by its dotted path, like bbox.xmin. '''
+    return {meta.schema.column(i).path: meta.schema.column(i).physical_type
+        for i in range(meta.num_columns)}
+
+def column_bytes(meta:pq.FileMetaData) -> dict:
+    ''' Compressed bytes of every leaf column over all row groups. '''
+    out = {}
+    for group in range(meta.num_row_groups):
+        for index in range(meta.num_columns):
+            chunk = meta.row_group(group).column(index)
+            out[chunk.path_in_schema] = out.get(chunk.path_in_schema, 0) + \
+                chunk.total_compressed_size
+    return out
+
+def variants(kinds:dict) -> dict:
+    '''
+    Column level choices to try, each as the columns it applies to and the writer options for them.
+    Floats like the MBR and LR values can be split into byte streams, integers like RevisionId and
+    text such as the time strings can be delta encoded.
+    '''
+    floats = [name for name, kind in kinds.items() if kind in ['FLOAT', 'DOUBLE']]
+    numbers = [name for name, kind in kinds.items() if kind in ['INT32', 'INT64']]
+    text = [name for name, kind in kinds.items() if kind == 'BYTE_ARRAY']
+    every = [name for name, kind in kinds.items() if kind != 'BOOLEAN']
+    delta = {name: 'DELTA_BINARY_PACKED' for name in numbers}
+    delta.update({name: 'DELTA_BYTE_ARRAY' for name in text})
+    return {'dictionary': (every, {'use_dictionary': True}),
+        'plain': (every, {'use_dictionary': False}),
+        'byte_stream_split': (floats, {'use_dictionary': False,
+            'column_encoding': {name: 'BYTE_STREAM_SPLIT' for name in floats}}),
+        'delta': (list(delta), {'use_dictionary': False, 'column_encoding': delta})}
+
+def tune_compression(args:argparse.Namespace) -> str:
+    '''
+    Sweep codecs and then column encodings. Each --codecs entry is written and run against the
+    queries, the smallest file within 10% of the fastest scan wins as bytes over the wire cost the
+    most on S3. Then each column encoding variant is written with that codec and every column takes
+    the variant that stored it in the fewest bytes, if it saves more than --min-saving over
+    dictionary encoding, the pyarrow default. The resulting config is written to --config-out
+    as JSON which change.py, merge.py, and the harvesters can load, and is benchmarked against the
+    snappy default the writers use today.
+    '''
+    queries = read_queries(args.queries) if args.queries else \
+        [{'name': 'full-scan', 'sql': "SELECT sum(hash(t)) FROM read_parquet({data}) t"}]
+    if not queries:
+        return f"No queries found in {args.queries}."
+    os.makedirs(args.work, exist_ok=True)
+    connection = connect(args)
+    results = []
+
+    def trial(name:str, options:dict) -> tuple[dict, pq.FileMetaData]:
+        path = os.path.join(args.work, f"compression_{name.replace(':', '_')}.parquet")
+        geoparquet.rewrite(args.parquet, path, args.row_group_size, **options)
+        meta = pq.ParquetFile(path).metadata
+        location = path
+        if args.s3_endpoint:
+            location = f"s3://{args.s3_bucket}/{os.path.basename(path)}"
+        item = {'trial': name, 'file_bytes': os.path.getsize(path)}
+        item.update(measure(connection, location, queries, meta, args))
+        results.append(item)
+        print(f"{name}: {item['file_bytes']:,} bytes, {item['scan_ms']:.1f}ms", file=sys.stderr)
+        if not args.keep:
+            os.remove(path)
+        return item, meta
+
+    tried = [trial(codec, codec_options(codec)) for codec in args.codecs.split(',')]
+    kinds = column_kinds(tried[0][1])
+    codecs = [item for item, _ in tried]
+    fastest = min(item['scan_ms'] for item in codecs)
+    codec = min((item for item in codecs if item['scan_ms'] <= fastest * 1.10),
+        key=lambda item: item['file_bytes'])['trial']
+
+    sizes = {}
+    for name, (columns, options) in variants(kinds).items():
+        _, meta = trial(f"{codec}+{name}", {**codec_options(codec), **options})
+        found = column_bytes(meta)
+        for column in columns:
+            sizes.setdefault(column, {})[name] = found[column]
+    choices = {}
+    for column, found in sizes.items():
+        # only move off the writer default for a real saving, other encodings can cost more to read
+        best = min(found, key=lambda name: found[name])
+        keep = found[best] > found['dictionary'] * (1 - args.min_saving)
+        choices[column] = 'dictionary' if keep else best
+    config = codec_options(codec)
+    config['use_dictionary'] = sorted(column for column, pick in choices.items()
+        if pick == 'dictionary')
+    config['column_encoding'] = {column: variants(kinds)[pick][1]['column_encoding'][column]
+        for column, pick in choices.items() if pick in ['byte_stream_split', 'delta']}
+    with open(args.config_out, 'w', encoding='utf-8') as file:
+        json.dump(config, file, indent=2)
+
+    baseline, _ = trial('snappy-default', {'compression': 'snappy'})
+    tuned, _ = trial('recommended', config)
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(results[0].keys()))
+    writer.writeheader()
+    writer.writerows(results)
+    out.write("\ncolumn,choice," + ",".join(variants(kinds).keys()) + "\n")
+    for column, tried in sizes.items():
+        out.write(f"{column},{choices[column]}," + ",".join(str(tried.get(name, ''))
+            for name in variants(kinds).keys()) + "\n")
+    out.write(f"\nRecommended config written to {args.config_out}: {tuned['file_bytes']:,} bytes "
+        f"and {tuned['scan_ms']:.1f}ms against {baseline['file_bytes']:,} bytes and "
+        f"{baseline['scan_ms']:.1f}ms with snappy defaults\n")
+    return out.getvalue()
+
+def narrow_queries(path:str, count:int, fraction:float, size:float, seed:int = 42) -> list[dict]:
+    '''
+    Narrow StartTime window and MBR box queries, as SQL and as a pyarrow filter. Windows span about
+    fraction of the rows, starting at a random row. Boxes are size degrees around a random center
+    and use the MBR columns when the file has them, otherwise the bbox column.
+    '''
+    names = pq.read_schema(path).names
+    starts = np.sort(pq.read_table(path, columns=['StartTime']).column('StartTime')
+        .drop_null().to_numpy(zero_copy_only=False))
+    rng = np.random.default_rng(seed)
+    span = max(1, int(len(starts) * fraction))
+    queries = []
+    for index in range(count):
+        first = int(rng.integers(max(1, len(starts) - span)))
+        low, high = starts[first], starts[min(first + span, len(starts) - 1)]
+        queries.append({'name': f"time-{index}",
+            'sql': f"SELECT * FROM read_parquet({{data}}) WHERE StartTime BETWEEN '{low}' AND "
+                f"'{high}'",
+            'filter': (ds.field('StartTime') >= low) & (ds.field('StartTime') <= high)})
+    if 'MBRWest' in names:
+        columns = ['MBRWest', 'MBRSouth', 'MBREast', 'MBRNorth']
+        fields = [ds.field(name) for name in columns]
+    else:
+        columns = ['bbox.xmin', 'bbox.ymin', 'bbox.xmax', 'bbox.ymax']
+        fields = [ds.field('bbox', name.split('.')[1]) for name in columns]
+    for index, box in enumerate(query_boxes(path, count, size, seed)):
+        queries.append({'name': f"box-{index}",
+            'sql': f"SELECT * FROM read_parquet({{data}}) WHERE {box[0]} <= {columns[2]} AND "
+                f"{box[2]} >= {columns[0]} AND {box[1]} <= {columns[3]} AND "
+                f"{box[3]} >= {columns[1]}",
+            'filter': (fields[2] >= box[0]) & (fields[0] <= box[2]) & (fields[3] >= box[1])
+                & (fields[1] <= box[3])})
+    return queries
+
+def tune_page_index(args:argparse.Namespace) -> str:
+    '''
+    Write the sample with and without a page index (column and offset indexes) at each of
+    --page-sizes and time narrow StartTime and MBR queries in DuckDB and pyarrow. Pages can only be
+    skipped when the rows are sorted on the column within each row group, so sort the sample first,
+    such as with `change.py -a sort-curve` or `merge.py -k StartTime`. With --s3-endpoint the bytes
+    read show what the readers really skipped.
+    '''
+    if args.queries and not read_queries(args.queries):
+        return f"No queries found in {args.queries}."
+    os.makedirs(args.work, exist_ok=True)
+    connection = connect(args)
+    sample = os.path.join(args.work, 'page_sample.parquet')
+    geoparquet.rewrite(args.parquet, sample, args.row_group_size, compression=args.compression)
+    generated = narrow_queries(sample, args.boxes, args.fraction, args.box_size)
+    queries = read_queries(args.queries) if args.queries else generated
+    results = []
+    for indexed in [False, True]:
+        for page in [int(item) for item in args.page_sizes.split(',')]:
+            name = f"page{page}_{'index' if indexed else 'none'}.parquet"
+            path = os.path.join(args.work, name)
+            geoparquet.rewrite(sample, path, args.row_group_size, compression=args.compression,
+                data_page_size=page, write_page_index=indexed)
+            meta = pq.ParquetFile(path).metadata
+            location = f"s3://{args.s3_bucket}/{name}" if args.s3_endpoint else path
+            item = {'page_index': indexed, 'page_size': page,
+                'file_bytes': os.path.getsize(path), 'footer_bytes': footer_size(path)}
+            item.update(measure(connection, location, queries, meta, args))
+            if not args.queries:
+                dataset = ds.dataset(path, format='parquet')
+                item['pyarrow_ms'] = sum(median_ms(lambda: dataset.to_table(
+                    filter=query['filter']).num_rows, args.tries)[0] for query in generated)
+            results.append(item)
+            print(f"{name}: {item['scan_ms']:.1f}ms", file=sys.stderr)
+            if not args.keep:
+                os.remove(path)
+    if not args.keep:
+        os.remove(sample)
+
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(results[0].keys()))
+    writer.writeheader()
+    writer.writerows(results)
+    cost = 's3_mib' if args.s3_endpoint else 'scan_ms'
+    best = min(results, key=lambda item: (item[cost], item['file_bytes']))
+    out.write(f"\nLowest {cost}: page index {best['page_index']}, page size {best['page_size']} "
+        f"({best[cost]:.1f} over {len(queries)} queries)\n")
+    return out.getvalue()
+
+# ################################################################################################ #
+
+def row(name:str, input, function, help_text:str) -> dict:
+    ''' shorten the creation of one row of the runner dictioanry '''
+    return {'name': name, 'input': input, 'function': function, 'help': help_text}
+
+runner = {
+    'row-groups': row('Row Groups', 'args', lambda x : tune_row_groups(x),
+        "Rewrite with each --sizes and --page-sizes and benchmark the --queries on each."),
+    'compression': row('Compression', 'args', lambda x : tune_compression(x),
+        "Sweep --codecs and column encodings, write the best as a writer config to --config-out."),
+    'page-index': row('Page Index', 'args', lambda x : tune_page_index(x),
+        "Time narrow StartTime and MBR queries with and without a page index at --page-sizes."),
+    'encoding': row('Geometry Encoding', 'args', lambda x : tune_encoding(x),
+        "Write WKB and GeoArrow versions and time read, decode, and intersect with --boxes."),
+}
+
+def what():
+    ''' Print out the available reports '''
+    for key in runner.keys():
+        print(f"{key}: {runner[key]['help']}")
+        print('-'*80)
+
+def run(args: argparse.Namespace):
+    ''' Script task '''
+    if args.actions:
+        for act in args.actions:
+            if not act in runner:
+                continue
+            thing_to_run = runner[act]
+            match thing_to_run['input']:
+                case 'args':
+                    print(runner[act]['function'](args))
+
+# ################################################################################################ #
+# Mark: - Command functions
+
+def handle_args() -> argparse.Namespace:
+    ''' Process all the command line arguments and return an argparse Namespace object. '''
+    parser = argparse.ArgumentParser(description="Benchmark different ways of writing a file")
+
+    # Add command-line arguments
+    parser.add_argument("parquet", help='Path to a sample parquet file or directory.')
+    parser.add_argument("-a", "--actions", choices=list(runner.keys()), nargs="+",
+        help='Tuning to run.')
+    parser.add_argument("-q", "--queries", help='CSV file of queries from create_sql.py.')
+    parser.add_argument("--sizes", default='25000,50000,100000,200000,400000',
+        help='Comma list of row group sizes.')
+    parser.add_argument("--page-sizes", default='1048576',
+        help='Comma list of data page sizes in bytes.')
+    parser.add_argument("-r", "--row-group-size", default=100_000, type=int,
+        help='Rows in each row group of the encoding files.')
+    parser.add_argument("--boxes", default=20, type=int,
+        help='Number of boxes for encoding, and of boxes and time windows for page-index.')
+    parser.add_argument("--box-size", default=10.0, type=float,
+        help='Width of each encoding or page-index box in degrees.')
+    parser.add_argument("--fraction", default=0.001, type=float,
+        help='Share of rows in each page-index time window.')
+    parser.add_argument("-c", "--compression", default='zstd', help='Parquet compression.')
+    parser.add_argument("-t", "--tries", default=3, type=int,
+        help='Times to run each query, the median is used.')
+    parser.add_argument("--codecs", default='snappy,lz4,zstd:1,zstd:3,zstd:9,zstd:19',
+        help='Comma list of codecs for compression, with an optional :level.')
+    parser.add_argument("--config-out", default='writer_config.json',
+        help='Where compression writes the recommended writer config.')
+    parser.add_argument("--min-saving", default=0.02, type=float,
+        help='Share of a column a compression encoding must save to be picked over dictionary.')
+    parser.add_argument("--work", default='tune_work', help='Directory for the rewritten files.')
+    parser.add_argument("-k", "--keep", action='store_true', help='Keep the rewritten files.')
+    parser.add_argument("--s3-endpoint",
+        help='host:port of an S3 compatible server serving --work, to count requests.')
+    parser.add_argument("--s3-bucket", default='bigstac', help='Bucket name on the S3 server.')
+    parser.add_argument("-w", "--what", action='store_true', help='List all the options')
+
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+def main():
+    ''' Be a command line app. '''
+    args = handle_args()
+
+    if args.what:
+        what()
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,7 @@ from util import (
     create_time_partitions,
     transform_elastic_results,
     save_buffer_to_parquet,
+    load_writer_config,
 )
 
 
@@ -28,7 +29,11 @@ def main(
     small_coll_filter_file,
     buffer_size=100000,
     max_pages=5,
+    geometry_encoding="WKB",
+    writer_config=None,
 ):
+    writer_options = load_writer_config(writer_config)
+
     # set up logging
     perf_report_filename = f"data_daskreport-{min_date}-{max_date}.html"
     log_filename = f"data_dasklog-{min_date}-{max_date}.log"
@@ -105,7 +110,7 @@ def main(
                     print(f"Buffer size met, now saving no. {file_counter}")
                     logger.info(f"Buffer size met, now saving no. {file_counter}")
                     rows_saved = save_buffer_to_parquet(
-                        buffer, output_dir, file_counter
+                        buffer, output_dir, file_counter, geometry_encoding, writer_options
                     )
                     total_rows += rows_saved
                     buffer = [[] for _ in range(len(COLUMN_NAMES))]
@@ -137,7 +142,7 @@ def main(
                         f"Remaining futures met buffer size, now saving no. {file_counter}"
                     )
                     rows_saved = save_buffer_to_parquet(
-                        buffer, output_dir, file_counter
+                        buffer, output_dir, file_counter, geometry_encoding, writer_options
                     )
                     total_rows += rows_saved
                     buffer = [[] for _ in range(len(COLUMN_NAMES))]
@@ -150,7 +155,9 @@ def main(
         # Save any remaining data in the buffer
         if buffer:
             print("Now saving remaining buffer content")
-            rows_saved = save_buffer_to_parquet(buffer, output_dir, file_counter)
+            rows_saved = save_buffer_to_parquet(
+                buffer, output_dir, file_counter, geometry_encoding, writer_options
+            )
             total_rows += rows_saved
 
     print(
@@ -175,6 +182,8 @@ if __name__ == "__main__":
     parser.add_argument("--max_pages", type=int, default=5, help="Maximum number of pages")
     parser.add_argument("--host", type=str, default="localhost", help="Host address")
     parser.add_argument("--port", type=int, default=9201, help="Port number")
+    parser.add_argument("--writer_config", type=str, default=None, help="JSON writer config from analyze/tune.py -a compression")
+    parser.add_argument("--geometry_encoding", type=str, default="WKB", choices=["WKB", "geoarrow"], help="Geometry encoding of the parquet files")
 
     args = parser.parse_args()
 
@@ -194,6 +203,8 @@ if __name__ == "__main__":
         args.large_coll_idx_file,
         args.small_coll_filter_file,
         args.buffer_size,
-        args.max_pages
+        args.max_pages,
+        args.geometry_encoding,
+        args.writer_config
     )
 
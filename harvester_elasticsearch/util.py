@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+import importlib.util
 import os
 import time
 from itertools import chain
@@ -81,9 +82,38 @@ COLUMN_NAMES = [
 ]
 
 
+# the writer config keys and their checks live in analyze/geoparquet.py, the one list of them
+GEOPARQUET = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "analyze", "geoparquet.py"
+)
+
+
+def load_writer_config(path: str) -> Dict[str, Any]:
+    """Per column pyarrow writer settings from a JSON file made by analyze/tune.py -a compression,
+    read with writer_options() from analyze/geoparquet.py. Unknown keys raise a ValueError here
+    instead of failing deep inside pyarrow on a write."""
+    if not path:
+        return None
+    spec = importlib.util.spec_from_file_location("geoparquet", GEOPARQUET)
+    geoparquet = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(geoparquet)
+    return geoparquet.writer_options(path)
+
+
 def save_buffer_to_parquet(
-    column_data: List[List[Any]], output_dir: str, file_counter: int
+    column_data: List[List[Any]],
+    output_dir: str,
+    file_counter: int,
+    geometry_encoding: str = "WKB",
+    writer_options: Dict[str, Any] = None,
 ) -> None:
+    """Write one buffer of columns to a parquet file. geometry_encoding is WKB or geoarrow, the
+    GeoArrow native encoding needs one geometry family per file so mixed buffers fall back to WKB.
+    writer_options are pyarrow writer settings, such as from load_writer_config(), and replace the
+    default snappy compression. A page index is written unless the settings turn it off, so readers
+    can skip pages of StartTime, EndTime and the MBR columns inside a row group."""
+    writer_options = writer_options or {"compression": "snappy"}
+    writer_options = {"write_page_index": True, **writer_options}
     logger = logging.getLogger(__name__)
     if not column_data:
         logger.warn(f"save_buffer_to_parquet: no.{file_counter} - No data to save")
@@ -107,9 +137,23 @@ def save_buffer_to_parquet(
 
         # Write the DataFrame to Parquet if there is data
         if not gdf.empty:
-            gdf.to_parquet(
-                output_file, engine="pyarrow", index=False, compression="snappy"
-            )
+            try:
+                gdf.to_parquet(
+                    output_file,
+                    engine="pyarrow",
+                    index=False,
+                    geometry_encoding=geometry_encoding,
+                    **writer_options,
+                )
+            except ValueError as e:
+                if geometry_encoding == "WKB":
+                    raise
+                logger.warning(
+                    f"save_buffer_to_parquet: no.{file_counter} - {e}, writing WKB instead"
+                )
+                gdf.to_parquet(
+                    output_file, engine="pyarrow", index=False, **writer_options
+                )
             end_time = time.time()
             logger.info(
                 f"save_buffer_to_parquet: no.{file_counter} - duration={end_time - start_time:.2f}s"
@@ -14,6 +14,8 @@ import pyarrow.parquet as pq
 from shapely.geometry import Point, Polygon, LineString
 from shapely import wkb
 
+from writer_config import load_writer_options
+
 # Need this for processing the blob columns
 oracledb.defaults.fetch_lobs = False
 
@@ -24,6 +26,9 @@ STARTING_COLLECTIONS_OFFSET = 7 # Change which collection to start at (good for
 MAX_WORKERS_PER_PROVIDER = 20  # Adjust as needed, 1 collection given per worker
 GRANULE_BATCH_SIZE = 5000 # Number of granules pulled at once from DB and accumulated for parquet file write
 TARGET_SIZE_BYTES = 100 * 1024 * 1024  # Target ~size of DataFrame before writing to parquet file (1MB = 1024*1024)
+GEOMETRY_ENCODING = 'WKB' # or 'geoarrow' for GeoArrow native coordinates, needs one geometry family per file
+WRITER_CONFIG = None # path to a JSON writer config from analyze/tune.py -a compression, default is snappy
+WRITER_OPTIONS = load_writer_options(WRITER_CONFIG) # read and checked once, not on every write
 #TARGET_PARQUET_ROWS = GRANULE_BATCH_SIZE * 4 # Target size of parquet file in number of 'rows'
 
 # Oracle DB env variables -- use read-only user!
@@ -211,7 +216,14 @@ def write_parquet(output_dir, gdf, collection_concept_id, gran_offset):
 
         # Use a temporary file name while writing so as to not interfere with reader programs running simultaneously
         temp_file_path = output_path + '.tmp'
-        gdf.to_parquet(temp_file_path, engine='pyarrow', compression='snappy', index=False)
+        try:
+            gdf.to_parquet(temp_file_path, engine='pyarrow', index=False,
+                geometry_encoding=GEOMETRY_ENCODING, **WRITER_OPTIONS)
+        except ValueError as e:
+            if GEOMETRY_ENCODING == 'WKB':
+                raise
+            print(f"Can not write {GEOMETRY_ENCODING} ({e}), writing WKB instead")
+            gdf.to_parquet(temp_file_path, engine='pyarrow', index=False, **WRITER_OPTIONS)
         
         # Atomically rename the file once it's fully written
         os.rename(temp_file_path, output_path)
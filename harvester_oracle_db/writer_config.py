@@ -0,0 +1,21 @@
+import importlib.util
+import os
+
+# the writer config keys and their checks live in analyze/geoparquet.py, the one list of them
+GEOPARQUET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analyze', 'geoparquet.py')
+
+
+def load_geoparquet():
+    """The analyze/geoparquet.py module, loaded from its file as analyze is not a package."""
+    spec = importlib.util.spec_from_file_location('geoparquet', GEOPARQUET)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_writer_options(path):
+    """Writer options for to_parquet() from a JSON writer config made by analyze/tune.py -a
+    compression, snappy when there is no config. A page index is written unless the config turns it
+    off, so readers can skip pages of the time columns inside a row group. Unknown keys fail here,
+    when the harvester starts, instead of deep inside pyarrow on the first write."""
+    return load_geoparquet().writer_options(path, compression='snappy', write_page_index=True)
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+
+'''
+Generate a synthetic granule dataset which looks like the output of the Elasticsearch harvester so
+that layout and engine experiments can be run on hosts which can not reach S3, Elasticsearch, or
+Oracle. Rows are written as GeoParquet using the same columns as harvester_elasticsearch/util.py.
+
+Every output file is generated from its own child seed, so the same --seed will produce the same
+files no matter how many workers are used. Each worker only holds one batch in memory at a time.
+
+example run:
+
+./generate.py --rows 10000000 --output data_synthetic --seed 42 --workers 8
+'''
+
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely
+
+# ################################################################################################ #
+# Mark: - Schema
+
+# These must match harvester_elasticsearch/util.py COLUMN_NAMES, including the order, geometry last
+COLUMN_NAMES = [
+    "GranuleUR",
+    "StartTime",
+    "EndTime",
+    "ConceptId",
+    "CollectionConceptId",
+    "CoordinateSystem",
+    "DayNight",
+    "EntryTitle",
+    "MetadataFormat",
+    "NativeId",
+    "ProviderId",
+    "ReadableGranuleNameSort",
+    "ShortNameLowercase",
+    "TwoDCoordName",
+    "VersionIdLowercase",
+    "UpdateTime",
+    "CreatedAt",
+    "ProductionDate",
+    "RevisionDate",
+    "RevisionId",
+    "Size",
+    "CloudCover",
+    "LRCrossesAntimeridian",
+    "LREast",
+    "LRNorth",
+    "LRSouth",
+    "LRWest",
+    "MBRCrossesAntimeridian",
+    "MBREast",
+    "MBRNorth",
+    "MBRSouth",
+    "MBRWest",
+    "geometry",  # This must go last
+]
+
+# Types as they come out of the Elasticsearch harvester, dates are kept as ISO strings
+SCHEMA = pa.schema(
+    [(name, pa.string()) for name in COLUMN_NAMES[:19]]
+    + [("RevisionId", pa.int64()),
+        ("Size", pa.float64()),
+        ("CloudCover", pa.float64()),
+        ("LRCrossesAntimeridian", pa.bool_()),
+        ("LREast", pa.float64()),
+        ("LRNorth", pa.float64()),
+        ("LRSouth", pa.float64()),
+        ("LRWest", pa.float64()),
+        ("MBRCrossesAntimeridian", pa.bool_()),
+        ("MBREast", pa.float64()),
+        ("MBRNorth", pa.float64()),
+        ("MBRSouth", pa.float64()),
+        ("MBRWest", pa.float64()),
+        ("geometry", pa.binary())])
+
+assert SCHEMA.names == COLUMN_NAMES, "synthetic schema out of sync with the harvester"
+
+SHAPE_KINDS = ['swath', 'tile', 'point', 'global']
+PROVIDERS = ['LPCLOUD', 'NSIDC_ECS', 'GES_DISC', 'POCLOUD', 'LAADS', 'ORNL_CLOUD', 'ASF', 'OB_DAAC']
+DAY_NIGHT = ['DAY', 'NIGHT', 'BOTH', 'UNSPECIFIED']
+
+# ################################################################################################ #
+# Mark: - Collections
+
+def parse_mix(raw:str) -> np.ndarray:
+    ''' Turn 'swath=0.5,tile=0.3' into a normalized probability for each of SHAPE_KINDS. '''
+    weights = dict.fromkeys(SHAPE_KINDS, 0.0)
+    for part in raw.split(','):
+        name, value = part.split('=')
+        if name not in weights:
+            raise ValueError(f"Unknown shape kind '{name}', expected one of {SHAPE_KINDS}")
+        weights[name] = float(value)
+    total = sum(weights.values())
+    return np.array([weights[k] / total for k in SHAPE_KINDS])
+
+def make_collections(args:argparse.Namespace) -> dict:
+    '''
+    Build the table of collections that every worker shares. Collection sizes follow a zipf like
+    curve so that a few collections own most of the granules, as they do in CMR.
+    '''
+    rng = np.random.default_rng([args.seed, 0])
+    count = args.collections
+    rank = np.arange(1, count + 1, dtype=np.float64)
+    weight = 1.0 / np.power(rank, args.collection_skew)
+    rng.shuffle(weight)
+
+    begin = np.datetime64(args.time_range.split('/')[0], 'ms')
+    end = np.datetime64(args.time_range.split('/')[1], 'ms')
+    span = (end - begin).astype(np.int64)
+    # collections start at different points in the range, most are older than the end of the range
+    first = begin + (span * rng.uniform(0.0, 0.9, count)).astype('timedelta64[ms]')
+
+    providers = np.array(PROVIDERS)[rng.integers(0, len(PROVIDERS), count)]
+    numbers = np.arange(count) + 1200000000
+    short_names = np.char.add('synth_', np.char.mod('%05d', np.arange(count)))
+
+    return {
+        'weight': weight / weight.sum(),
+        'kind': rng.choice(len(SHAPE_KINDS), size=count, p=parse_mix(args.mix)),
+        'first': first,
+        'end': end,
+        # granule length in minutes, swaths are 5 minutes, tiles are daily
+        'minutes': rng.choice([5, 50, 99, 1440], size=count, p=[0.5, 0.2, 0.1, 0.2]),
+        'swath_length': rng.uniform(10.0, 30.0, count),
+        'swath_width': rng.uniform(5.0, 25.0, count),
+        # a few stations per point collection, points jitter around one of them
+        'station_lon': rng.uniform(-180.0, 180.0, (count, 4)),
+        'station_lat': np.degrees(np.arcsin(rng.uniform(-0.95, 0.95, (count, 4)))),
+        'tile_h': rng.integers(0, 36, (count, 2)),
+        'tile_v': rng.integers(2, 16, (count, 2)),
+        'provider': pa.array(providers),
+        'concept_id': pc.binary_join_element_wise(
+            'C', pc.cast(pa.array(numbers), pa.string()), '-', pa.array(providers), ''),
+        'short_name': pa.array(short_names),
+        'entry_title': pa.array(np.char.add('Synthetic granule collection ', short_names)),
+        'format': pa.array(rng.choice(['ECHO10', 'UMM_JSON', 'ISO19115'], count, p=[.6, .3, .1])),
+    }
+
+# ################################################################################################ #
+# Mark: - Geometry
+
+def wrap(lon:np.ndarray) -> np.ndarray:
+    ''' Bring longitudes back into the -180 to 180 range. '''
+    return ((lon + 180.0) % 360.0) - 180.0
+
+def box_coords(west, south, east, north, per_side:int=1) -> np.ndarray:
+    ''' Closed rings of boxes, shaped (n, 4*per_side+1, 2), optionally densified. '''
+    steps = np.linspace(0.0, 1.0, per_side, endpoint=False)
+    xs = np.concatenate([west[:, None] + (east - west)[:, None] * steps,
+        np.repeat(east[:, None], per_side, axis=1),
+        east[:, None] - (east - west)[:, None] * steps,
+        np.repeat(west[:, None], per_side, axis=1),
+        west[:, None]], axis=1)
+    ys = np.concatenate([np.repeat(south[:, None], per_side, axis=1),
+        south[:, None] + (north - south)[:, None] * steps,
+        np.repeat(north[:, None], per_side, axis=1),
+        north[:, None] - (north - south)[:, None] * steps,
+        south[:, None]], axis=1)
+    return np.stack([xs, ys], axis=-1)
+
+def swaths(rng:np.random.Generator, collections:dict, idx:np.ndarray, per_side:int) -> tuple:
+    '''
+    Polar orbiting swaths: a rotated strip around a random center. Longitudes are wrapped the
+    same way the harvester leaves them, so swaths over the antimeridian span the whole globe in
+    planar terms and the MBR has west > east.
+    '''
+    n = len(idx)
+    lat = np.degrees(np.arcsin(rng.uniform(-0.97, 0.97, n)))
+    lon = rng.uniform(-180.0, 180.0, n)
+    heading = np.radians(rng.uniform(-12.0, 12.0, n) + rng.choice([0.0, 180.0], n))
+    half_length = collections['swath_length'][idx] / 2.0
+    half_width = collections['swath_width'][idx] / 2.0
+
+    # walk along both long edges of the strip, then close the ring
+    along = np.concatenate([np.linspace(-1.0, 1.0, per_side + 1),
+        np.linspace(1.0, -1.0, per_side + 1), [-1.0]])
+    across = np.concatenate([np.full(per_side + 1, -1.0), np.full(per_side + 1, 1.0), [-1.0]])
+    dy = (along[None, :] * half_length[:, None] * np.cos(heading)[:, None]
+        - across[None, :] * half_width[:, None] * np.sin(heading)[:, None])
+    dx = (along[None, :] * half_length[:, None] * np.sin(heading)[:, None]
+        + across[None, :] * half_width[:, None] * np.cos(heading)[:, None])
+    ys = np.clip(lat[:, None] + dy, -89.9, 89.9)
+    # swaths widen in degrees of longitude as they approach the poles
+    xs = lon[:, None] + dx / np.maximum(np.cos(np.radians(ys)), 0.2)
+
+    raw_west, raw_east = xs.min(axis=1), xs.max(axis=1)
+    crosses = (raw_west < -180.0) | (raw_east > 180.0)
+    coords = np.stack([wrap(xs), ys], axis=-1)
+    mbr = (wrap(raw_west), ys.min(axis=1), wrap(raw_east), ys.max(axis=1))
+    return shapely.polygons(coords), mbr, crosses
+
+def tiles(rng:np.random.Generator, collections:dict, idx:np.ndarray) -> tuple:
+    ''' MODIS like 10 degree grid tiles, each collection covers a patch of tiles. '''
+    n = len(idx)
+    h = collections['tile_h'][idx, 0] + rng.integers(0, 4, n)
+    v = collections['tile_v'][idx, 0] + rng.integers(0, 3, n)
+    west = -180.0 + 10.0 * (h % 36)
+    north = 90.0 - 10.0 * np.clip(v, 0, 17)
+    east, south = west + 10.0, north - 10.0
+    mbr = (west, south, east, north)
+    return shapely.polygons(box_coords(west, south, east, north, per_side=2)), mbr, np.zeros(n, bool)
+
+def points(rng:np.random.Generator, collections:dict, idx:np.ndarray) -> tuple:
+    ''' In-situ style points scattered around a few stations per collection. '''
+    n = len(idx)
+    station = rng.integers(0, 4, n)
+    lon = wrap(collections['station_lon'][idx, station] + rng.normal(0.0, 0.5, n))
+    lat = np.clip(collections['station_lat'][idx, station] + rng.normal(0.0, 0.5, n), -90, 90)
+    return shapely.points(lon, lat), (lon, lat, lon, lat), np.zeros(n, bool)
+
+def globals_(idx:np.ndarray) -> tuple:
+    ''' Granules covering the whole earth, such as model output. '''
+    n = len(idx)
+    west, south = np.full(n, -180.0), np.full(n, -90.0)
+    east, north = np.full(n, 180.0), np.full(n, 90.0)
+    mbr = (west, south, east, north)
+    return shapely.polygons(box_coords(west, south, east, north)), mbr, np.zeros(n, bool)
+
+# ################################################################################################ #
+# Mark: - Batches
+
+def iso(times:np.ndarray) -> pa.Array:
+    ''' Format datetime64 values the way Elasticsearch returns them. '''
+    return pa.array(np.char.add(np.datetime_as_string(times, unit='ms'), 'Z'))
+
+def make_batch(rng:np.random.Generator, collections:dict, first_row:int, rows:int,
+    args:argparse.Namespace) -> pa.RecordBatch:
+    ''' Create one record batch of granules. '''
+    idx = rng.choice(len(collections['weight']), size=rows, p=collections['weight'])
+    kind = collections['kind'][idx]
+
+    # start times lean toward the end of each collection's life, there is more recent data
+    first = collections['first'][idx]
+    span = (collections['end'] - first).astype(np.int64)
+    offset = (span * rng.beta(args.time_skew, 1.0, rows)).astype('timedelta64[ms]')
+    start = (first + offset).astype('datetime64[s]').astype('datetime64[ms]')
+    stop = start + (collections['minutes'][idx] * 60_000).astype('timedelta64[ms]')
+    lag = (rng.exponential(3.0, rows) * 86_400_000).astype('timedelta64[ms]')
+
+    geometry = np.empty(rows, dtype=object)
+    west, south, east, north = (np.zeros(rows) for _ in range(4))
+    crosses = np.zeros(rows, dtype=bool)
+    for code, name in enumerate(SHAPE_KINDS):
+        mask = kind == code
+        if not mask.any():
+            continue
+        if name == 'swath':
+            geoms, mbr, cross = swaths(rng, collections, idx[mask], args.swath_vertices)
+        elif name == 'tile':
+            geoms, mbr, cross = tiles(rng, collections, idx[mask])
+        elif name == 'point':
+            geoms, mbr, cross = points(rng, collections, idx[mask])
+        else:
+            geoms, mbr, cross = globals_(idx[mask])
+        geometry[mask] = geoms
+        west[mask], south[mask], east[mask], north[mask] = mbr
+        crosses[mask] = cross
+
+    # the largest interior rectangle is a shrunken MBR, points and globals keep their MBR
+    inset = np.where((kind == 0) | (kind == 1), 0.25, 0.0)
+    width = np.where(crosses, east + 360.0 - west, east - west)
+    lr_west = wrap(west + width * inset)
+    lr_east = wrap(east - width * inset)
+    lr_south = south + (north - south) * inset
+    lr_north = north - (north - south) * inset
+
+    serial = pa.array(np.arange(first_row, first_row + rows) + 1000000000)
+    take = lambda name: pc.take(collections[name], pa.array(idx))
+    provider = take('provider')
+    start_text = iso(start)
+    compact = pc.replace_substring_regex(pc.utf8_slice_codeunits(start_text, 0, 19), r'[-:T]', '')
+    granule_ur = pc.utf8_lower(pc.binary_join_element_wise(take('short_name'), '.a', compact, '.',
+        pc.cast(serial, pa.string()), ''))
+    cloud = rng.uniform(0.0, 100.0, rows)
+
+    columns = {
+        'GranuleUR': granule_ur,
+        'StartTime': start_text,
+        'EndTime': iso(stop),
+        'ConceptId': pc.binary_join_element_wise('G', pc.cast(serial, pa.string()), '-', provider,
+            ''),
+        'CollectionConceptId': take('concept_id'),
+        'CoordinateSystem': pa.array(np.where(kind == 0, 'GEODETIC', 'CARTESIAN')),
+        'DayNight': pa.array(np.array(DAY_NIGHT)[rng.integers(0, len(DAY_NIGHT), rows)]),
+        'EntryTitle': take('entry_title'),
+        'MetadataFormat': take('format'),
+        'NativeId': granule_ur,
+        'ProviderId': provider,
+        'ReadableGranuleNameSort': granule_ur,
+        'ShortNameLowercase': take('short_name'),
+        'TwoDCoordName': pa.array(np.where(kind == 1, 'MODIS Tile SIN', None)),
+        'VersionIdLowercase': pa.array(np.full(rows, '061')),
+        'UpdateTime': iso(stop + lag * 2),
+        'CreatedAt': iso(stop + lag),
+        'ProductionDate': iso(stop + lag // 2),
+        'RevisionDate': iso(stop + lag * 2),
+        'RevisionId': pa.array(rng.geometric(0.6, rows)),
+        'Size': pa.array(np.round(rng.lognormal(3.0, 1.5, rows), 3)),
+        'CloudCover': pa.array(np.round(cloud, 2), mask=(kind == 2) | (kind == 3)),
+        'LRCrossesAntimeridian': pa.array(crosses),
+        'LREast': pa.array(lr_east),
+        'LRNorth': pa.array(lr_north),
+        'LRSouth': pa.array(lr_south),
+        'LRWest': pa.array(lr_west),
+        'MBRCrossesAntimeridian': pa.array(crosses),
+        'MBREast': pa.array(east),
+        'MBRNorth': pa.array(north),
+        'MBRSouth': pa.array(south),
+        'MBRWest': pa.array(west),
+        'geometry': pa.array(shapely.to_wkb(geometry), type=pa.binary()),
+    }
+    return pa.RecordBatch.from_arrays([pc.cast(columns[f.name], f.type) for f in SCHEMA],
+        schema=SCHEMA)
+
+# ################################################################################################ #
+# Mark: - Files
+
+def geo_metadata(args:argparse.Namespace) -> bytes:
+    '''
+    GeoParquet 1.1 file metadata, the CRS is left off which means OGC:CRS84. The geometry types
+    are known from the shape mix up front so the metadata can go into the schema before writing.
+    '''
+    kinds = [name for name, share in zip(SHAPE_KINDS, parse_mix(args.mix)) if share > 0]
+    types = sorted({'Point' if kind == 'point' else 'Polygon' for kind in kinds})
+    geo = {'version': '1.1.0',
+        'primary_column': 'geometry',
+        'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': types}}}
+    return json.dumps(geo).encode('utf-8')
+
+def write_file(file_index:int, seed:np.random.SeedSequence, first_row:int, rows:int,
+    args:argparse.Namespace) -> tuple[str, int, int]:
+    ''' Generate and write one output file, returns the path, rows, and milliseconds taken. '''
+    mark_start = int(time.time() * 1000)
+    rng = np.random.default_rng(seed)
+    collections = make_collections(args)
+    path = os.path.join(args.output, f"synthetic_{file_index:05d}.parquet")
+    temp_path = path + '.tmp'
+
+    schema = SCHEMA.with_metadata({'geo': geo_metadata(args)})
+    written = 0
+    with pq.ParquetWriter(temp_path, schema, compression=args.compression) as writer:
+        while written < rows:
+            size = min(args.batch_rows, rows - written)
+            batch = make_batch(rng, collections, first_row + written, size, args)
+            writer.write_batch(batch.replace_schema_metadata(schema.metadata),
+                row_group_size=args.row_group_size)
+            written += size
+    os.rename(temp_path, path)
+
+    mark_stop = int(time.time() * 1000)
+    return path, written, mark_stop - mark_start
+
+def run(args:argparse.Namespace):
+    ''' Split the requested rows into files and generate them in parallel. '''
+    mark_start = int(time.time() * 1000)
+    os.makedirs(args.output, exist_ok=True)
+
+    file_count = (args.rows + args.rows_per_file - 1) // args.rows_per_file
+    seeds = np.random.SeedSequence(args.seed).spawn(file_count)
+    total = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = []
+        for i in range(file_count):
+            first_row = i * args.rows_per_file
+            rows = min(args.rows_per_file, args.rows - first_row)
+            futures.append(executor.submit(write_file, i, seeds[i], first_row, rows, args))
+        for future in concurrent.futures.as_completed(futures):
+            path, rows, took = future.result()
+            total += rows
+            print(f"wrote {rows} rows to {path} in {took}ms, {total} of {args.rows}")
+
+    mark_stop = int(time.time() * 1000)
+    print(f"Generated {total} rows in {file_count} files in {mark_stop-mark_start}ms")
+
+# ################################################################################################ #
+# Mark: - Command functions
+
+def handle_args() -> argparse.Namespace:
+    ''' Process all the command line arguments and return an argparse Namespace object. '''
+    parser = argparse.ArgumentParser(description="Generate a synthetic granule GeoParquet dataset")
+
+    parser.add_argument("-r", "--rows", type=int, default=1_000_000,
+        help='Total number of rows to generate.')
+    parser.add_argument("-o", "--output", default='data_synthetic',
+        help='Directory to write parquet files to.')
+    parser.add_argument("-s", "--seed", type=int, default=42,
+        help='Seed, the same seed always produces the same files.')
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+        help='Number of worker processes.')
+    parser.add_argument("--rows-per-file", type=int, default=1_000_000,
+        help='Rows in each output file.')
+    parser.add_argument("--batch-rows", type=int, default=100_000,
+        help='Rows generated at a time, bounds the memory used by each worker.')
+    parser.add_argument("--row-group-size", type=int, default=100_000,
+        help='Parquet row group size.')
+    parser.add_argument("--compression", default='snappy', help='Parquet compression codec.')
+    parser.add_argument("--collections", type=int, default=500,
+        help='Number of collections to spread granules over.')
+    parser.add_argument("--collection-skew", type=float, default=1.2,
+        help='Zipf exponent for collection sizes, 0 makes all collections the same size.')
+    parser.add_argument("--time-range", default='2012-01-01/2021-07-05',
+        help='start/end dates for granule StartTime.')
+    parser.add_argument("--time-skew", type=float, default=2.0,
+        help='Beta shape pushing StartTime to recent dates, 1 is uniform.')
+    parser.add_argument("--mix", default='swath=0.55,tile=0.25,point=0.15,global=0.05',
+        help='Share of collections for each kind of shape: swath, tile, point, global.')
+    parser.add_argument("--swath-vertices", type=int, default=10,
+        help='Vertices along each long edge of a swath polygon.')
+
+    args = parser.parse_args()
+    return args
+
+def main():
+    ''' Be a command line app. '''
+    args = handle_args()
+    run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+'''
+Stream a parquet dataset into the nested geohash buckets of bucket-brigade-nested.ipynb. Each row
+goes in the deepest geohash cell holding its whole envelope, like 4/0/1, or a hemisphere bucket
+such as SW-NW, or global. The notebook walked the rows one at a time with pandas and took hours;
+here each record batch gets its buckets from the vectorized functions in geohash_bin.py and is
+split up with one sort.
+
+Rows wait in a buffer for each bucket and are written out a row group at a time, by a pool of
+threads, to at most --max-open files at once. When a bucket whose file was closed to make room
+gets more rows it starts a new file, so a bucket directory can hold data0001.parquet,
+data0002.parquet, and so on. Each bucket directory also gets an info.json with its bounds and row
+count.
+
+Envelopes come from a bbox struct column, the MBR columns, or the geometry, in that order.
+
+example run:
+
+ ./bucket_brigade.py '../../data/*.parquet' -o ../../data/buckets --depth 3
+'''
+
+import argparse
+import collections
+import concurrent.futures
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import shapely
+
+import geohash_bin
+
+# columns envelopes() can use, in the order it tries them
+ENVELOPE_COLUMNS = [['bbox'], ['MBRWest', 'MBRSouth', 'MBREast', 'MBRNorth'], ['geometry']]
+
+# ################################################################################################ #
+# Mark: - Functions
+
+def source_files(source: str) -> str | list[str]:
+    ''' A file or directory as given, or every file a glob matches, as pyarrow does not glob. '''
+    if not glob.has_magic(source):
+        return source
+    found = sorted(glob.glob(source, recursive=True))
+    if not found:
+        raise FileNotFoundError(f"No files match {source}")
+    return found
+
+def envelopes(table: pa.Table) -> tuple:
+    ''' minx, miny, maxx, maxy arrays for a table, minx > maxx when crossing the antimeridian. '''
+    if 'bbox' in table.column_names:
+        bbox = table.column('bbox').combine_chunks()
+        return tuple(bbox.field(name).to_numpy(zero_copy_only=False).astype(np.float64)
+            for name in ['xmin', 'ymin', 'xmax', 'ymax'])
+    if 'MBRWest' in table.column_names:
+        return tuple(table.column(name).to_numpy().astype(np.float64)
+            for name in ['MBRWest', 'MBRSouth', 'MBREast', 'MBRNorth'])
+    geometry = shapely.from_wkb(table.column('geometry').to_numpy(zero_copy_only=False))
+    return tuple(shapely.bounds(geometry).T)
+
+class BucketWriters():
+    '''
+    Buffer rows for each bucket and write them out with a bounded number of open files. Files are
+    written by a pool of threads, each bucket by only one thread at a time.
+    '''
+
+    def __init__(self, directory: str, schema: pa.Schema, max_open: int = 64,
+        row_group_size: int = 100_000, buffer_rows: int = 2_000_000, threads: int = 4,
+        file_rows: int = None, bounds = geohash_bin.path_bounds, **options):
+        '''
+        A bucket starts a new file after file_rows rows when it is set. bounds gives the extent of
+        a bucket for its info.json. options are passed on to pyarrow.parquet.ParquetWriter, like
+        compression.
+        '''
+        self.directory = directory
+        self.schema = schema
+        self.max_open = max_open
+        self.row_group_size = row_group_size
+        self.buffer_rows = buffer_rows
+        self.file_rows = file_rows
+        self.bounds = bounds
+        self.options = options
+        self.pool = concurrent.futures.ThreadPoolExecutor(threads)
+        self.pending = collections.defaultdict(list)
+        self.pending_rows = collections.Counter()
+        self.open = collections.OrderedDict()
+        self.files = collections.Counter()
+        self.rows = collections.Counter()
+        self.in_file = collections.Counter()
+        self.closing = []
+        self.paths = collections.defaultdict(list)
+
+    def writer(self, bucket: str) -> pq.ParquetWriter:
+        ''' The open writer for a bucket, closing the least recently used if too many are open. '''
+        if bucket in self.open:
+            self.open.move_to_end(bucket)
+            return self.open[bucket]
+        while len(self.open) >= self.max_open:
+            # a job may still be writing to it, so close it once the jobs are done
+            self.closing.append(self.open.popitem(last=False)[1])
+        folder = os.path.join(self.directory, bucket)
+        os.makedirs(folder, exist_ok=True)
+        self.files[bucket] += 1
+        path = os.path.join(folder, f"data{self.files[bucket]:04d}.parquet")
+        self.open[bucket] = pq.ParquetWriter(path, self.schema, **self.options)
+        self.paths[bucket].append(path)
+        self.in_file[bucket] = 0
+        return self.open[bucket]
+
+    def full(self, bucket: str) -> bool:
+        ''' True when the bucket's open file has all the rows it should. '''
+        return self.file_rows is not None and self.in_file[bucket] >= self.file_rows
+
+    def write(self, bucket: str, table: pa.Table) -> list:
+        '''
+        Hand rows for a bucket to the pool, cutting them across files when file_rows is set.
+        Returns the jobs. Only called on this thread so the open writers do not change under a job.
+        '''
+        jobs = []
+        while table.num_rows:
+            if bucket in self.open and self.full(bucket):
+                self.closing.append(self.open.pop(bucket))
+            writer = self.writer(bucket)
+            room = table.num_rows
+            if self.file_rows is not None:
+                room = self.file_rows - self.in_file[bucket]
+            jobs.append(self.pool.submit(writer.write_table, table.slice(0, room),
+                row_group_size=self.row_group_size))
+            self.in_file[bucket] += min(room, table.num_rows)
+            table = table.slice(room)
+        return jobs
+
+    def add(self, bucket: str, table: pa.Table):
+        ''' Buffer rows for a bucket. '''
+        self.pending[bucket].append(table)
+        self.pending_rows[bucket] += table.num_rows
+        self.rows[bucket] += table.num_rows
+
+    def flush(self, final: bool = False):
+        '''
+        Write every bucket with a full row group waiting, and when the buffer is over buffer_rows
+        the largest buckets too, or everything when final.
+        '''
+        ready = [bucket for bucket, rows in self.pending_rows.items()
+            if rows >= self.row_group_size]
+        waiting = sum(self.pending_rows.values())
+        if final:
+            ready = list(self.pending_rows)
+        elif waiting > self.buffer_rows:
+            for bucket, rows in self.pending_rows.most_common():
+                if waiting <= self.buffer_rows / 2:
+                    break
+                if bucket not in ready:
+                    ready.append(bucket)
+                waiting -= rows
+        # open files on this thread so only it changes the open writers, then write in parallel
+        ready = ready[:self.max_open]
+        jobs = []
+        for bucket in ready:
+            table = pa.concat_tables(self.pending.pop(bucket))
+            del self.pending_rows[bucket]
+            jobs.extend(self.write(bucket, table))
+        for job in jobs:
+            job.result()
+        for job in [self.pool.submit(writer.close) for writer in self.closing]:
+            job.result()
+        self.closing = []
+        if final and self.pending_rows:
+            self.flush(final)
+
+    def close(self):
+        ''' Write out everything left, close all the files, and write each bucket's info.json. '''
+        self.flush(final=True)
+        for job in [self.pool.submit(writer.close) for writer in self.open.values()]:
+            job.result()
+        self.open.clear()
+        self.pool.shutdown()
+        for bucket, rows in self.rows.items():
+            details = {'bucket': bucket, 'bounds': self.bounds(bucket), 'rows': rows,
+                'files': self.files[bucket]}
+            path = os.path.join(self.directory, bucket, 'info.json')
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(details, file)
+
+def partition(args: argparse.Namespace) -> str:
+    ''' Stream the source into nested buckets and report how the rows were spread out. '''
+    mark_start = time.time()
+    dataset = ds.dataset(source_files(args.source), format='parquet')
+    writers = BucketWriters(args.output, dataset.schema, args.max_open, args.row_group_size,
+        args.buffer_rows, args.threads, compression=args.compression)
+    for batch in dataset.to_batches(batch_size=args.batch_rows):
+        table = pa.Table.from_batches([batch])
+        labels, ids = geohash_bin.hash_path_ids(*envelopes(table), depth=args.depth)
+        order = np.argsort(ids, kind='stable')
+        starts = np.flatnonzero(np.diff(ids[order], prepend=-1))
+        stops = np.append(starts[1:], len(order))
+        grouped = table.take(order)
+        for start, stop in zip(starts, stops):
+            writers.add(labels[ids[order[start]]], grouped.slice(start, stop - start))
+        writers.flush()
+    writers.close()
+
+    rows = sum(writers.rows.values())
+    top = ', '.join(f"{bucket}={count}" for bucket, count in writers.rows.most_common(5))
+    return (f"Wrote {rows} rows into {len(writers.rows)} buckets and {sum(writers.files.values())} "
+        f"files in {time.time() - mark_start:.1f}s, largest: {top}")
+
+# ################################################################################################ #
+# testing
+
+def partition_test():
+    ''' Every row lands in one bucket file and deep buckets really hold their rows. '''
+    import tempfile
+    rng = np.random.default_rng(7)
+    x = rng.uniform(-179, 170, 5000)
+    y = rng.uniform(-89, 80, 5000)
+    size = rng.choice([0.01, 1.0, 40.0], 5000)
+    geometry = shapely.to_wkb(shapely.box(x, y, x + size, y + size))
+    table = pa.table({'id': np.arange(5000), 'geometry': pa.array(geometry, type=pa.binary())})
+    with tempfile.TemporaryDirectory() as temp:
+        pq.write_table(table, os.path.join(temp, 'in.parquet'))
+        args = argparse.Namespace(source=os.path.join(temp, 'in.parquet'),
+            output=os.path.join(temp, 'out'), depth=3, batch_rows=700, max_open=4,
+            row_group_size=100, buffer_rows=1000, threads=2, compression='zstd')
+        partition(args)
+        seen = []
+        for folder, _, names in os.walk(args.output):
+            bucket = os.path.relpath(folder, args.output)
+            for name in [name for name in names if name.endswith('.parquet')]:
+                part = pq.read_table(os.path.join(folder, name))
+                seen.extend(part.column('id').to_pylist())
+                if bucket not in geohash_bin.HEMISPHERE_BOUNDS and bucket != 'empty':
+                    west, south, east, north = geohash_bin.path_bounds(bucket)
+                    bounds = shapely.bounds(shapely.from_wkb(part.column('geometry').to_numpy(
+                        zero_copy_only=False)))
+                    assert (bounds[:, 0] >= west).all() and (bounds[:, 2] <= east).all()
+                    assert (bounds[:, 1] >= south).all() and (bounds[:, 3] <= north).all()
+        assert sorted(seen) == list(range(5000))
+
+#partition_test()
+
+# ################################################################################################ #
+# Mark: - Command functions
+
+def handle_args() -> argparse.Namespace:
+    ''' Process all the command line arguments and return an argparse Namespace object. '''
+    parser = argparse.ArgumentParser(description="Partition parquet into nested geohash buckets")
+
+    # Add command-line arguments
+    parser.add_argument("source", help='Parquet file, directory, or glob to partition.')
+    parser.add_argument("-o", "--output", required=True, help='Directory for the buckets.')
+    parser.add_argument("-d", "--depth", default=3, type=int,
+        help='Most geohash characters, and so directory levels, in a bucket path.')
+    parser.add_argument("--batch-rows", default=256 * 1024, type=int, help='Rows read at a time.')
+    parser.add_argument("--max-open", default=64, type=int, help='Most files open at once.')
+    parser.add_argument("-r", "--row-group-size", default=100_000, type=int,
+        help='Rows in each row group.')
+    parser.add_argument("--buffer-rows", default=2_000_000, type=int,
+        help='Rows to hold before writing out partly full row groups of the largest buckets.')
+    parser.add_argument("-t", "--threads", default=4, type=int, help='Threads writing files.')
+    parser.add_argument("--compression", default='zstd', help='Parquet compression.')
+
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+def main():
+    ''' Be a command line app. '''
+    args = handle_args()
+    print(partition(args))
+
+if __name__ == "__main__":
+    main()
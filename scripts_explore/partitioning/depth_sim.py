@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+'''
+Simulate the nested geohash buckets of bucket_brigade.py at several depths without writing any
+files, to answer whether the tree should be 2, 3, 4, or 5 levels deep. The Go and Rust geohash-depth
+tools count the rows in each bucket for one depth, here every depth is worked out in the same pass
+over the envelope columns using the vectorized functions in geohash_bin.py.
+
+For each depth the report gives:
+
+* files, one per bucket or more when --file-rows splits them
+* the spread of file sizes, in rows and in MB estimated from the average row size
+* the share of rows at full depth, in a parent cell, a hemisphere bucket, or global, rows forced
+  out of the deepest cells are read by every query over their larger area
+* with --suite, for each test suite the mean files a query touches and the share of rows in them
+
+Suites, JSON or YAML, are read with the tester's own test_config.py so tests made from templates
+are counted too. Query boxes are taken from the bbox and geometry operations of each test, and from
+WKT in raw SQL.
+
+example run:
+
+ ./depth_sim.py '../../data/*.parquet' --depths 1,2,3,4,5 --suite ../../tester/suite7.json \\
+    --suite ../../tester/suite.json --csv depths.csv
+'''
+
+import argparse
+import collections
+import csv
+import importlib.util
+import json
+import math
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import shapely
+
+import bucket_brigade
+import geohash_bin
+
+WKT = re.compile(r"'((?:MULTI)?(?:POLYGON|POINT|LINESTRING)\s*\(.*?\))'", re.IGNORECASE)
+TEST_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tester', 'util',
+    'test_config.py')
+
+# ################################################################################################ #
+# Mark: - Functions
+
+def kind_of(label: str) -> str:
+    ''' What sort of bucket a label is: global, empty, hemisphere, or the depth of a cell. '''
+    if label in ['global', 'empty']:
+        return label
+    if label in geohash_bin.HEMISPHERES.values():
+        return 'hemisphere'
+    return str(label.count('/') + 1)
+
+def count_buckets(source: str, depths: list[int], batch_rows: int) -> tuple:
+    ''' Rows in each bucket for each depth, read in one pass, and the average bytes in a row. '''
+    dataset = ds.dataset(bucket_brigade.source_files(source), format='parquet')
+    names = dataset.schema.names
+    columns = next(group for group in bucket_brigade.ENVELOPE_COLUMNS
+        if all(name in names for name in group))
+    counts = {depth: collections.Counter() for depth in depths}
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_rows):
+        found = bucket_brigade.envelopes(pa.Table.from_batches([batch]))
+        for depth in depths:
+            labels, ids = geohash_bin.hash_path_ids(*found, depth=depth)
+            rows = np.bincount(ids, minlength=len(labels))
+            counts[depth].update(dict(zip(labels, rows.tolist())))
+
+    rows, size = 0, 0
+    for fragment in dataset.get_fragments():
+        metadata = pq.read_metadata(fragment.path)
+        rows += metadata.num_rows
+        size += sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups))
+    return counts, size / rows if rows else 0.0
+
+def load_test_config():
+    ''' The tester's test_config module, loaded from its file as the tester is not a package. '''
+    spec = importlib.util.spec_from_file_location('test_config', TEST_CONFIG)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def suite_boxes(path: str) -> list:
+    '''
+    One query box for each test in a suite, templates expanded, the overlap of all its spatial
+    operations, None for tests with none.
+    '''
+    suite = load_test_config().from_file(path)
+    boxes = []
+    for test in suite.each_test():
+        found = []
+        if test.raw:
+            for text in WKT.findall(test.raw):
+                found.append(tuple(shapely.bounds(shapely.from_wkt(text))))
+        for operation in test.operations or []:
+            for step in operation.ands or []:
+                if step.type_of == 'bbox':
+                    found.append((step.xmin, step.ymin, step.xmax, step.ymax))
+                elif step.type_of == 'geometry' and step.value:
+                    found.append(tuple(shapely.bounds(shapely.from_wkt(step.value))))
+        if not found:
+            boxes.append(None)
+            continue
+        # boxes crossing the antimeridian are kept as they are, the overlap of several is rare
+        if len(found) == 1:
+            boxes.append(found[0])
+        else:
+            boxes.append((max(box[0] for box in found), max(box[1] for box in found),
+                min(box[2] for box in found), min(box[3] for box in found)))
+    return boxes
+
+def touched(bounds: np.ndarray, query: tuple) -> np.ndarray:
+    ''' Mask of buckets whose bounds touch a query box, which may cross the antimeridian. '''
+    minx, miny, maxx, maxy = query
+    sides = [(minx, 180.0), (-180.0, maxx)] if minx > maxx else [(minx, maxx)]
+    hit = np.zeros(len(bounds), dtype=bool)
+    for west, east in sides:
+        hit |= (west <= bounds[:, 2]) & (east >= bounds[:, 0])
+    return hit & (miny <= bounds[:, 3]) & (maxy >= bounds[:, 1])
+
+def summarize(depth: int, counts: collections.Counter, row_bytes: float, file_rows: int,
+    suites: dict) -> dict:
+    ''' One report row for a depth. '''
+    labels = [label for label in counts if label != 'empty' and counts[label]]
+    rows = np.array([counts[label] for label in labels], dtype=np.int64)
+    files = np.array([math.ceil(count / file_rows) if file_rows else 1 for count in rows])
+    per_file = np.repeat(rows / files, files)
+    total = rows.sum()
+    kinds = collections.Counter()
+    for label, count in zip(labels, rows):
+        kinds[kind_of(label)] += int(count)
+    out = {'depth': depth, 'buckets': len(labels), 'files': int(files.sum()),
+        'rows_min': int(per_file.min()), 'rows_median': int(np.median(per_file)),
+        'rows_p90': int(np.percentile(per_file, 90)), 'rows_max': int(per_file.max()),
+        'mb_median': round(float(np.median(per_file)) * row_bytes / 2**20, 2),
+        'mb_max': round(float(per_file.max()) * row_bytes / 2**20, 2),
+        'full_depth': kinds[str(depth)] / total,
+        'parent': sum(kinds[str(level)] for level in range(1, depth)) / total,
+        'hemisphere': kinds['hemisphere'] / total, 'global': kinds['global'] / total}
+
+    bounds = np.array([geohash_bin.path_bounds(label) for label in labels], dtype=np.float64)
+    for name, boxes in suites.items():
+        spatial = [box for box in boxes if box is not None]
+        if not spatial:
+            continue
+        hits = [touched(bounds, box) for box in spatial]
+        out[f"{name}_files"] = float(np.mean([files[hit].sum() for hit in hits]))
+        out[f"{name}_rows"] = float(np.mean([rows[hit].sum() / total for hit in hits]))
+    return out
+
+def simulate(args: argparse.Namespace) -> list[dict]:
+    ''' Count every depth and report on each. '''
+    mark_start = time.time()
+    depths = [int(item) for item in args.depths.split(',')]
+    counts, row_bytes = count_buckets(args.source, depths, args.batch_rows)
+    suites = {}
+    for path in args.suite or []:
+        boxes = suite_boxes(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        suites[name] = boxes
+        print(f"{name}: {sum(box is not None for box in boxes)} spatial tests of {len(boxes)}",
+            file=sys.stderr)
+    report = [summarize(depth, counts[depth], row_bytes, args.file_rows, suites)
+        for depth in depths]
+    print(f"Simulated {len(depths)} depths in {time.time() - mark_start:.1f}s", file=sys.stderr)
+    return report
+
+def write_report(report: list[dict], path: str = None):
+    ''' Print the report as a table, and save it as csv when a path is given. '''
+    names = list(dict.fromkeys(name for row in report for name in row))
+    cells = [[f"{row.get(name, ''):.3g}" if isinstance(row.get(name), float)
+        else str(row.get(name, '')) for name in names] for row in report]
+    widths = [max(len(name), *(len(line[i]) for line in cells)) for i, name in enumerate(names)]
+    print('  '.join(name.rjust(width) for name, width in zip(names, widths)))
+    for line in cells:
+        print('  '.join(cell.rjust(width) for cell, width in zip(line, widths)))
+    if path:
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=names)
+            writer.writeheader()
+            writer.writerows(report)
+
+# ################################################################################################ #
+# testing
+
+def simulate_test():
+    ''' Deeper trees make more files, push more rows up, and touch fewer rows for small queries. '''
+    import tempfile
+    rng = np.random.default_rng(5)
+    x = rng.uniform(-170, 170, 3000)
+    y = rng.uniform(-80, 80, 3000)
+    size = rng.choice([0.1, 2.0, 30.0], 3000)
+    geometry = shapely.to_wkb(shapely.box(x, y, x + size, y + size))
+    table = pa.table({'geometry': pa.array(geometry, type=pa.binary())})
+    with tempfile.TemporaryDirectory() as temp:
+        pq.write_table(table, os.path.join(temp, 'in.parquet'))
+        suite = {'tests': [{'name': 'box', 'operations': [{'ands': [{'type_of': 'bbox',
+            'xmin': 10.0, 'ymin': 10.0, 'xmax': 11.0, 'ymax': 11.0}]}]},
+            {'name': 'raw', 'raw': "SELECT 1 FROM t WHERE st_intersects(geometry, "
+            "'POLYGON ((1 1, 2 1, 2 2, 1 2, 1 1))'::GEOMETRY)"}],
+            'templates': [{'test': {'name': 'moved', 'operations': [{'ands': [{'type_of': 'bbox',
+            'xmin': '${x}', 'ymin': 10.0, 'xmax': '${x}', 'ymax': 11.0}]}]},
+            'matrix': {'x': [-60.0, 60.0]}}]}
+        with open(os.path.join(temp, 'suite.json'), 'w', encoding='utf-8') as file:
+            json.dump(suite, file)
+        assert len(suite_boxes(os.path.join(temp, 'suite.json'))) == 4
+        args = argparse.Namespace(source=os.path.join(temp, '*.parquet'), depths='1,2,3',
+            batch_rows=1000, file_rows=None, suite=[os.path.join(temp, 'suite.json')])
+        report = simulate(args)
+        assert [row['files'] for row in report] == sorted(row['files'] for row in report)
+        for row in report:
+            shares = row['full_depth'] + row['parent'] + row['hemisphere'] + row['global']
+            assert abs(shares - 1.0) < 1e-9
+        assert report[0]['full_depth'] > report[2]['full_depth']
+        assert report[2]['suite_rows'] < report[0]['suite_rows']
+
+#simulate_test()
+
+# ################################################################################################ #
+# Mark: - Command functions
+
+def handle_args() -> argparse.Namespace:
+    ''' Process all the command line arguments and return an argparse Namespace object. '''
+    parser = argparse.ArgumentParser(description="Simulate nested geohash bucket depths")
+
+    # Add command-line arguments
+    parser.add_argument("source", help='Parquet file, directory, or glob to simulate.')
+    parser.add_argument("--depths", default='1,2,3,4,5', help='Comma list of depths to try.')
+    parser.add_argument("--suite", action='append',
+        help='Tester suite, JSON or YAML, whose queries are counted, can be given more than once.')
+    parser.add_argument("--file-rows", type=int,
+        help='Most rows in one file, larger buckets are counted as several files.')
+    parser.add_argument("--batch-rows", default=256 * 1024, type=int, help='Rows read at a time.')
+    parser.add_argument("--csv", help='Also write the report to this csv file.')
+
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+def main():
+    ''' Be a command line app. '''
+    args = handle_args()
+    write_report(simulate(args), args.csv)
+
+if __name__ == "__main__":
+    main()
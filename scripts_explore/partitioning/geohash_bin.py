@@ -1,3 +1,6 @@
+import numpy as np
+import pyarrow as pa
+import shapely
 from shapely.geometry import box, Polygon
 from shapely import wkb
 import pygeohash as pgh
@@ -83,3 +86,137 @@ def wkb_to_hash_path(blob: bytes, geohash_length: int = 1) -> str:
   hash2 = pgh.encode(longitude=maxx, latitude=maxy, precision=geohash_length)
 
   return  hash_to_path(hash1, hash2)
+
+
+# Vectorized versions of the functions above, these work on whole arrays of envelopes at once
+# rather than one shapely object and two pygeohash calls per row.
+
+BASE32 = np.frombuffer(b'0123456789bcdefghjkmnpqrstuvwxyz', dtype=np.uint8)
+
+# hemisphere labels by which of SW (1), NW (2), SE (4), NE (8) a box touches
+HEMISPHERES = {0: 'Central', 1: 'SW', 2: 'NW', 4: 'SE', 8: 'NE', 3: 'SW-NW', 5: 'SW-SE',
+  10: 'NE-NW', 12: 'SE-NE', 15: 'All'}
+GLOBAL = 16
+EMPTY = 32
+SPECIAL = {GLOBAL: 'global', EMPTY: 'empty'}
+
+HEMISPHERE_BOUNDS = {'SW': (-180, -90, 0, 0), 'NW': (-180, 0, 0, 90), 'SE': (0, -90, 180, 0),
+  'NE': (0, 0, 180, 90), 'SW-NW': (-180, -90, 0, 90), 'SW-SE': (-180, -90, 180, 0),
+  'NE-NW': (-180, 0, 180, 90), 'SE-NE': (0, -90, 180, 90), 'All': (-180, -90, 180, 90),
+  'Central': (0, 0, 0, 0), 'global': (-180, -90, 180, 90)}
+
+
+def encode_array(lon: np.ndarray, lat: np.ndarray, precision: int = 1) -> np.ndarray:
+  '''
+  Geohash of each point as an n by precision array of ASCII codes. Bits alternate longitude then
+  latitude, points on the east or north edge go in the last cell instead of wrapping around.
+  '''
+  lon = np.asarray(lon, dtype=np.float64)
+  lat = np.asarray(lat, dtype=np.float64)
+  bits = 5 * precision
+  lon_bits = (bits + 1) // 2
+  lat_bits = bits // 2
+  x = np.clip(np.floor((lon + 180.0) / 360.0 * (1 << lon_bits)), 0, (1 << lon_bits) - 1)
+  y = np.clip(np.floor((lat + 90.0) / 180.0 * (1 << lat_bits)), 0, (1 << lat_bits) - 1)
+  x = np.nan_to_num(x).astype(np.uint64)
+  y = np.nan_to_num(y).astype(np.uint64)
+  value = np.zeros(len(x), dtype=np.uint64)
+  for bit in range(bits):
+    # even bits, counting from the most significant, are longitude
+    if bit % 2 == 0:
+      source, shift = x, lon_bits - 1 - bit // 2
+    else:
+      source, shift = y, lat_bits - 1 - bit // 2
+    value = (value << np.uint64(1)) | ((source >> np.uint64(shift)) & np.uint64(1))
+  shifts = np.arange(precision - 1, -1, -1, dtype=np.uint64) * np.uint64(5)
+  return BASE32[((value[:, None] >> shifts[None, :]) & np.uint64(31)).astype(np.intp)]
+
+
+def codes_to_strings(codes: np.ndarray) -> np.ndarray:
+  ''' Turn an n by precision array of ASCII codes from encode_array() into strings. '''
+  codes = np.ascontiguousarray(codes, dtype=np.uint8)
+  return codes.view(f"S{codes.shape[1]}").ravel().astype(str)
+
+
+def encode_many(lon: np.ndarray, lat: np.ndarray, precision: int = 1) -> np.ndarray:
+  ''' Geohash strings for arrays of points, the same as pgh.encode() for each one. '''
+  return codes_to_strings(encode_array(lon, lat, precision))
+
+
+def hash_path_ids(minx, miny, maxx, maxy, depth: int = 1) -> tuple:
+  '''
+  Nested bucket of each envelope as (labels, ids) where labels[ids[i]] is the path of row i. A
+  box goes in the deepest geohash cell, up to depth, holding both of its corners, like 4/0/1,
+  and when not even the first character matches, in the hemisphere bucket it touches. Boxes
+  with minx > maxx cross the antimeridian and always touch both the east and west. Boxes which
+  cover the whole globe, or are out of range, go in global and missing ones in empty.
+  '''
+  minx, miny, maxx, maxy = (np.asarray(item, dtype=np.float64) for item in (minx, miny, maxx, maxy))
+  crossing = minx > maxx
+  low = encode_array(minx, miny, depth)
+  high = encode_array(maxx, maxy, depth)
+  shared = np.cumprod(low == high, axis=1).sum(axis=1)
+  shared[crossing] = 0
+  cells = np.where(np.arange(depth)[None, :] < shared[:, None], low, 0).astype(np.uint8)
+
+  west = (minx < 0) | crossing
+  east = (maxx > 0) | crossing
+  south = miny < 0
+  north = maxy > 0
+  hemisphere = ((west & south) * 1 + (west & north) * 2 + (east & south) * 4
+    + (east & north) * 8).astype(np.uint8)
+  whole = (((minx <= -180) & (maxx >= 180) & (miny <= -90) & (maxy >= 90))
+    | (minx < -180) | (maxx > 180) | (miny < -90) | (maxy > 90))
+  hemisphere[whole] = GLOBAL
+  hemisphere[np.isnan(minx) | np.isnan(miny) | np.isnan(maxx) | np.isnan(maxy)] = EMPTY
+  cells[hemisphere >= GLOBAL] = 0
+  hemisphere[(shared > 0) & (hemisphere < GLOBAL)] = 0
+
+  keys, ids = np.unique(np.column_stack([cells, hemisphere]), axis=0, return_inverse=True)
+  labels = []
+  for key in keys:
+    if key[depth] in SPECIAL:
+      labels.append(SPECIAL[key[depth]])
+    elif key[0]:
+      labels.append('/'.join(chr(code) for code in key[:depth] if code))
+    else:
+      labels.append(HEMISPHERES[key[depth]])
+  return labels, ids.ravel()
+
+
+def envelopes_to_hash_paths(minx, miny, maxx, maxy, depth: int = 1) -> np.ndarray:
+  ''' Nested bucket path of each envelope as strings, see hash_path_ids(). '''
+  labels, ids = hash_path_ids(minx, miny, maxx, maxy, depth)
+  return np.array(labels, dtype=object)[ids]
+
+
+def wkb_array_to_hash_paths(blobs: pa.Array, depth: pa.Array) -> pa.Array:
+  '''
+  Arrow version of wkb_to_hash_path() which DuckDB can call a whole vector at a time:
+  db_con.create_function('hashbin_wkb', geohash_bin.wkb_array_to_hash_paths, [BLOB, BIGINT],
+    VARCHAR, type='arrow')
+  '''
+  bounds = shapely.bounds(shapely.from_wkb(blobs.to_numpy(zero_copy_only=False)))
+  level = depth[0].as_py() if len(depth) else 1
+  return pa.array(envelopes_to_hash_paths(*bounds.T, depth=level), type=pa.string())
+
+
+def path_bounds(path: str) -> tuple:
+  ''' minx, miny, maxx, maxy of a bucket, the geohash cell for nested paths like 4/0/1. '''
+  if path in HEMISPHERE_BOUNDS:
+    return HEMISPHERE_BOUNDS[path]
+  code = path.replace('/', '')
+  west, south, east, north = -180.0, -90.0, 180.0, 90.0
+  bit = 0
+  for char in code:
+    value = int(np.flatnonzero(BASE32 == ord(char))[0])
+    for shift in range(4, -1, -1):
+      on = (value >> shift) & 1
+      if bit % 2 == 0:
+        middle = (west + east) / 2
+        west, east = (middle, east) if on else (west, middle)
+      else:
+        middle = (south + north) / 2
+        south, north = (middle, north) if on else (south, middle)
+      bit += 1
+  return west, south, east, north
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+'''
+Partition a parquet dataset into an adaptive quadtree of files. Fixed geohash bins give nearly empty
+files over the oceans and huge ones over North America, here a cell is only split into its four
+quadrants when it holds more than --target-rows rows, so dense areas get deep small cells and empty
+ones stay large.
+
+A row belongs to the smallest cell, down to --max-depth, which holds its whole envelope. Rows which
+straddle the edge between quadrants stay in the lowest cell enclosing them, so every row of a file
+is inside that file's cell and a reader only needs the files whose cell touches its query.
+
+The data is read twice. The first pass reads only the envelopes and counts the rows held by each
+cell, from which the tree is planned, and the second streams every column into the files. The tree
+is written to _manifest.json with each node's bounds, row counts, and files, and each node
+directory, like r/3/0/2 for the south west quadrant of the north west quadrant of the north east
+quadrant, has an info.json too.
+
+example run:
+
+ ./quadtree.py '../../data/*.parquet' -o ../../data/quadtree --target-rows 1000000 --max-depth 8
+'''
+
+import argparse
+import collections
+import json
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import bucket_brigade
+
+ROOT = 'r'
+
+# ################################################################################################ #
+# Mark: - Functions
+
+def node_key(level, x, y) -> np.ndarray:
+    ''' One int64 for a cell from its level and its column and row in that level's grid. '''
+    return ((np.asarray(level, dtype=np.int64) << 56) | (np.asarray(x, dtype=np.int64) << 28)
+        | np.asarray(y, dtype=np.int64))
+
+def split_key(key: int) -> tuple:
+    ''' level, x, y of a cell key. '''
+    return int(key) >> 56, (int(key) >> 28) & 0xFFFFFFF, int(key) & 0xFFFFFFF
+
+def cells(minx, miny, maxx, maxy, max_depth: int) -> tuple:
+    '''
+    The smallest cell holding each envelope as (level, x, y) arrays. Envelopes crossing the
+    antimeridian, or with no extent at all, go in the root.
+    '''
+    scale = float(1 << max_depth)
+    top = (1 << max_depth) - 1
+
+    def grid(value, low, span):
+        found = np.floor((np.nan_to_num(value) - low) / span * scale)
+        return np.clip(found, 0, top).astype(np.int64)
+
+    x0, x1 = grid(minx, -180.0, 360.0), grid(maxx, -180.0, 360.0)
+    y0, y1 = grid(miny, -90.0, 180.0), grid(maxy, -90.0, 180.0)
+    # levels to climb until both corners are in the same cell, the bit length of the difference
+    differ = (x0 ^ x1) | (y0 ^ y1)
+    climb = np.where(differ > 0, np.floor(np.log2(np.maximum(differ, 1))).astype(np.int64) + 1, 0)
+    outside = (minx > maxx) | np.isnan(minx) | np.isnan(miny) | np.isnan(maxx) | np.isnan(maxy)
+    climb[outside] = max_depth
+    return max_depth - climb, x0 >> climb, y0 >> climb
+
+def count_cells(dataset: ds.Dataset, args: argparse.Namespace) -> collections.Counter:
+    ''' Rows held by each cell, reading only the envelope columns. '''
+    names = dataset.schema.names
+    columns = next(group for group in bucket_brigade.ENVELOPE_COLUMNS
+        if all(name in names for name in group))
+    counts = collections.Counter()
+    for batch in dataset.to_batches(columns=columns, batch_size=args.batch_rows):
+        table = pa.Table.from_batches([batch])
+        keys, found = np.unique(node_key(*cells(*bucket_brigade.envelopes(table), args.max_depth)),
+            return_counts=True)
+        counts.update(dict(zip(keys.tolist(), found.tolist())))
+    return counts
+
+def plan_tree(counts: collections.Counter, target_rows: int, max_depth: int) -> tuple:
+    '''
+    Split cells from the root down while they and everything under them hold more than
+    target_rows rows. Returns (leaves, inner, under), the keys of the cells which keep all the
+    rows under them, the keys of the split cells, and the rows under each cell.
+    '''
+    keys = np.array(list(counts.keys()), dtype=np.int64)
+    rows = np.array(list(counts.values()), dtype=np.int64)
+    levels = keys >> 56
+    under = collections.Counter()
+    for level in range(int(levels.max()) + 1 if len(keys) else 0):
+        held = levels >= level
+        shift = levels[held] - level
+        above = node_key(level, ((keys[held] >> 28) & 0xFFFFFFF) >> shift,
+            (keys[held] & 0xFFFFFFF) >> shift)
+        unique, ids = np.unique(above, return_inverse=True)
+        under.update(dict(zip(unique.tolist(), np.bincount(ids.ravel(),
+            weights=rows[held]).astype(np.int64).tolist())))
+    leaves, inner = set(), set()
+    stack = [int(node_key(0, 0, 0))]
+    while stack:
+        key = stack.pop()
+        level, x, y = split_key(key)
+        if under[key] > target_rows and level < max_depth:
+            inner.add(key)
+            for dx, dy in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+                child = int(node_key(level + 1, 2 * x + dx, 2 * y + dy))
+                if under[child]:
+                    stack.append(child)
+        else:
+            leaves.add(key)
+    return leaves, inner, under
+
+def node_path(key: int) -> str:
+    ''' Directory of a cell, a quadrant digit per level below the root, 0 SW 1 SE 2 NW 3 NE. '''
+    level, x, y = split_key(key)
+    digits = [str(((x >> (level - depth)) & 1) + 2 * ((y >> (level - depth)) & 1))
+        for depth in range(1, level + 1)]
+    return '/'.join([ROOT, *digits])
+
+def path_bounds(path: str) -> tuple:
+    ''' minx, miny, maxx, maxy of the cell for a directory from node_path(). '''
+    west, south, east, north = -180.0, -90.0, 180.0, 90.0
+    for digit in path.split('/')[1:]:
+        quadrant = int(digit)
+        middle_x, middle_y = (west + east) / 2, (south + north) / 2
+        west, east = (middle_x, east) if quadrant & 1 else (west, middle_x)
+        south, north = (middle_y, north) if quadrant & 2 else (south, middle_y)
+    return west, south, east, north
+
+def assign(keys: np.ndarray, leaves: np.ndarray) -> np.ndarray:
+    '''
+    The cell whose file gets each row: the first cell from the root down to the row's own cell
+    which was not split, or the row's own cell when every cell above it was split.
+    '''
+    out = keys.copy()
+    done = np.zeros(len(keys), dtype=bool)
+    levels = keys >> 56
+    xs, ys = (keys >> 28) & 0xFFFFFFF, keys & 0xFFFFFFF
+    for level in range(int(levels.max()) + 1 if len(keys) else 0):
+        shift = np.maximum(levels - level, 0)
+        above = node_key(level, xs >> shift, ys >> shift)
+        hit = ~done & (levels >= level) & np.isin(above, leaves)
+        out[hit] = above[hit]
+        done |= hit
+    return out
+
+def partition(args: argparse.Namespace) -> str:
+    ''' Plan the tree from the envelopes, write the files, and the manifest describing them. '''
+    mark_start = time.time()
+    dataset = ds.dataset(bucket_brigade.source_files(args.source), format='parquet')
+    counts = count_cells(dataset, args)
+    leaves, inner, under = plan_tree(counts, args.target_rows, args.max_depth)
+    leaf_keys = np.array(sorted(leaves), dtype=np.int64)
+
+    writers = bucket_brigade.BucketWriters(args.output, dataset.schema, args.max_open,
+        args.row_group_size, args.buffer_rows, args.threads, file_rows=args.file_rows,
+        bounds=path_bounds, compression=args.compression)
+    for batch in dataset.to_batches(batch_size=args.batch_rows):
+        table = pa.Table.from_batches([batch])
+        keys = assign(node_key(*cells(*bucket_brigade.envelopes(table), args.max_depth)),
+            leaf_keys)
+        unique, ids = np.unique(keys, return_inverse=True)
+        order = np.argsort(ids, kind='stable')
+        starts = np.flatnonzero(np.diff(ids[order], prepend=-1))
+        stops = np.append(starts[1:], len(order))
+        grouped = table.take(order)
+        for start, stop in zip(starts, stops):
+            writers.add(node_path(unique[ids[order[start]]]), grouped.slice(start, stop - start))
+        writers.flush()
+    writers.close()
+
+    nodes = []
+    for key in sorted(leaves | inner):
+        path = node_path(key)
+        nodes.append({'path': path, 'level': split_key(key)[0], 'bounds': path_bounds(path),
+            'split': key in inner, 'rows_under': under[key], 'rows': writers.rows[path],
+            'files': [os.path.relpath(name, args.output) for name in writers.paths[path]]})
+    manifest = {'target_rows': args.target_rows, 'max_depth': args.max_depth,
+        'rows': sum(counts.values()), 'nodes': nodes}
+    with open(os.path.join(args.output, '_manifest.json'), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1)
+
+    sizes = np.array([rows for rows in writers.rows.values()])
+    return (f"Wrote {sizes.sum()} rows into {len(sizes)} nodes and "
+        f"{sum(writers.files.values())} files in {time.time() - mark_start:.1f}s, rows per node: "
+        f"median {np.median(sizes):.0f}, max {sizes.max()}, deepest level "
+        f"{max(split_key(key)[0] for key in leaves)}")
+
+def files_for_box(manifest: dict, minx: float, miny: float, maxx: float, maxy: float) -> list:
+    ''' Files from a manifest a reader needs for a query box, those whose cell touches it. '''
+    found = []
+    for node in manifest['nodes']:
+        west, south, east, north = node['bounds']
+        if minx <= east and maxx >= west and miny <= north and maxy >= south:
+            found.extend(node['files'])
+    return found
+
+# ################################################################################################ #
+# testing
+
+def partition_test():
+    ''' Dense areas split deeper, every row is written once, and inside its file's cell. '''
+    import tempfile
+    import pyarrow.parquet as pq
+    import shapely
+    rng = np.random.default_rng(3)
+    x = np.concatenate([rng.uniform(-100, -80, 4000), rng.uniform(-180, 170, 1000)])
+    y = np.concatenate([rng.uniform(30, 45, 4000), rng.uniform(-90, 80, 1000)])
+    size = rng.choice([0.01, 0.5, 10.0], len(x))
+    geometry = shapely.to_wkb(shapely.box(x, y, x + size, y + size))
+    table = pa.table({'id': np.arange(len(x)), 'geometry': pa.array(geometry, type=pa.binary())})
+    with tempfile.TemporaryDirectory() as temp:
+        pq.write_table(table, os.path.join(temp, 'in.parquet'))
+        args = argparse.Namespace(source=os.path.join(temp, 'in.parquet'),
+            output=os.path.join(temp, 'out'), target_rows=500, max_depth=10, file_rows=None,
+            batch_rows=1000, max_open=8, row_group_size=200, buffer_rows=2000, threads=2,
+            compression='zstd')
+        partition(args)
+        with open(os.path.join(args.output, '_manifest.json'), encoding='utf-8') as file:
+            manifest = json.load(file)
+        seen = []
+        for node in manifest['nodes']:
+            west, south, east, north = node['bounds']
+            for name in node['files']:
+                part = pq.read_table(os.path.join(args.output, name))
+                seen.extend(part.column('id').to_pylist())
+                bounds = shapely.bounds(shapely.from_wkb(part.column('geometry').to_numpy(
+                    zero_copy_only=False)))
+                assert (bounds[:, 0] >= west).all() and (bounds[:, 2] <= east).all()
+                assert (bounds[:, 1] >= south).all() and (bounds[:, 3] <= north).all()
+            if not node['split']:
+                assert node['rows'] <= args.target_rows or node['level'] == args.max_depth
+        assert sorted(seen) == list(range(len(x)))
+        assert len(files_for_box(manifest, -95, 35, -94, 36)) < len(seen)
+
+#partition_test()
+
+# ################################################################################################ #
+# Mark: - Command functions
+
+def handle_args() -> argparse.Namespace:
+    ''' Process all the command line arguments and return an argparse Namespace object. '''
+    parser = argparse.ArgumentParser(description="Partition parquet into an adaptive quadtree")
+
+    # Add command-line arguments
+    parser.add_argument("source", help='Parquet file, directory, or glob to partition.')
+    parser.add_argument("-o", "--output", required=True, help='Directory for the tree.')
+    parser.add_argument("--target-rows", default=1_000_000, type=int,
+        help='Split a cell when it and the cells under it hold more rows than this.')
+    parser.add_argument("-d", "--max-depth", default=10, type=int,
+        help='Deepest level of the tree, 10 is cells of about 0.35 by 0.18 degrees.')
+    parser.add_argument("--file-rows", type=int,
+        help='Most rows in one file, cells at --max-depth can hold more than --target-rows.')
+    parser.add_argument("--batch-rows", default=256 * 1024, type=int, help='Rows read at a time.')
+    parser.add_argument("--max-open", default=64, type=int, help='Most files open at once.')
+    parser.add_argument("-r", "--row-group-size", default=100_000, type=int,
+        help='Rows in each row group.')
+    parser.add_argument("--buffer-rows", default=2_000_000, type=int,
+        help='Rows to hold before writing out partly full row groups of the largest cells.')
+    parser.add_argument("-t", "--threads", default=4, type=int, help='Threads writing files.')
+    parser.add_argument("--compression", default='zstd', help='Parquet compression.')
+
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+def main():
+    ''' Be a command line app. '''
+    args = handle_args()
+    print(partition(args))
+
+if __name__ == "__main__":
+    main()
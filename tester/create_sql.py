@@ -43,12 +43,16 @@ def select_engine(system_name:str) -> duck:
 
 def to_csv_file(out_file:str, queries:list):
     ''' Write out a CSV file with the list of queries '''
-    headers = ['suite', 'name', 'action', 'sql']
     with open(out_file, 'w', encoding='utf8') as file:
-        writer = csv.DictWriter(file, fieldnames=headers)
-        writer.writeheader()
-        for item in queries:
-            writer.writerow(item)
+        to_csv_stream(file, queries)
+
+def to_csv_stream(file, queries):
+    ''' Write queries, a list or generator, to an open file one row at a time. '''
+    headers = ['suite', 'name', 'action', 'sql']
+    writer = csv.DictWriter(file, fieldnames=headers)
+    writer.writeheader()
+    for item in queries:
+        writer.writerow(item)
 
 def to_csv_string(queries: list) -> str:
     ''' Convert the list of queries to a CSV string to be printed or saved latter '''
@@ -181,36 +185,24 @@ test_remove_order_by('failed4',
 
 # ##################################################
 
-def run(args:argparse.Namespace):
-    '''
-    Handle the script tasks in 4 steps:
-    1. Parse configuration
-    2. Select test target engine
-    3. Create search query from generator
-    4. Output the queries
-    '''
-
-    # 1. Parse configuration
-    config = test_config.from_file(args.config)
-    output.log.log(output.LOG_ALWAYS, "Starting create sql: %s.", config.name)
-
-    # 2. select test target engine
-    engine = select_engine(args.system)
-    engine.use_configuration(config)
-
-    # 3. Create search query from generator
-    queries = []
+def make_queries(args:argparse.Namespace, config:test_config.AssessConfig, engine:duck):
+    ''' Generator of CSV rows, the query for each test along with any requested variations. '''
     for resp in engine.generate_tests():
         test_query = resp[0]
         test_settings = resp[1]
 
         if test_settings.name == engine.special_lifecycle_name:
             flag = test_settings.description
-            queries.append(encode_csv_row(config.name, test_settings, flag, test_query))
+            yield encode_csv_row(config.name, test_settings, flag, test_query)
             continue
 
         if not args.no_orig:
-            queries.append(encode_csv_row(config.name, test_settings, "flag-0-base", test_query))
+            yield encode_csv_row(config.name, test_settings, "flag-0-base", test_query)
+
+        if args.late:
+            late_query = engine.generate_late(test_settings)
+            if late_query:
+                yield encode_csv_row(config.name, test_settings, "flag-late", late_query)
 
         # set bit flag as such Limit-Order-All
         flags = (4 if args.limit else 0) | (2 if args.order else 0) | (1 if args.all else 0)
@@ -238,13 +230,33 @@ def run(args:argparse.Namespace):
                 flag_tag = f"flag-{flag}{flag_name}"
                 output.log.debug(flag_tag)
 
-                queries.append(encode_csv_row(config.name, test_settings, flag_tag, current_query))
+                yield encode_csv_row(config.name, test_settings, flag_tag, current_query)
+
+def run(args:argparse.Namespace):
+    '''
+    Handle the script tasks in 4 steps:
+    1. Parse configuration
+    2. Select test target engine
+    3. Create search query from generator
+    4. Output the queries
+    '''
+
+    # 1. Parse configuration
+    config = test_config.from_file(args.config)
+    output.log.log(output.LOG_ALWAYS, "Starting create sql: %s.", config.name)
+
+    # 2. select test target engine
+    engine = select_engine(args.system)
+    engine.use_configuration(config)
+
+    # 3. Create search query from generator, rows are made as they are written out
+    queries = make_queries(args, config, engine)
 
     # 4. output the queries
     if args.data:
         to_csv_file(args.data, queries)
     else:
-        print(to_csv_string(queries), end=None)
+        to_csv_stream(sys.stdout, queries)
 
 # ################################################################################################ #
 # Mark: - Command functions
@@ -263,6 +275,9 @@ def handle_args() -> argparse.Namespace:
         help='Add ORDER BY check, adding queries without one if found.')
     parser.add_argument("-a", "--all", action='store_true',
         help='Add all "*" check, adding queries if SELECT * is not used.')
+    parser.add_argument('-L', '--late', action='store_true',
+        help='Add a late materialization query, filter first then fetch only the matching rows '
+            'by file row number.')
     parser.add_argument('-l', '--limit' , type=int,
         help='Limit the number of queries to generate.')
     parser.add_argument("-v", '--verbose-level', default='info',
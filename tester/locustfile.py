@@ -5,6 +5,7 @@ env variables:
 * call_count - A number of the times to call each test query
 * test_file - File listing all the test queries, json or yaml
 * engine - parquet system to test against, currently only 'duckdb'
+* golden_file - Optional JSON file of counts and checksums, see util/verify.py
 '''
 import inspect
 import os
@@ -15,6 +16,7 @@ from locust import User, task, events
 import duckdb
 
 from util import test_config
+from util import verify
 
 from target_duckdb import engine as duck
 
@@ -79,6 +81,7 @@ def on_test_start(environment, **kwargs):
     environment.call_count = int(os.environ.get('call_count', 2))
     environment.test_file = os.environ.get('test_file', 'suite.json')
     environment.engine = os.environ.get('engine', 'duckdb')
+    environment.golden = verify.load_golden(os.environ.get('golden_file'))
     environment.use_direct_command = False
 
     print(f"Using data path '{environment.path}' and config file '{environment.test_file}'.")
@@ -119,6 +122,13 @@ class Foiegras(User):
         '''
         item = work_provider.get()
         if item:
+            # validate the response once, before and outside of the timed calls
+            failed = None
+            if item[1].name != engine.special_lifecycle_name:
+                valid = verify.verify_test(engine, item[0].replace('{data}', self.environment.path),
+                    item[1].name, item[1].expected, self.environment.golden)
+                if valid is False:
+                    failed = f"{item[1].name} failed validation"
             for _ in range(self.environment.call_count):
                 #1. setup
                 config = item[1]
@@ -148,7 +158,6 @@ class Foiegras(User):
                     else:
                         output = engine.run_test(sql)
                         stop_time = time.time()
-                        output = '\n'.join(output)
                         error = None
 
                     if error:
@@ -156,9 +165,9 @@ class Foiegras(User):
                         error_exception = Exception(error)
                 response_time_ms = int((stop_time - start_time) * 1000)
 
-                # 3. validate response
-                if error_exception is None and not engine.verify(config.expected, output):
-                    error_exception = Exception(f"{work_name} failed validation")
+                # 3. validate response, checked once above
+                if error_exception is None and failed:
+                    error_exception = Exception(failed)
 
                 # 4. deal with results
                 events.request.fire(
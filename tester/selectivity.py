@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+'''
+Build a test suite of bbox and time queries which each hit a target selectivity, the fraction of all
+rows returned. Query centers are picked from the data itself so dense areas get tested as often as
+they get used. A sample of envelopes and StartTime values is read from the data, then for each
+target a time window is taken from the StartTime quantiles and the size of a box around the center
+is binary searched until the sample says the target fraction of rows will be found.
+
+Tests come out as a suite for single.py or create_sql.py with no limit so the whole result is read,
+and with expected counts measured against all the data unless --no-count is given.
+
+example run:
+
+ ./selectivity.py --data "'../data/*.parquet'" --targets 1e-6,1e-4,1e-2,0.1 --per-target 5 \\
+    --output suite_selectivity.json
+'''
+
+import argparse
+import json
+import math
+
+import duckdb
+import numpy as np
+
+from util import output
+
+# ################################################################################################ #
+# Mark: - Functions
+
+def envelope_columns(envelope:str) -> list[str]:
+    ''' SQL for xmin, ymin, xmax, ymax from either a bbox struct or the MBR columns. '''
+    if envelope == 'MBR':
+        return ['MBRWest', 'MBRSouth', 'MBREast', 'MBRNorth']
+    return [f"{envelope}.xmin", f"{envelope}.ymin", f"{envelope}.xmax", f"{envelope}.ymax"]
+
+def load_sample(data:str, envelope:str, sample:int) -> tuple[dict, int]:
+    ''' Read a sample of envelopes and start times as numpy arrays, along with the total rows. '''
+    xmin, ymin, xmax, ymax = envelope_columns(envelope)
+    total = duckdb.sql(f"SELECT count(*) FROM read_parquet({data})").fetchone()[0]
+    sql = f"""SELECT {xmin} AS xmin, {ymin} AS ymin, {xmax} AS xmax, {ymax} AS ymax,
+        epoch_ms(StartTime::TIMESTAMP) AS start
+    FROM read_parquet({data})
+    WHERE {xmin} IS NOT NULL AND StartTime IS NOT NULL"""
+    if sample < total:
+        sql += f"\n    USING SAMPLE reservoir({sample} ROWS) REPEATABLE (42)"
+    found = duckdb.sql(sql).fetchnumpy()
+    return {key: np.asarray(value, dtype=np.float64) for key, value in found.items()}, total
+
+def wrap_x(x:float, half:float) -> tuple[float, float]:
+    '''
+    West and east edges of a box half wide on each side of x, wrapped over the antimeridian so west
+    > east when the box crosses it, as the engine takes bbox steps.
+    '''
+    if half >= 180.0:
+        return -180.0, 180.0
+    west, east = x - half, x + half
+    if west < -180.0:
+        west += 360.0
+    if east > 180.0:
+        east -= 360.0
+    return west, east
+
+def x_sides(west:float, east:float) -> list[tuple[float, float]]:
+    ''' A box crossing the antimeridian as a box on each side of it. '''
+    return [(west, 180.0), (-180.0, east)] if west > east else [(west, east)]
+
+def hits(rows:dict, center:tuple, half:float) -> np.ndarray:
+    '''
+    Mask of sample rows whose envelope touches a box of half width half around center, envelopes
+    with xmin > xmax cross the antimeridian.
+    '''
+    crossing = rows['xmin'] > rows['xmax']
+    x = np.zeros(len(crossing), dtype=bool)
+    for west, east in x_sides(*wrap_x(center[0], half)):
+        x |= (west <= rows['xmax']) & (east >= rows['xmin'])
+        x |= crossing & ((east >= rows['xmin']) | (west <= rows['xmax']))
+    return x & (center[1] - half <= rows['ymax']) & (center[1] + half >= rows['ymin'])
+
+def search_box(rows:dict, center:tuple, target:int, steps:int = 40,
+    min_half:float = 0.0) -> float:
+    '''
+    Binary search for the half width of a box around center which touches target rows. A point
+    center is touched by a box of any size, so the width is kept to at least min_half.
+    '''
+    low, high = min_half, 360.0
+    for _ in range(steps):
+        half = (low + high) / 2
+        if np.count_nonzero(hits(rows, center, half)) < target:
+            low = half
+        else:
+            high = half
+    return high
+
+def time_window(starts:np.ndarray, fraction:float, rng:np.random.Generator) -> tuple[float, float]:
+    ''' A random StartTime window holding about fraction of the sample, as epoch ms. '''
+    fraction = min(1.0, fraction)
+    first = rng.uniform(0, 1 - fraction)
+    return tuple(np.quantile(starts, [first, first + fraction]))
+
+def iso(epoch_ms:float) -> str:
+    ''' Epoch ms to UTC ISO 8601 text, as StartTime is written in the data. '''
+    return f"{np.datetime64(int(epoch_ms), 'ms')}Z"
+
+def make_query(rows:dict, target:float, mode:str, rng:np.random.Generator,
+    min_half:float = 0.0) -> dict:
+    '''
+    Pick a box and time window for one query. With mode 'both' the time window takes about the
+    square root of the selectivity and the box is sized to make up the rest, but is never narrower
+    than min_half on each side of the center.
+    '''
+    count = len(rows['start'])
+    pick = rng.integers(count)
+    center = ((rows['xmin'][pick] + rows['xmax'][pick]) / 2,
+        (rows['ymin'][pick] + rows['ymax'][pick]) / 2)
+    query = {'center': center, 'half': None, 'window': None}
+    subset = rows
+    if mode in ['time', 'both']:
+        fraction = target if mode == 'time' else math.sqrt(target)
+        query['window'] = time_window(rows['start'], fraction, rng)
+        inside = (query['window'][0] <= rows['start']) & (rows['start'] <= query['window'][1])
+        subset = {key: value[inside] for key, value in rows.items()}
+    if mode in ['bbox', 'both']:
+        query['half'] = search_box(subset, center, max(1, round(target * count)),
+            min_half=min_half)
+    mask = np.ones(count, dtype=bool)
+    if query['half'] is not None:
+        mask &= hits(rows, center, query['half'])
+    if query['window'] is not None:
+        mask &= (query['window'][0] <= rows['start']) & (rows['start'] <= query['window'][1])
+    query['estimate'] = np.count_nonzero(mask) / count
+    return query
+
+def make_test(query:dict, name:str, args:argparse.Namespace) -> dict:
+    ''' Turn a query into a suite test. '''
+    ands = []
+    if query['half'] is not None:
+        x, y = query['center']
+        half = query['half']
+        west, east = wrap_x(x, half)
+        # the sample counted envelopes crossing the antimeridian, so the engine has to as well
+        step = {'description': f"box {half*2:.6g} degrees wide",
+            'type_of': 'bbox',
+            'bbox_column_name': args.envelope,
+            'antimeridian': True,
+            'xmin': west, 'xmax': east,
+            'ymin': max(-90.0, y - half), 'ymax': min(90.0, y + half)}
+        if args.envelope == 'MBR':
+            # the MBR values are separate columns, not a struct, so write out the predicate
+            step = {'description': step['description'],
+                'type_of': 'attribute_raw',
+                'statement': box_predicate(step, args.envelope),
+                **{key: step[key] for key in ['xmin', 'xmax', 'ymin', 'ymax']}}
+        ands.append(step)
+    if query['window'] is not None:
+        ands.append({'description': 'window start', 'type_of': 'time',
+            'option': 'greater-then', 'value': iso(query['window'][0])})
+        ands.append({'description': 'window end', 'type_of': 'time',
+            'option': 'less-then', 'value': iso(query['window'][1])})
+    return {'name': name,
+        'description': f"target selectivity {query['target']:g}, sample estimate "
+            f"{query['estimate']:.3g}",
+        'columns': args.columns.split(','),
+        'operations': [{'ands': ands}],
+        'limit': 0,
+        'source': '{data}'}
+
+def box_predicate(step:dict, envelope:str) -> str:
+    '''
+    SQL for an envelope touching the box in step, written the way the engine writes a bbox step.
+    A box with xmin > xmax is split into one on each side of the antimeridian, and envelopes with
+    xmin > xmax are only taken to cross it when the step says antimeridian.
+    '''
+    xmin, ymin, xmax, ymax = envelope_columns(envelope)
+    tests = []
+    for west, east in x_sides(step['xmin'], step['xmax']):
+        test = f"({west} <= {xmax} AND {east} >= {xmin})"
+        if step.get('antimeridian'):
+            test = f"({test} OR ({xmin} > {xmax} AND ({east} >= {xmin} OR {west} <= {xmax})))"
+        tests.append(test)
+    x_test = tests[0] if len(tests) == 1 else f"({' OR '.join(tests)})"
+    return f"({x_test} AND {step['ymin']} <= {ymax} AND {step['ymax']} >= {ymin})"
+
+def count_test(test:dict, data:str, envelope:str) -> int:
+    ''' Count the rows a test will find in all the data, using the same predicates as the engine. '''
+    where = []
+    for step in test['operations'][0]['ands']:
+        if step['type_of'] == 'bbox':
+            where.append(box_predicate(step, envelope))
+        elif step['type_of'] == 'attribute_raw':
+            where.append(step['statement'])
+        elif step['option'] == 'greater-then':
+            where.append(f"StartTime >= '{step['value']}'")
+        else:
+            where.append(f"StartTime <= '{step['value']}'")
+    sql = f"SELECT count(*) FROM read_parquet({data}) WHERE {' AND '.join(where)}"
+    return duckdb.sql(sql).fetchone()[0]
+
+def run(args:argparse.Namespace):
+    ''' Sample the data, build the queries, and write out the suite. '''
+    rng = np.random.default_rng(args.seed)
+    rows, total = load_sample(args.data, args.envelope, args.sample)
+    sampled = len(rows['start'])
+    output.log.log(output.LOG_ALWAYS, "Sampled %d of %d rows.", sampled, total)
+    if sampled < 1:
+        output.log.critical("No rows with an envelope and StartTime found.")
+        return
+
+    tests = []
+    for target in [float(item) for item in args.targets.split(',')]:
+        if target * sampled < 1:
+            output.log.warning("Target %g is under one row of the %d row sample, use a larger "
+                "--sample to hit it.", target, sampled)
+        for index in range(args.per_target):
+            query = make_query(rows, target, args.mode, rng, args.min_half)
+            query['target'] = target
+            test = make_test(query, f"selectivity-{target:g}-{args.mode}-{index}", args)
+            if not args.no_count:
+                found = count_test(test, args.data, args.envelope)
+                test['expected'] = {'action': 'count', 'value': found}
+                test['description'] += f", actual {found / total:.3g}"
+            tests.append(test)
+            output.log.info("%s: %s", test['name'], test['description'])
+
+    suite = {'name': args.name,
+        'description': f"{len(tests)} {args.mode} queries from {args.targets} selectivity over "
+            f"{total} rows",
+        'tests': tests}
+    text = json.dumps(suite, indent=4)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+    else:
+        print(text)
+
+# ################################################################################################ #
+# Mark: - Command functions
+
+def handle_args() -> argparse.Namespace:
+    ''' Process all the command line arguments and return an argparse Namespace object. '''
+    parser = argparse.ArgumentParser(description="Generate a suite of queries by selectivity.")
+    parser.add_argument("-d", "--data", required=True,
+        help='Path to data files, as given to read_parquet(). Include any quotes or [] as needed')
+    parser.add_argument("-e", "--envelope", default='bbox',
+        help='bbox struct column with xmin/ymin/xmax/ymax, or MBR to use the MBR columns')
+    parser.add_argument("-m", "--mode", default='both', choices=['bbox', 'time', 'both'],
+        help='Which predicates each query uses.')
+    parser.add_argument("-t", "--targets", default='1e-6,1e-5,1e-4,1e-3,1e-2,0.1',
+        help='Comma list of selectivities, the fraction of all rows each query should find.')
+    parser.add_argument("-p", "--per-target", default=5, type=int,
+        help='Number of queries, each around a different center, for each target.')
+    parser.add_argument("--min-half", default=0.01, type=float,
+        help='Smallest half width of a query box in degrees, low targets are often a point.')
+    parser.add_argument("-s", "--sample", default=1_000_000, type=int,
+        help='Rows to sample, targets below 1/sample can not be hit.')
+    parser.add_argument("-c", "--columns", default='*', help='Comma list of columns to select.')
+    parser.add_argument("-N", "--no-count", action='store_true',
+        help='Skip counting each query over all the data, no expected values are written.')
+    parser.add_argument("-n", "--name", default='Selectivity', help='Name of the suite.')
+    parser.add_argument("-o", "--output", help='File to write the suite to, default is stdout.')
+    parser.add_argument("--seed", default=42, type=int, help='Seed for picking query centers.')
+    parser.add_argument("-v", '--verbose-level', default='info',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        help='Set the logging level, default is info')
+    return parser.parse_args()
+
+def main():
+    ''' Be a command line app. '''
+    output.init_logging(__file__)
+    args = handle_args()
+    output.set_log_level(args.verbose_level)
+    run(args)
+
+if __name__ == "__main__":
+    main()
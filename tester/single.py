@@ -4,9 +4,10 @@
 
 import argparse
 import concurrent.futures
-import functools
+import itertools
 import multiprocessing
 import sys
+import threading
 import time
 
 from util import test_config
@@ -14,6 +15,7 @@ from util import output
 from util import stats
 from util import file
 from util import tools
+from util import verify
 import os
 from target_duckdb import engine as duck
 from target_duckdb import native as mallard
@@ -21,7 +23,8 @@ from target_duckdb import native as mallard
 # ################################################################################################ #
 # Mark: - Functions
 
-def run_one_test(engine:duck, args:argparse.Namespace, stat:stats.Stats, data:dict):
+def run_one_test(engine:duck, args:argparse.Namespace, stat:stats.Stats, data:dict,
+    golden:dict = None, record:dict = None):
     ''' Run one query and record the statistical information about that call. '''
     data_dir = args.data
 
@@ -30,33 +33,108 @@ def run_one_test(engine:duck, args:argparse.Namespace, stat:stats.Stats, data:di
     test_query = test_query.replace('{data}', data_dir)
     output.log.debug (test_query)
     out = None
-    for _ in range(args.tries):
-        mark_start = int(time.time() * 1000)
+    sub = stat.get_sub(config.name)
+    for attempt in range(args.tries):
+        mark_start = time.perf_counter_ns()
         out = engine.run_test(test_query)
-        mark_stop = int(time.time() * 1000)
+        mark_stop = time.perf_counter_ns()
 
         #4. take stats
-        mark_diff = mark_stop - mark_start
+        mark_diff = (mark_stop - mark_start) / 1_000_000 # ms
         stat.value(mark_diff, config.name)
-        sub = stat.get_sub(config.name)
+        stat.sample(config.name, attempt, mark_stop - mark_start, len(out))
         sub.value(mark_diff)
         sub.note("note", args.note)
+        output.log.info("\tn=%s\tr=%d\tms=%d", config.name, len(out), mark_diff)
 
-        #5. validate response
-        valid = None
-        if config.expected:
-            # configuration has an expected setting, so verify it
-            valid = engine.verify(config.expected, out)
+    #5. validate response once, outside of the timed runs
+    if config.name != engine.special_lifecycle_name:
+        valid = verify.verify_test(engine, test_query, config.name, config.expected, golden,
+            record)
+        if valid is not None:
             stat.add('valid' if valid else 'failed', 1) # top level, all tests
             sub.add('valid' if valid else 'failed', 1) # lower level, just this test
-        output.log.info("\tn=%s\tr=%d\tms=%d\tv=%s",
-            config.name, len(out), mark_stop-mark_start, valid)
+        output.log.info("\tn=%s\tv=%s", config.name, valid)
     return out #give the last one back so there is something to work with in the caller
 
+def make_engine(system:str):
+    ''' Create the test target engine by name, returns None for unknown names. '''
+    engine = None
+    if system == 'duckdb':
+        engine = duck.DuckDbSystem()
+    elif system == 'mallard': # duckdb using a native database ; Mallards are native to America
+        # not well tested at this point (2024-10-18)
+        engine = mallard.NativeDuckSystem('~/test_lpcloud_data/single_file/native.db')
+    return engine
+
+# Each worker process gets its own engine, connections can not be shared across processes
+worker_state = {}
+
+def init_worker(args:argparse.Namespace, config:test_config.AssessConfig, setup:list,
+    golden:dict):
+    ''' Process pool initializer, build an engine for this worker and run any setup sql. '''
+    output.init_logging(__file__)
+    engine = make_engine(args.system)
+    engine.use_configuration(config)
+    for sql in setup:
+        engine.run_test(sql)
+    worker_state['engine'] = engine
+    worker_state['args'] = args
+    worker_state['golden'] = golden
+
+def run_in_worker(item:list) -> tuple:
+    '''
+    Run one test descriptor, [sql, test], in a worker process. Returns the Stats for this test and
+    the recorded golden values, if recording, so the parent can merge them.
+    '''
+    args = worker_state['args']
+    stat = stats.Stats()
+    if args.samples:
+        stat.samples = stats.Samples() # kept in memory and merged into the file by the parent
+    record = {} if args.record else None
+    run_one_test(worker_state['engine'], args, stat, item, worker_state['golden'], record)
+    return stat, record
+
+def run_processes(engine, args:argparse.Namespace, config:test_config.AssessConfig,
+    stat:stats.Stats, golden:dict, record:dict):
+    '''
+    Run the tests over a pool of processes, each with its own engine. Tests are handed out in order
+    one at a time and the stats from each are merged back into stat. Tests are made as the pool
+    needs them, only a few more than there are workers are waiting at any time, so a large
+    template matrix is never held in memory.
+    '''
+    tests = engine.generate_tests()
+    setup = []
+    first = []
+    for sql, test in tests: # setup comes before any test, every worker needs it
+        if test.name != engine.special_lifecycle_name:
+            first = [[sql, test]]
+            break
+        if test.description == 'Initial database setup':
+            setup.append(sql)
+    # the pool reads its input as fast as it can, so hold it back until results come in
+    waiting = threading.BoundedSemaphore(args.workers * 2)
+
+    def handed_out():
+        for item in itertools.chain(first, tests):
+            if item[1].name == engine.special_lifecycle_name:
+                continue # teardown has nothing to clean in the workers
+            waiting.acquire()
+            yield item
+
+    with multiprocessing.Pool(args.workers, init_worker, (args, config, setup, golden)) as pool:
+        for test_stat, test_record in pool.imap(run_in_worker, handed_out()):
+            waiting.release()
+            stat.merge(test_stat)
+            if record is not None:
+                record.update(test_record)
+
 def run(args):
     ''' Handle the script tasks '''
 
     stat = stats.Stats()
+    if args.samples:
+        stat.samples = stats.Samples(args.samples)
     # 1. Parse configuration
     if args.config is None:
         output.error("No configuration file provided")
@@ -68,34 +146,27 @@ def run(args):
         print(f"Starting test run: {args.note} - {config.name}")
 
     # 2. select test target engine
-    engine = None
-    if args.system == 'duckdb':
-        engine = duck.DuckDbSystem()
-    elif args.system == 'mallard': # duckdb using a native database ; Mallards are native to America
-        # not well tested at this point (2024-10-18)
-        engine = mallard.NativeDuckSystem('~/test_lpcloud_data/single_file/native.db')
-    else:
+    engine = make_engine(args.system)
+    if engine is None:
         output.log.error('no engine defined')
         sys.exit(-1)
 
     # 3. create search query as generator
     engine.use_configuration(config)
+    golden = verify.load_golden(args.golden)
+    record = {} if args.record else None
 
-    mode = "single" # vs process, thread
+    mode = args.mode # single, process, or thread
 
     if mode == 'single':
         # One thread at a time
         for resp in engine.generate_tests():
-            result = run_one_test(engine, args, stat, resp)
+            result = run_one_test(engine, args, stat, resp, golden, record)
             output.log.debug(result)
 
     elif mode == 'process':
-        # original action, multiple threads used, but watch connections
-        with multiprocessing.Pool() as p:
-            tester = functools.partial(run_one_test, engine, args, stat)
-            for result in p.map(lambda x : tester, engine.generate_tests()):
-                if result is not None:
-                    output.log.debug(result)
+        # one engine per process, this can use all the cores when one duckdb does not scale
+        run_processes(engine, args, config, stat, golden, record)
 
     elif mode == 'thread':
         # and idea that may not be fully functioning
@@ -111,6 +182,10 @@ def run(args):
     base_name = f"{tools.iso_ish()}-{tools.file_safe(config.name)}-{args.note}"
     file.write(stat.dump(), f"{base_name}.json")
     stat.csv(f"{base_name}.csv")
+    if stat.samples is not None:
+        stat.samples.close()
+    if record is not None:
+        verify.save_golden(args.record, record)
 
     output.log.info("#"*80)
 
@@ -129,12 +204,21 @@ def handle_args() -> argparse.Namespace:
     parser.add_argument("config", help='Path to configuration file.')
     parser.add_argument("-d", "--data",
         help='Path to data files which goes into {data}. Include any quotes or [] as needed')
+    parser.add_argument("-g", "--golden",
+        help='JSON file of recorded counts and checksums to verify tests without an expected rule.')
     parser.add_argument("-n", "--note", default='normal', help='give a note about this specific run.')
-    parser.add_argument("-m", "--mode", default='single', help='Processing mode. single is best.')
+    parser.add_argument("-r", "--record",
+        help='Write the count and checksum of every test to this JSON file as golden values.')
+    parser.add_argument("-m", "--mode", default='single', choices=['single', 'process', 'thread'],
+        help='Processing mode. single is best for timing one query, process uses all the cores.')
+    parser.add_argument("--samples",
+        help="Parquet file to write every raw sample to, one row for each try of each test.")
     parser.add_argument("-s", "--system", default='duckdb', help="engine to test, duckdb or mallard")
     parser.add_argument("-t", "--tries", default='8', type=int,
         help="Number of times to run a test.")
     parser.add_argument("-v", "--verbose", action="store_true", help="Increase output verbosity")
+    parser.add_argument("-w", "--workers", type=int,
+        help="Number of processes in process mode, defaults to the number of cores.")
 
     # Parse arguments
     args = parser.parse_args()
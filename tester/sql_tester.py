@@ -7,6 +7,14 @@ lines, 2. swap out {data} with an actual path to the data.
 
 NOTE: HTTP stats are only run if s3:// is in the data path.
 
+To study S3 request patterns without network access, serve a local directory as a bucket with
+--s3-root and point --data at it, every HEAD and GET made for a test is counted in the report:
+
+ ./sql_tester.py out.csv --s3-root ../data --s3-latency 20 --data "'s3://bigstac/*.parquet'"
+
+A util/s3_local.py already running on its own can be used with --s3-endpoint and still counts the
+requests of each test, other S3 compatible servers only give totals on their side.
+
 example run:
 
  ./sql_tester.py out.csv
@@ -18,13 +26,16 @@ example run:
 
 import argparse
 import csv
+import itertools
 import sys
 import time
 
 from util import file as filer
 from util import output
+from util import s3_local
 from util import stats
 from util import tools
+from util import verify
 
 from target_duckdb import engine as duck
 from target_duckdb import native as mallard
@@ -32,27 +43,39 @@ from target_duckdb import native as mallard
 # ################################################################################################ #
 # Mark: - Functions
 
-def run_one_test(engine:duck, args:argparse.Namespace, stat:stats.Stats, data:dict):
+def run_one_test(engine:duck, args:argparse.Namespace, stat:stats.Stats, data:dict,
+    s3_server:s3_local.LocalS3Server|s3_local.RemoteLabels = None, golden:dict = None,
+    record:dict = None):
     ''' Run one query and record the statistical information about that call. '''
     config_name = f"{data['name']}-{data['action']}"
     test_query = data['sql']
     test_query = test_query.replace('{data}', args.data)
     output.log.debug(test_query)
     out = None
+    if s3_server:
+        s3_server.label(config_name)
 
     http_stats = {}
     if 's3://' in args.data:
         # Get the HTTP stats once, before other runs in case caching has an impact
+        if s3_server:
+            s3_server.label(f"{config_name}-stats") # kept out of the totals for the test
         http_stats = engine.http_stats(test_query)
+        if s3_server:
+            s3_server.label(config_name)
 
-    for _ in range(args.tries):
-        mark_start = int(time.time() * 1000)
+    for attempt in range(args.tries):
+        size = s3_server.summary(config_name)['bytes'] if s3_server else None
+        mark_start = time.perf_counter_ns()
         out = engine.run_test(test_query)
-        mark_stop = int(time.time() * 1000)
+        mark_stop = time.perf_counter_ns()
 
         #4. take stats
-        mark_diff = mark_stop - mark_start
+        if s3_server:
+            size = s3_server.summary(config_name)['bytes'] - size
+        mark_diff = (mark_stop - mark_start) / 1_000_000 # ms
         stat.value(mark_diff, config_name)
+        stat.sample(config_name, attempt, mark_stop - mark_start, len(out), size)
         sub = stat.get_sub(config_name)
         sub.value(mark_diff)
         sub.note("note", args.note)
@@ -60,19 +83,38 @@ def run_one_test(engine:duck, args:argparse.Namespace, stat:stats.Stats, data:di
         if 's3://' in args.data:
             for key, value in http_stats.items():
                 sub.note(key, value)
+        output.log.info("\tn=%s\tr=%d\tms=%d", config_name, len(out), mark_diff)
+
+    #5. validate response once, outside of the timed runs, against golden values if there are any
+    valid = None
+    if data['name'] != engine.special_lifecycle_name:
+        if s3_server:
+            s3_server.label(f"{config_name}-verify") # kept out of the totals for the test
+        valid = verify.verify_test(engine, test_query, config_name, None, golden, record)
+    if valid is not None:
+        sub = stat.get_sub(config_name)
+        stat.add('valid' if valid else 'failed', 1) # top level, all tests
+        sub.add('valid' if valid else 'failed', 1) # lower level, just this test
+    output.log.info("\tn=%s\tv=%s", config_name, valid)
 
-        #5. validate response
-        valid = None
-        #if config.expected:
-        #    # configuration has an expected setting, so verify it
-        #    valid = engine.verify(config.expected, out)
-        #    stat.add('valid' if valid else 'failed', 1) # top level, all tests
-        #    sub.add('valid' if valid else 'failed', 1) # lower level, just this test
-        output.log.info("\tn=%s\tr=%d\tms=%d\tv=%s",
-            config_name, len(out), mark_stop-mark_start, valid)
+    if s3_server:
+        # requests seen by the server over all the tries, the stats and verify runs have their own
+        s3_server.label(s3_local.NO_LABEL)
+        sub = stat.get_sub(config_name)
+        for key, value in s3_server.summary(config_name).items():
+            sub.note(f"s3-{key}", value)
     out = str(len(out))
     return out #give the last one back so there is something to work with in the caller
 
+def write_requests(s3_server:s3_local.LocalS3Server, out_file:str):
+    ''' Write out every request the local S3 server saw, one row per request. '''
+    headers = ['label', 'time', 'method', 'key', 'first', 'last', 'bytes', 'status', 'ms']
+    with open(out_file, 'w', encoding='utf8') as file:
+        writer = csv.DictWriter(file, fieldnames=headers)
+        writer.writeheader()
+        for item in s3_server.log.rows():
+            writer.writerow(item)
+
 def run(args:argparse.Namespace):
     '''
     Run the steps of the script:
@@ -92,22 +134,31 @@ def run(args:argparse.Namespace):
         output.log.critical("No data path provided.")
         sys.exit(1)
 
-    data = None # Decoded CSV rows
-    if args.config:
-        with open(args.config, 'r', encoding='utf-8') as file:
-            # Assuming 'file' is a file object opened in read mode
-            csv_reader = csv.DictReader(file)
-            data = list(csv_reader)
-    else:
-        # read from standard in
-        csv_reader = csv.DictReader(sys.stdin)
-        data = list(csv_reader)
+    # Decoded CSV rows are read one at a time as the tests run so large suites can be streamed in
+    source = open(args.config, 'r', encoding='utf-8') if args.config else sys.stdin # pylint: disable=consider-using-with
+    data = csv.DictReader(source)
+    first = next(data, None)
 
     # 2. select test target engine
     engine = None
+    s3_server = None
     if args.system == 'duckdb':
         engine = duck.DuckDbSystem()
-        if args.keys:
+        if args.s3_root:
+            s3_server = s3_local.LocalS3Server(args.s3_root, args.s3_bucket,
+                latency_ms=args.s3_latency,
+                bandwidth=args.s3_bandwidth * 1024 * 1024).start()
+            output.log.log(output.LOG_ALWAYS, "Serving %s as s3://%s at %s", s3_server.root,
+                s3_server.bucket, s3_server.endpoint)
+            engine.use_endpoint(s3_server.endpoint)
+        elif args.s3_endpoint:
+            engine.use_endpoint(args.s3_endpoint)
+            # a stand alone s3_local.py takes labels, other servers can only be counted in total
+            s3_server = s3_local.RemoteLabels(args.s3_endpoint).connect()
+            if s3_server is None:
+                output.log.warning("%s does not take labels, no per test S3 counts",
+                    args.s3_endpoint)
+        elif args.keys:
             engine.send_credentials(args.keys)
     elif args.system == 'mallard': # duckdb using a native database ; Mallards are native to America
         # not well tested at this point (2024-10-18)
@@ -118,25 +169,38 @@ def run(args:argparse.Namespace):
 
     # 3. run the tests in each row
     stat = stats.Stats()
-    if not 'suite' in data[0]:
+    if args.samples:
+        stat.samples = stats.Samples(args.samples)
+    golden = verify.load_golden(args.golden)
+    record = {} if args.record else None
+    if first is None or not 'suite' in first:
         output.log.critical("No 'suite' column in CSV file.")
         sys.exit(3)
-    suite_name = data[0]["suite"] # Assume this column is the same for all rows
+    suite_name = first["suite"] # Assume this column is the same for all rows
     output.log.log(output.LOG_ALWAYS, "Starting test run: [%s - %s]...", suite_name, args.note)
-    for row in data:
+    for row in itertools.chain([first], data):
         # NOTE: need to decode SQL from CSV: replace \n with newline
         sql = row['sql'].replace('\\n', '\n')
         row['sql'] = sql
 
         # ##########
         # The test !
-        run_one_test(engine, args, stat, row)
+        run_one_test(engine, args, stat, row, s3_server, golden, record)
+    if source is not sys.stdin:
+        source.close()
 
     # 4. write out the results
     base_name = f"reports/{tools.iso_ish()}-{tools.file_safe(suite_name)}-{args.note}"
     filer.create('reports')
     filer.write(stat.dump(), f"{base_name}.json")
     stat.csv(f"{base_name}.csv")
+    if stat.samples is not None:
+        stat.samples.close()
+    if record is not None:
+        verify.save_golden(args.record, record)
+    if isinstance(s3_server, s3_local.LocalS3Server):
+        write_requests(s3_server, f"{base_name}-s3.csv")
+        s3_server.stop()
 
     mark_stop = int(time.time() * 1000)
 
@@ -161,10 +225,26 @@ def handle_args() -> argparse.Namespace:
     parser.add_argument("-d", "--data",
         help='''Path to data files or name of DuckDB table which goes into {data}.
 Include any quotes or [] as needed'''.replace('\n', ' '))
+    parser.add_argument('-g', "--golden",
+        help='JSON file of recorded counts and checksums to verify each test against.')
     parser.add_argument('-k', "--keys", required=False,
         help='Path to aws credential file. Credentials are only sent if this flag is used.')
     parser.add_argument("-n", "--note", default='normal',
         help='give a note about this specific run.')
+    parser.add_argument("-r", "--record",
+        help='Write the count and checksum of every test to this JSON file as golden values.')
+    parser.add_argument("--samples",
+        help="Parquet file to write every raw sample to, one row for each try of each test.")
+    parser.add_argument("--s3-root",
+        help='Serve this directory as a local S3 bucket and count the requests made by each test.')
+    parser.add_argument("--s3-bucket", default='bigstac', help='Bucket name used with --s3-root.')
+    parser.add_argument("--s3-endpoint",
+        help='host:port of an already running S3 compatible server to read from, requests are '
+            'counted for each test when it is util/s3_local.py.')
+    parser.add_argument("--s3-latency", default=0, type=float,
+        help='Milliseconds added to each request made to --s3-root.')
+    parser.add_argument("--s3-bandwidth", default=0, type=float,
+        help='Bandwidth limit in MB/s for --s3-root, 0 for none.')
     parser.add_argument("-s", "--system", default='duckdb', help="engine to test, duckdb")
     parser.add_argument("-t", "--tries", default='8', type=int,
         help="Number of times to run a test.")
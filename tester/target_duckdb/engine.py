@@ -45,7 +45,7 @@ class DuckDbSystem(target_system.TargetSystem):
 
         # ######################
         # generate tests
-        for test in self.data.tests:
+        for test in self.data.each_test(): # templates are expanded one test at a time
             src = test.source if test.source else '{data}/**/*.parquet'
             if not test.raw is None:
                 # test provides it's own sql
@@ -71,14 +71,76 @@ class DuckDbSystem(target_system.TargetSystem):
                     tests=[])
                 yield [sql, setup_test]
 
+    def generate_late(self, test: test_config.AssessType) -> str:
+        '''
+        Late materialization version of a test, or None if it does not apply. The filter, sort, and
+        limit are run first reading only the columns they need along with the file name and row
+        number of each match. These are written into a second query, a read_parquet() for each file
+        with its row numbers as literals so duckdb only reads the pages holding them, which is run
+        with query(). A join on the row numbers can not be pushed into the scan and reads every row
+        group again, which made it slower than the plain query.
+        '''
+        if test.raw is not None or test.limit < 1:
+            return None # without a limit nearly every row is read in the second phase anyway
+        src = test.source if test.source else '{data}/**/*.parquet'
+        hive = ', hive_partitioning=true' if self.hive_levels() else ''
+        located = f"read_parquet({src}, filename=true, file_row_number=true{hive})"
+        fetch = (f"SELECT * EXCLUDE (file_row_number) FROM read_parquet({{}}, "
+            f"file_row_number=true{hive}) WHERE file_row_number IN ({{}})")
+        # with no hits there are no files to read, so fall back to a query with the same columns
+        empty = f"SELECT * EXCLUDE (filename, file_row_number) FROM {located} LIMIT 0"
+        empty = empty.replace("'", "''")
+        return f"""-- {test.description} (late)
+    SET VARIABLE late_fetch = coalesce((
+        SELECT string_agg(format('{fetch}', '''' || replace(filename, '''', '''''') || '''',
+            rows), ' UNION ALL BY NAME ')
+        FROM (
+            SELECT filename, string_agg(file_row_number, ', ') AS rows
+            FROM (
+                SELECT filename, file_row_number
+                FROM {located}
+                WHERE {self.generate_where(test)}
+                {self.generate_sort(test)}
+                {self.generate_limit(test)})
+            GROUP BY filename)), '{empty}');
+    SELECT {self.generate_select(test)}
+    FROM query(getvariable('late_fetch'))
+    {self.generate_sort(test)}
+    {self.generate_limit(test)}"""
+
     def generate_select(self, test: test_config.AssessType) -> str:
-        ''' Generate a select statment of the sql '''
+        '''
+        Generate a select statment of the sql. A * leaves out the columns hive_partitioning adds
+        so results match the same data unpartitioned.
+        '''
+        added = self.hive_added()
+        if test.columns == ['*'] and added:
+            return f"* EXCLUDE ({', '.join(added)})"
         return ','.join(test.columns)
 
     def generate_from(self, src:str) -> str:
         ''' Generate a from statment of the sql '''
+        if self.hive_levels():
+            return f"read_parquet({src}, hive_partitioning=true)"
         return f"read_parquet({src})"
 
+    def hive_levels(self) -> list[tuple]:
+        ''' (name, column, format) for each level of the suite's hive layout, if it has one. '''
+        layout = getattr(self.data, 'hive_partitioning', None) or {}
+        levels = []
+        for name, source in layout.items():
+            column, _, pattern = source.partition(':')
+            levels.append((name, column, pattern or None))
+        return levels
+
+    def hive_added(self) -> list[str]:
+        '''
+        Partition columns to leave out of SELECT *. hive.py writes no partition column into the
+        files, so a level named for its own column, like ProviderId=ProviderId, is the data column.
+        '''
+        return [name for name, column, pattern in self.hive_levels()
+            if name != column or pattern]
+
     def generate_sort(self, test: test_config.AssessType) -> str:
         ''' Generate a sort statment of the sql '''
         return f"ORDER BY {test.sortby}" if test.sortby else ''
@@ -100,10 +162,69 @@ class DuckDbSystem(target_system.TargetSystem):
                     where_list.append(self.generate_bbox(step))
                 elif step.type_of == 'attribute_raw':
                     where_list.append(self.generate_attribute_raw(step))
+                elif step.type_of == 'collection':
+                    where_list.append(self.generate_collection(step))
+        where_list.extend(self.generate_partitions(test))
 
         stm_where = '\tAND'.join(where_list)
         return stm_where
 
+    def generate_collection(self, step: test_config.OpType) -> str:
+        ''' Generate a collection statement, value is a comma list of collection concept ids '''
+        ids = ', '.join(f"'{item.strip()}'" for item in step.value.split(','))
+        return f"\n\t-- {step.description}\n\tCollectionConceptId IN ({ids})\n"
+
+    def generate_partitions(self, test: test_config.AssessType) -> list[str]:
+        '''
+        Predicates on the hive partition columns which duckdb can use to skip whole directories,
+        taken from the collection and StartTime steps of a test. Year, month, and day levels made
+        from StartTime are compared as one ordered key, so 2020-03 is after 2019-11.
+        '''
+        levels = self.hive_levels()
+        if not levels:
+            return []
+        out = []
+        parts = {'%Y': (0, 4), '%m': (5, 7), '%d': (8, 10)}
+        times = []
+        for pattern in ['%Y', '%m', '%d']:
+            found = [name for name, column, kind in levels
+                if column == 'StartTime' and kind == pattern]
+            if not found:
+                break
+            times.append((found[0], parts[pattern]))
+        for op in test.operations:
+            for step in op.ands:
+                if step.type_of == 'collection':
+                    ids = ', '.join(f"'{item.strip()}'" for item in step.value.split(','))
+                    for name, column, kind in levels:
+                        if column == 'CollectionConceptId' and kind is None:
+                            out.append(f"\n\t-- partition of {step.description}\n"
+                                f"\t{name} IN ({ids})\n")
+                elif step.type_of == 'time' and times:
+                    bound = None
+                    if step.option == 'greater-then':
+                        bound = (step.value, '>')
+                    elif step.option == 'less-then':
+                        bound = (step.value, '<')
+                    elif step.option == 'range' and step.value.split('/')[0]:
+                        bound = (step.value.split('/')[0], '<')
+                    if bound:
+                        out.append(f"\n\t-- partition of {step.description}\n"
+                            f"\t{self.partition_bound(times, *bound)}\n")
+        return out
+
+    def partition_bound(self, times: list[tuple], value: str, direction: str) -> str:
+        '''
+        Predicate for (year, month, ...) being on the direction side of value, or equal. Values are
+        compared as the zero padded text hive.py writes, duckdb reads month=01 as VARCHAR.
+        '''
+        name, (start, stop) = times[0]
+        text = f"'{value[start:stop]}'"
+        if len(times) == 1:
+            return f"{name} {direction}= {text}"
+        rest = self.partition_bound(times[1:], value, direction)
+        return f"({name} {direction} {text} OR ({name} = {text} AND {rest}))"
+
     def generate_attribute_raw(self, step: test_config.OpType) -> str:
         ''' Generate an bounding box attribute query statement for the where clause '''
         partial_statment = f"\n\t-- {step.description}\n"
@@ -111,14 +232,35 @@ class DuckDbSystem(target_system.TargetSystem):
 
         return partial_statment
 
+    def bbox_columns(self, name: str) -> list[str]:
+        ''' xmin, ymin, xmax, ymax of a bbox struct column, or of the MBR or LR (LIR) columns '''
+        if name in ['MBR', 'LR']:
+            return [f"{name}West", f"{name}South", f"{name}East", f"{name}North"]
+        return [f"{name}.xmin", f"{name}.ymin", f"{name}.xmax", f"{name}.ymax"]
+
     def generate_bbox(self, step: test_config.OpType) -> str:
-        ''' Generate an bounding box attribute query statement for the where clause '''
-        # todo: use this for LIR too, as an option
+        '''
+        Generate an bounding box attribute query statement for the where clause. A query box with
+        xmin > xmax crosses the antimeridian and is split into a box on each side. Envelopes in the
+        data with xmin > xmax cross it too, when step.antimeridian is on these are also tested as
+        two sides so they are not missed, at the cost of duckdb not using the x statistics.
+        '''
+        xmin, ymin, xmax, ymax = self.bbox_columns(step.bbox_column_name)
+        if step.xmin > step.xmax:
+            sides = [(step.xmin, 180.0), (-180.0, step.xmax)]
+        else:
+            sides = [(step.xmin, step.xmax)]
+        tests = []
+        for west, east in sides:
+            test = f"({west} <= {xmax} AND {east} >= {xmin})"
+            if step.antimeridian:
+                test = f"({test} OR ({xmin} > {xmax} AND ({east} >= {xmin} OR {west} <= {xmax})))"
+            tests.append(test)
+        x_test = tests[0] if len(tests) == 1 else f"({' OR '.join(tests)})"
         partial_statment = f"\n\t-- {step.description}\n"
-        partial_statment += f"\t({step.xmin} <= {step.bbox_column_name}.xmax AND "
-        partial_statment += f"{step.xmax} >= {step.bbox_column_name}.xmin AND "
-        partial_statment += f"{step.ymin} <= {step.bbox_column_name}.ymax AND "
-        partial_statment += f"{step.ymax} >= {step.bbox_column_name}.ymin) \n"
+        partial_statment += f"\t({x_test} AND "
+        partial_statment += f"{step.ymin} <= {ymax} AND "
+        partial_statment += f"{step.ymax} >= {ymin}) \n"
 
         return partial_statment
 
@@ -128,10 +270,13 @@ class DuckDbSystem(target_system.TargetSystem):
         # intersects = st_intersects
         # contains = st_contains
         partial_statment = f"\n\t-- {step.description}\n"
-        if step.option == 'intersects':
-            partial_statment += f"\tst_intersects(geometry, '{step.value}'::GEOMETRY)\n"
-        elif step.option == 'contains':
-            partial_statment += f"\tst_contains(geometry, '{step.value}'::GEOMETRY)\n"
+        if step.option in ['intersects', 'contains']:
+            exact = f"st_{step.option}(geometry, '{step.value}'::GEOMETRY)"
+            if step.coarse_column_name:
+                # the coarse shape covers the full one, so only rows it passes need the exact test
+                coarse = f"st_{step.option}({step.coarse_column_name}, '{step.value}'::GEOMETRY)"
+                exact = f"CASE WHEN {coarse} THEN {exact} ELSE false END"
+            partial_statment += f"\t{exact}\n"
         else:
             partial_statment += f"\n-- {step.option} is known\n"
 
@@ -183,6 +328,24 @@ class DuckDbSystem(target_system.TargetSystem):
         res = self.connection.sql(code).fetchall()
         return res
 
+    def run_setup(self, code:str) -> str:
+        '''
+        Run every statement of code but the last, like the SET VARIABLE of a late test, and return
+        the last one so it can be wrapped in another query.
+        '''
+        statements = duckdb.extract_statements(code)
+        for statement in statements[:-1]:
+            self.connection.execute(statement)
+        return statements[-1].query.strip().rstrip(';')
+
+    def summarize(self, code:str) -> dict:
+        ''' Count and hash the rows of a query inside duckdb, the row order does not matter. '''
+        inner = self.run_setup(code)
+        sql = ("SELECT count(*)::BIGINT, coalesce(sum(hash(t)), 0)::VARCHAR "
+            f"FROM (\n{inner}\n) AS t")
+        count, checksum = self.connection.sql(sql).fetchone()
+        return {'count': count, 'checksum': checksum}
+
     def give_to_each_user(self):
         return self.connection
 
@@ -194,9 +357,17 @@ class DuckDbSystem(target_system.TargetSystem):
             return ans and ans[0][0]
         return False
 
+    def use_endpoint(self, endpoint:str, use_ssl:bool=False):
+        ''' Send S3 requests to an S3 compatible server instead of AWS. '''
+        self.has_credentials = True
+        self.connection.execute(tools.create_endpoint_secret(endpoint, use_ssl)).fetchall()
+        # cached metadata would hide requests from the accounting on the server
+        self.connection.execute("SET enable_http_metadata_cache = false")
+
     def http_stats(self, sql:str) -> dict:
         ''' Run a sql query and return the HTTP stats of the query '''
 
+        sql = self.run_setup(sql)
         command = f'''
             PRAGMA enable_profiling ;
             EXPLAIN ANALYZE
@@ -208,3 +379,69 @@ class DuckDbSystem(target_system.TargetSystem):
         self.connection.sql(f'PRAGMA disable_profiling ;')
         stats = tools.parse_http_stats(details)
         return stats
+
+# ################################################################################################ #
+# testing
+
+def hive_test():
+    '''
+    Tests made for a layout written by analyze/hive.py run against it and find the same rows as the
+    same tests against the flat file.
+    '''
+    import glob
+    import json
+    import logging
+    import os
+    import sys
+    import tempfile
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import shapely
+    rng = np.random.default_rng(3)
+    starts = np.datetime64('2019-01-01') + rng.integers(0, 3 * 365 * 24, 2000).astype(
+        'timedelta64[h]')
+    table = pa.table({'GranuleUR': [f"g{index}" for index in range(2000)],
+        'ProviderId': rng.choice(['LPCLOUD', 'ASF'], 2000),
+        'CollectionConceptId': rng.choice(['C1-LPCLOUD', 'C2-LPCLOUD', 'C3-ASF'], 2000),
+        'StartTime': [f"{item}Z" for item in starts.astype('datetime64[ms]')],
+        'geometry': shapely.to_wkb(shapely.points(rng.uniform(-180, 180, 2000),
+            rng.uniform(-90, 90, 2000)))})
+    steps = [[{'type_of': 'time', 'option': 'greater-then', 'value': '2020-03-15T00:00:00Z'}],
+        [{'type_of': 'time', 'option': 'less-then', 'value': '2019-11-02T00:00:00Z'}],
+        [{'type_of': 'collection', 'value': 'C2-LPCLOUD'},
+            {'type_of': 'time', 'option': 'greater-then', 'value': '2021-10-01T00:00:00Z'}]]
+    # hive.py rewrites the geometry and adds bbox, so compare the columns it leaves alone
+    columns = ['GranuleUR', 'ProviderId', 'CollectionConceptId', 'StartTime']
+    tests = [{'name': f"t{index}", 'operations': [{'ands': ands}], 'limit': 0,
+        'columns': columns, 'source': '{data}'} for index, ands in enumerate(steps)]
+    hive = os.path.join(os.path.dirname(__file__), '..', '..', 'analyze', 'hive.py')
+    output.log = output.log or logging.getLogger('hive_test')
+    engine = DuckDbSystem()
+    with tempfile.TemporaryDirectory() as temp:
+        flat = os.path.join(temp, 'flat.parquet')
+        pq.write_table(table, flat)
+        subprocess.run([sys.executable, hive, flat, '-o', f"{temp}/hive", '--target-rows', '100',
+            '--row-group-size', '100'], check=True, capture_output=True)
+        with open(f"{temp}/hive/_layout.json", encoding='utf-8') as file:
+            layout = json.load(file)
+        for partitioned in [False, True]:
+            engine.use_configuration(test_config.AssessConfig(name='hive', tests=tests,
+                **({'hive_partitioning': layout} if partitioned else {})))
+            data = f"'{temp}/hive/**/*.parquet'" if partitioned else f"'{flat}'"
+            found = [engine.summarize(sql.replace('{data}', data))
+                for sql, _ in engine.generate_tests()]
+            if not partitioned:
+                expected = found
+        assert found == expected, (found, expected)
+        assert all(item['count'] for item in found)
+
+        # SELECT * gives the columns in the files and none of the partition columns
+        engine.use_configuration(test_config.AssessConfig(name='hive',
+            tests=[{**tests[0], 'columns': ['*']}], hive_partitioning=layout))
+        sql, _ = next(engine.generate_tests())
+        names = engine.connection.sql(sql.replace('{data}', data)).columns
+        part = glob.glob(f"{temp}/hive/**/*.parquet", recursive=True)[0]
+        assert names == pq.read_schema(part).names, names
+
+#hive_test()
@@ -65,6 +65,17 @@ def create_secret(credential_file: str) -> str:
         SECRET '{access_key}',
         REGION 'us-east-1');'''
 
+def create_endpoint_secret(endpoint: str, use_ssl: bool = False) -> str:
+    ''' Point S3 requests at an S3 compatible server such as util/s3_local.py. '''
+    return f'''CREATE OR REPLACE SECRET local_s3(
+        TYPE S3,
+        KEY_ID 'bigstac',
+        SECRET 'bigstac',
+        REGION 'us-east-1',
+        ENDPOINT '{endpoint}',
+        URL_STYLE 'path',
+        USE_SSL {'true' if use_ssl else 'false'});'''
+
 # ################################################################################################ #
 # In-line testing
 
@@ -0,0 +1,374 @@
+'''
+A small S3 compatible server which serves a local directory as a bucket so the S3 code paths of the
+tester can be exercised without network access. Only the calls DuckDB's httpfs makes for reading
+parquet are supported: HEAD and ranged GET of objects and ListObjectsV2 for globs.
+
+Every request is recorded with its byte count and attributed to the label that was current when the
+request was made, normally the name of the test being run. Latency and bandwidth can be injected to
+act more like a remote bucket.
+
+Run stand alone with:
+
+    python3 util/s3_local.py --root ../data --bucket bigstac --port 9000 --latency 20
+
+Clients which can not call label() directly can PUT /_label?name=... to change the label and
+GET /_stats?name=... for a JSON summary of the requests made under that label. These two calls are
+not recorded, so polling for stats does not add to the totals.
+'''
+
+import argparse
+import email.utils
+import hashlib
+import http.server
+import json
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from xml.sax.saxutils import escape
+
+NO_LABEL = 'none'
+
+class RequestLog:
+    ''' Thread safe list of the requests made against the server. '''
+
+    def __init__(self, echo:bool=False):
+        ''' echo prints each request as it is recorded. '''
+        self.lock = threading.Lock()
+        self.requests = []
+        self.label = NO_LABEL
+        self.echo = echo
+
+    def set_label(self, name:str):
+        ''' All requests after this call will be attributed to name. '''
+        with self.lock:
+            self.label = name
+
+    def record(self, method:str, key:str, first:int, last:int, sent:int, status:int, ms:float):
+        ''' Store one request, first and last are the requested byte range if any. '''
+        with self.lock:
+            self.requests.append({'label': self.label, 'time': time.time(), 'method': method,
+                'key': key, 'first': first, 'last': last, 'bytes': sent, 'status': status,
+                'ms': ms})
+            if self.echo:
+                print(f"{self.label}\t{method}\t{key}\t{sent}", flush=True)
+
+    def summary(self, name:str) -> dict:
+        ''' Counts and bytes by method for the requests made under one label. '''
+        out = {'requests': 0, 'bytes': 0, 'HEAD': 0, 'GET': 0, 'LIST': 0}
+        with self.lock:
+            for item in self.requests:
+                if item['label'] != name:
+                    continue
+                out['requests'] += 1
+                out['bytes'] += item['bytes']
+                out[item['method']] = out.get(item['method'], 0) + 1
+        return out
+
+    def rows(self) -> list:
+        ''' A copy of all the requests, for writing out as a CSV. '''
+        with self.lock:
+            return list(self.requests)
+
+class S3Handler(http.server.BaseHTTPRequestHandler):
+    ''' Answer S3 requests using the settings on the server object. '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        ''' Requests are tracked in the RequestLog, keep the console quiet. '''
+
+    def _split(self) -> tuple[str, str, dict]:
+        ''' Break a path style url into bucket, key and query parameters. '''
+        parsed = urllib.parse.urlparse(self.path)
+        parts = urllib.parse.unquote(parsed.path).lstrip('/').split('/', 1)
+        bucket = parts[0]
+        key = parts[1] if len(parts) > 1 else ''
+        query = dict(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True))
+        return bucket, key, query
+
+    def _local_path(self, key:str) -> str|None:
+        ''' Map a key to a file in the root, refusing anything which escapes it. '''
+        root = self.server.root
+        path = os.path.realpath(os.path.join(root, key))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def _delay(self):
+        ''' Injected per request latency. '''
+        if self.server.latency_ms > 0:
+            time.sleep(self.server.latency_ms / 1000.0)
+
+    def _send_body(self, data:bytes):
+        ''' Write a body, throttled to the configured bandwidth. '''
+        rate = self.server.bandwidth
+        if rate <= 0:
+            self.wfile.write(data)
+            return
+        chunk = 64 * 1024
+        for start in range(0, len(data), chunk):
+            piece = data[start:start+chunk]
+            self.wfile.write(piece)
+            time.sleep(len(piece) / rate)
+
+    def _error(self, status:int, code:str):
+        body = (f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code>'
+            f'<Message>{code}</Message></Error>').encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _object_headers(self, path:str):
+        stat = os.stat(path)
+        etag = hashlib.md5(f"{path}{stat.st_size}{stat.st_mtime}".encode()).hexdigest()
+        self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+        self.send_header('ETag', f'"{etag}"')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'binary/octet-stream')
+
+    def do_HEAD(self): # pylint: disable=invalid-name
+        ''' Object size and dates, DuckDB calls this before reading a file. '''
+        mark_start = time.time()
+        self._delay()
+        bucket, key, _ = self._split()
+        path = self._local_path(key) if bucket == self.server.bucket else None
+        if path is None:
+            self._error(404, 'NoSuchKey')
+            status = 404
+        else:
+            self.send_response(200)
+            self._object_headers(path)
+            self.send_header('Content-Length', str(os.path.getsize(path)))
+            self.end_headers()
+            status = 200
+        self.server.log.record('HEAD', key, -1, -1, 0, status, (time.time()-mark_start)*1000)
+
+    def do_GET(self): # pylint: disable=invalid-name
+        ''' Ranged object reads and bucket listings. '''
+        mark_start = time.time()
+        bucket, key, query = self._split()
+        if bucket == '_stats':
+            self._send_json(self.server.log.summary(query.get('name', NO_LABEL)))
+            return
+        self._delay()
+        if bucket != self.server.bucket:
+            self._error(404, 'NoSuchBucket')
+            return
+        if not key or 'list-type' in query:
+            sent = self._list(query)
+            self.server.log.record('LIST', query.get('prefix', ''), -1, -1, sent, 200,
+                (time.time()-mark_start)*1000)
+            return
+
+        path = self._local_path(key)
+        if path is None:
+            self._error(404, 'NoSuchKey')
+            self.server.log.record('GET', key, -1, -1, 0, 404, (time.time()-mark_start)*1000)
+            return
+        size = os.path.getsize(path)
+        first, last, status = 0, size - 1, 200
+        ranged = self.headers.get('Range')
+        if ranged and ranged.startswith('bytes='):
+            start, _, end = ranged[6:].partition('-')
+            if start:
+                first = int(start)
+                last = min(int(end), size - 1) if end else size - 1
+            else:
+                # suffix range, the last n bytes, used to find parquet footers
+                first = max(size - int(end), 0)
+            status = 206
+        with open(path, 'rb') as file:
+            file.seek(first)
+            data = file.read(last - first + 1)
+        self.send_response(status)
+        self._object_headers(path)
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {first}-{last}/{size}")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self._send_body(data)
+        self.server.log.record('GET', key, first, last, len(data), status,
+            (time.time()-mark_start)*1000)
+
+    def do_PUT(self): # pylint: disable=invalid-name
+        ''' Only used to change the label, the bucket is read only. '''
+        bucket, _, query = self._split()
+        if bucket != '_label':
+            self._error(403, 'AccessDenied')
+            return
+        self.server.log.set_label(query.get('name', NO_LABEL))
+        self._send_json({'label': query.get('name', NO_LABEL)})
+
+    def _send_json(self, data:dict):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _list(self, query:dict) -> int:
+        ''' ListObjectsV2, paged by key with the continuation token being the last key sent. '''
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter', '')
+        max_keys = int(query.get('max-keys', 1000))
+        after = query.get('continuation-token', query.get('start-after', ''))
+
+        keys = []
+        for folder, _, files in os.walk(self.server.root):
+            for name in files:
+                full = os.path.join(folder, name)
+                keys.append(os.path.relpath(full, self.server.root).replace(os.sep, '/'))
+        keys = sorted(k for k in keys if k.startswith(prefix) and k > after)
+
+        contents, prefixes = [], []
+        for key in keys:
+            if delimiter and delimiter in key[len(prefix):]:
+                common = prefix + key[len(prefix):].split(delimiter)[0] + delimiter
+                if common not in prefixes:
+                    prefixes.append(common)
+                continue
+            contents.append(key)
+        truncated = len(contents) > max_keys
+        contents = contents[:max_keys]
+
+        xml = ['<?xml version="1.0" encoding="UTF-8"?>',
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">',
+            f"<Name>{escape(self.server.bucket)}</Name><Prefix>{escape(prefix)}</Prefix>",
+            f"<KeyCount>{len(contents)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>",
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"]
+        if truncated:
+            xml.append(f"<NextContinuationToken>{escape(contents[-1])}</NextContinuationToken>")
+        for key in contents:
+            stat = os.stat(os.path.join(self.server.root, key))
+            modified = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(stat.st_mtime))
+            xml.append(f"<Contents><Key>{escape(key)}</Key><LastModified>{modified}</LastModified>"
+                f"<ETag>\"{stat.st_size}\"</ETag><Size>{stat.st_size}</Size>"
+                "<StorageClass>STANDARD</StorageClass></Contents>")
+        for common in prefixes:
+            xml.append(f"<CommonPrefixes><Prefix>{escape(common)}</Prefix></CommonPrefixes>")
+        xml.append('</ListBucketResult>')
+        body = ''.join(xml).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self._send_body(body)
+        return len(body)
+
+class LocalS3Server(http.server.ThreadingHTTPServer):
+    ''' Serve root as the only bucket, in a background thread. '''
+
+    daemon_threads = True
+
+    def __init__(self, root:str, bucket:str='bigstac', host:str='127.0.0.1', port:int=0,
+        latency_ms:float=0, bandwidth:float=0):
+        '''
+        Parameters:
+            root: directory to serve as the bucket
+            port: 0 picks a free port
+            latency_ms: delay added to every request
+            bandwidth: bytes per second for response bodies, 0 for no limit
+        '''
+        super().__init__((host, port), S3Handler)
+        self.root = os.path.realpath(os.path.expanduser(root))
+        self.bucket = bucket
+        self.latency_ms = latency_ms
+        self.bandwidth = bandwidth
+        self.log = RequestLog()
+        self.thread = None
+
+    @property
+    def endpoint(self) -> str:
+        ''' host:port as DuckDB expects it for an S3 endpoint. '''
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> 'LocalS3Server':
+        ''' Serve in a daemon thread so the caller can keep running tests. '''
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        ''' Stop serving and release the port. '''
+        self.shutdown()
+        self.server_close()
+
+    def label(self, name:str):
+        ''' Attribute the requests which follow to name. '''
+        self.log.set_label(name)
+
+    def summary(self, name:str) -> dict:
+        ''' Request counts and bytes made under a label. '''
+        return self.log.summary(name)
+
+class RemoteLabels:
+    '''
+    label() and summary() for a server already running elsewhere, such as this file run stand
+    alone, using the /_label and /_stats calls.
+    '''
+
+    def __init__(self, endpoint:str, timeout:float=5):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def _call(self, method:str, path:str, name:str) -> dict:
+        query = urllib.parse.urlencode({'name': name})
+        request = urllib.request.Request(f"http://{self.endpoint}/{path}?{query}", method=method)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def connect(self) -> 'RemoteLabels|None':
+        ''' self if the server takes labels, None for other S3 servers which only give totals. '''
+        try:
+            self.label(NO_LABEL)
+        except (OSError, ValueError):
+            return None
+        return self
+
+    def label(self, name:str):
+        ''' Attribute the requests which follow to name. '''
+        self._call('PUT', '_label', name)
+
+    def summary(self, name:str) -> dict:
+        ''' Request counts and bytes made under a label. '''
+        return self._call('GET', '_stats', name)
+
+# ################################################################################################ #
+# Mark: - Command functions
+
+def handle_args() -> argparse.Namespace:
+    ''' Process all the command line arguments and return an argparse Namespace object. '''
+    parser = argparse.ArgumentParser(description="Serve a local directory as an S3 bucket.")
+    parser.add_argument("-r", "--root", required=True, help='Directory to serve.')
+    parser.add_argument("-b", "--bucket", default='bigstac', help='Bucket name.')
+    parser.add_argument("-p", "--port", default=9000, type=int, help='Port to listen on.')
+    parser.add_argument("-l", "--latency", default=0, type=float,
+        help='Milliseconds to wait before answering each request.')
+    parser.add_argument("-w", "--bandwidth", default=0, type=float,
+        help='Bandwidth limit in MB/s, 0 for none.')
+    return parser.parse_args()
+
+def main():
+    ''' Be a command line app, printing each request as it is made. '''
+    args = handle_args()
+    server = LocalS3Server(args.root, args.bucket, port=args.port, latency_ms=args.latency,
+        bandwidth=args.bandwidth * 1024 * 1024)
+    server.log.echo = True
+    print(f"Serving {server.root} as s3://{server.bucket} at {server.endpoint}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+'''
+A mergeable quantile sketch for latency values. Values are counted in logarithmic buckets so that
+any quantile is returned within a fixed relative error while memory only grows with the range of
+values seen, not the number of values. Sketches from threads, processes, or other machines can be
+merged and the result is the same as if all the values had been added to one sketch.
+'''
+
+import math
+
+class Sketch():
+    ''' Log bucket histogram, each bucket covers values within ±accuracy of its center. '''
+
+    def __init__(self, accuracy:float = 0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.low = None
+        self.high = None
+
+    def _index(self, value:float) -> int:
+        ''' Bucket number for a positive value. '''
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _center(self, index:int) -> float:
+        ''' The value which is closest to everything in a bucket. '''
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value:int|float, count:int = 1):
+        ''' Count a value, zero and negative values are all counted as zero. '''
+        if value > 0:
+            index = self._index(value)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        else:
+            self.zeros += count
+        self.count += count
+        self.low = value if self.low is None else min(self.low, value)
+        self.high = value if self.high is None else max(self.high, value)
+
+    def merge(self, other:'Sketch'):
+        ''' Add all the values counted by other into this sketch. Both must share an accuracy. '''
+        if other.accuracy != self.accuracy:
+            raise ValueError("Can not merge sketches with different accuracy.")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        for value in [other.low, other.high]:
+            if value is not None:
+                self.low = value if self.low is None else min(self.low, value)
+                self.high = value if self.high is None else max(self.high, value)
+
+    def quantile(self, q:float) -> float:
+        ''' Return the value at quantile q, 0 to 1, or None if nothing has been counted. '''
+        if self.count < 1:
+            return None
+        rank = max(1, math.ceil(q * self.count)) # nearest rank
+        seen = self.zeros
+        if rank <= seen:
+            return 0 if self.low > 0 else self.low
+        value = self.high
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank <= seen:
+                value = self._center(index)
+                break
+        # the first and last bucket can be tightened with the actual min and max
+        return min(max(value, self.low), self.high)
+
+    def quantiles(self) -> dict:
+        ''' The standard set of quantiles to report. '''
+        return {'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'p999': self.quantile(0.999)}
+
+    def to_dict(self) -> dict:
+        ''' Serialize to a dictionary that can be written as JSON. '''
+        return {'accuracy': self.accuracy,
+            'zeros': self.zeros,
+            'low': self.low,
+            'high': self.high,
+            'buckets': {str(k): v for k, v in sorted(self.buckets.items())}}
+
+    @staticmethod
+    def from_dict(data:dict) -> 'Sketch':
+        ''' Build a sketch from the output of to_dict(). '''
+        sketch = Sketch(data['accuracy'])
+        sketch.buckets = {int(k): v for k, v in data['buckets'].items()}
+        sketch.zeros = data['zeros']
+        sketch.count = sketch.zeros + sum(sketch.buckets.values())
+        sketch.low = data['low']
+        sketch.high = data['high']
+        return sketch
+
+# ################################################################################################ #
+# testing
+
+def sketch_test():
+    ''' Quantiles should be within the accuracy and merged sketches the same as one big one. '''
+    values = [(i * 7919) % 10007 + 1 for i in range(10000)]
+    one, two, both = Sketch(), Sketch(), Sketch()
+    for i, value in enumerate(values):
+        (one if i % 2 else two).add(value)
+        both.add(value)
+    one.merge(two)
+    assert one.count == both.count == len(values)
+    assert one.to_dict() == both.to_dict()
+    ordered = sorted(values)
+    for q in [0.5, 0.9, 0.99, 0.999]:
+        exact = ordered[math.ceil(q * len(values)) - 1]
+        assert abs(one.quantile(q) - exact) <= exact * 0.01 + 1, (q, exact, one.quantile(q))
+    copy = Sketch.from_dict(one.to_dict())
+    assert copy.quantiles() == one.quantiles()
+    assert Sketch().quantile(0.5) is None
+
+#sketch_test()
@@ -1,8 +1,86 @@
 ''' All functions related to the Stats object, an object to collect statistical information. '''
 
-import statistics
 import csv
 import json
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from util import sketch
+
+SAMPLE_SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('ns', tz='UTC')),
+    ('test', pa.string()),
+    ('try', pa.int32()),
+    ('latency_ns', pa.int64()),
+    ('rows', pa.int64()),
+    ('bytes', pa.int64()),
+    ('worker', pa.string())])
+
+class Samples():
+    '''
+    Every raw sample, one row per try, kept in typed Arrow tables. With a path the rows are flushed
+    to a Parquet file as they build up, without one they are kept in memory, as a worker would, to
+    be merged into a Samples object which does have a path.
+    '''
+
+    def __init__(self, path:str = None, buffer_rows:int = 64 * 1024):
+        self.path = path
+        self.buffer_rows = buffer_rows
+        self.rows = {name: [] for name in SAMPLE_SCHEMA.names}
+        self.tables = []
+        self.writer = None
+        self.worker = str(os.getpid())
+
+    def add(self, test:str, attempt:int, latency_ns:int, rows:int = None, size:int = None):
+        ''' Record one try of a test, size is bytes read if known. '''
+        for name, value in [('timestamp', time.time_ns()), ('test', test), ('try', attempt),
+            ('latency_ns', latency_ns), ('rows', rows), ('bytes', size), ('worker', self.worker)]:
+            self.rows[name].append(value)
+        if len(self.rows['test']) >= self.buffer_rows:
+            self.flush()
+
+    def _take(self) -> pa.Table:
+        ''' Turn the buffered rows into a table and start a new buffer. '''
+        table = pa.Table.from_pydict(self.rows, schema=SAMPLE_SCHEMA)
+        self.rows = {name: [] for name in SAMPLE_SCHEMA.names}
+        return table
+
+    def _write(self, table:pa.Table):
+        ''' Append a table to the Parquet file, opening it on first use. '''
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, SAMPLE_SCHEMA, compression='zstd')
+        self.writer.write_table(table)
+
+    def flush(self):
+        ''' Move buffered rows to the Parquet file, or to the in memory tables. '''
+        if self.rows['test']:
+            table = self._take()
+            if self.path:
+                self._write(table)
+            else:
+                self.tables.append(table)
+
+    def merge(self, other:'Samples'):
+        ''' Take all the rows from another Samples object, such as one returned by a worker. '''
+        other.flush()
+        for table in other.tables:
+            if self.path:
+                self._write(table)
+            else:
+                self.tables.append(table)
+        other.tables = []
+
+    def close(self):
+        ''' Flush and close the Parquet file. '''
+        self.flush()
+        if self.path and self.writer is None:
+            self._write(self._take()) # always leave a file, even with no samples
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
 
 class Stats():
     ''' An object to track status in a dictionary with some convenience functions to manage them '''
@@ -12,6 +90,8 @@ class Stats():
         ''' Just getting things started with some defaults '''
         self.stats =  {}
         self.subs = {}
+        self.sketch = None # created by the first value()
+        self.samples = None # a Samples object to also keep raw samples, off by default
 
     def _ensure(self, name:str, init_value:int|float|list) -> bool:
         '''
@@ -50,16 +130,21 @@ class Stats():
         self._ensure(name, [])
         self.stats[name].append(value)
 
+    def sample(self, test:str, attempt:int, latency_ns:int, rows:int = None, size:int = None):
+        ''' Keep a raw sample if samples are turned on. '''
+        if self.samples is not None:
+            self.samples.add(test, attempt, latency_ns, rows, size)
+
     def value(self, value:int|float, data:str = None):
         ''' Add several standard stats '''
         self.add('count', 1)
         self.add('total', value)
         self.min('min', value, {'min-id': data} if data else None)
         self.max('max', value, {'max-id': data} if data else None)
-        self.append('list', value)
-        #recalculate values based on lists
+        if self.sketch is None:
+            self.sketch = sketch.Sketch()
+        self.sketch.add(value)
         self.store('average', self.get('total', 1) / self.get('count', 1))
-        self.store('median', self.median())
 
     def min(self, name:str, value:int|float, data:dict = None):
         '''
@@ -85,19 +170,59 @@ class Stats():
                 for k,v in data.items():
                     self.stats[k] = v
 
+    def merge(self, other:'Stats'):
+        '''
+        Fold the stats from another object, such as one filled in by a worker process, into this
+        one. Counts and other numbers are added, min and max keep their ids, sketches are merged and
+        the average is recalculated. Notes and other text are taken from other.
+        '''
+        for name, value in other.stats.items():
+            if name in ['min', 'max']:
+                id_name = f"{name}-id"
+                ids = {id_name: other.stats[id_name]} if id_name in other.stats else None
+                getattr(self, name)(name, value, ids)
+            elif name in ['min-id', 'max-id', 'average']:
+                continue # handled with min and max or recalculated below
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.add(name, value)
+            else:
+                self.note(name, value)
+        if other.sketch is not None:
+            if self.sketch is None:
+                self.sketch = sketch.Sketch(other.sketch.accuracy)
+            self.sketch.merge(other.sketch)
+            self.store('average', self.get('total', 1) / self.get('count', 1))
+        for name, sub in other.subs.items():
+            self.get_sub(name).merge(sub)
+        if self.samples is not None and other.samples is not None:
+            self.samples.merge(other.samples)
+
     def median(self)-> float:
-        ''' Calculate a median from the current values in 'list'. '''
-        return statistics.median(self.get('list', []))
+        ''' The median of all the values, from the sketch so within 1% of the actual value. '''
+        return self.sketch.quantile(0.5) if self.sketch else None
+
+    def report(self) -> dict:
+        ''' The stats with the median and percentiles filled in from the sketch. '''
+        out = self.stats.copy()
+        if self.sketch is not None:
+            out['median'] = self.median()
+            out.update(self.sketch.quantiles())
+        return out
 
     def __str__(self) -> str:
         ''' Return a string representation of the stats. '''
         return str(self.stats)
 
     def dump(self) -> str:
-        out = self.stats.copy()
+        ''' JSON report, sketches are included so reports from many runs can be merged later. '''
+        out = self.report()
+        if self.sketch is not None:
+            out['sketch'] = self.sketch.to_dict()
         out['tests'] = []
         for test in self.subs:
-            item = self.subs[test].stats
+            item = self.subs[test].report()
+            if self.subs[test].sketch is not None:
+                item['sketch'] = self.subs[test].sketch.to_dict()
             item['name'] = test
             out['tests'].append(item)
         return json.dumps(out)
@@ -115,7 +240,7 @@ class Stats():
         ''' Write out the stats to a csv file. '''
         headers = []
         for key in self.subs:
-            headers = self._sort_csv_headers(list(self.subs[key].stats.keys()))
+            headers = self._sort_csv_headers(list(self.subs[key].report().keys()) + ['name'])
             break #just look at the first one, they are all the same
         if not 'valid' in headers:
             headers.append('valid')
@@ -125,7 +250,7 @@ class Stats():
             writer = csv.DictWriter(file, fieldnames=headers)
             writer.writeheader()
             for sub in self.subs:
-                data = self.subs[sub].stats.copy()
+                data = self.subs[sub].report()
                 data['name'] = sub
                 writer.writerow(data)
 
@@ -149,6 +274,22 @@ def create_a_test_stats_object():
     sub.max('max', 15)
     return s
 
+def merge_test():
+    ''' Stats from two workers should be the same as if they were all taken in one place. '''
+    one, two, both = Stats(), Stats(), Stats()
+    for value, stat in [(5, one), (1, two), (9, one), (3, two)]:
+        stat.value(value, f"t{value}")
+        stat.get_sub('test').value(value)
+        both.value(value, f"t{value}")
+    one.merge(two)
+    assert one.stats['count'] == 4 and one.stats['total'] == 18
+    assert one.stats['min'] == 1 and one.stats['min-id'] == 't1'
+    assert one.stats['max'] == 9 and one.stats['max-id'] == 't9'
+    assert one.median() == both.median()
+    assert one.report()['p99'] == both.report()['p99']
+    assert one.get_sub('test').stats['count'] == 4
+
+#merge_test()
 #s = create_a_test_stats_object()
 #print(s.csv('test.csv'))
 
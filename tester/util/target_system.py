@@ -26,6 +26,10 @@ class TargetSystem:
         ''' Generator to produce tests specific to the system. Will call yield. '''
         raise NotImplementedError("This class method must be implemented by subclasses")
 
+    def generate_late(self, test:test_config.AssessType) -> str:
+        ''' Two phase version of a test, filter first then fetch rows, or None if not supported. '''
+        return None
+
     def run_test(self, code:str):
         ''' Perform one test with a string specific to the target system. '''
         pass
@@ -52,10 +56,36 @@ class TargetSystem:
             ret = expected.value > len(data)
         elif expected.action == 'exact':
             ret = str(expected.value) == data
-        elif expected.action == 'contains':
+        elif expected.action in ['contain', 'contains']:
             if expected.value in data:
                 ret = True
         return ret
 
+    def summarize(self, code:str) -> dict:
+        '''
+        Run a test once and return {'count': rows, 'checksum': order independent hash} computed by
+        the engine so that rows do not need to be sent back to python.
+        '''
+        raise NotImplementedError("This class method must be implemented by subclasses")
+
+    def verify_summary(self, expected, summary:dict) -> bool:
+        ''' Like verify() but checked against the output of summarize(). '''
+        if not expected or not expected.action:
+            return True
+        count = summary['count']
+        if expected.action == 'checksum':
+            same_count = expected.value is None or int(expected.value) == count
+            return same_count and str(expected.checksum) == str(summary['checksum'])
+        if expected.value is None:
+            return True
+        ret = False
+        if expected.action == 'count':
+            ret = int(expected.value) == count
+        elif expected.action == 'greater-then':
+            ret = int(expected.value) < count
+        elif expected.action == 'less-then':
+            ret = int(expected.value) > count
+        return ret
+
     def give_to_each_user(self):
         return None
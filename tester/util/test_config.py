@@ -3,8 +3,10 @@ Create a pydantic based object which can be read in from either a json or yaml f
 blast script
 '''
 
+import itertools
 import json
-from typing import Literal
+import string
+from typing import Any, Iterator, Literal
 
 import yaml
 from pydantic import BaseModel, ConfigDict, model_validator
@@ -17,7 +19,7 @@ class OpType(BaseModel):
     ''' A single operation within a test. '''
     model_config = ConfigDict(strict=True, extra="forbid", frozen=True)
     description: str = None
-    type_of: Literal["geometry", "time", "bbox", "attribute_raw"]
+    type_of: Literal["geometry", "time", "bbox", "attribute_raw", "collection"]
     option: str = None
     value: str = None
     xmin: float = None
@@ -25,6 +27,9 @@ class OpType(BaseModel):
     ymin: float = None
     ymax: float = None
     bbox_column_name: str = "bbox"
+    # bbox only, also test envelopes with xmin > xmax as crossing the antimeridian, costs pruning
+    antimeridian: bool = False
+    coarse_column_name: str = None
     statement: str = None
 
 class OperationType(BaseModel):
@@ -42,9 +47,13 @@ class OperationType(BaseModel):
         return self
 
 class ExpectedType(BaseModel):
-    ''' An expected result rule. '''
-    action: Literal["count", "greater-then", "less-then", "exact", "contain"]
-    value: str | int
+    '''
+    An expected result rule. The count rules and checksum are checked with aggregates inside the
+    engine, checksum is an order independent hash of every row and value is then the row count.
+    '''
+    action: Literal["count", "greater-then", "less-then", "exact", "contain", "checksum"]
+    value: str | int = None
+    checksum: str = None
 
 class AssessType(BaseModel):
     ''' A single test to perform. '''
@@ -66,6 +75,63 @@ class AssessType(BaseModel):
             raise ValueError("At least one of 'raw' or 'operations' must be provided")
         return self
 
+class Placeholder(string.Template):
+    ''' ${name} placeholders, dots allow ${box.xmin} to reach into a dictionary value. '''
+    idpattern = r'(?a:[_a-z][_a-z0-9.]*)'
+    flags = 0 # names are case sensitive
+
+class TemplateType(BaseModel):
+    '''
+    One test written with ${name} placeholders and a matrix of values for each name. Every
+    combination of matrix values becomes a test, a string that is only a placeholder takes on the
+    type of the value so lists like columns can also be swapped in. {data} is left alone.
+    '''
+    model_config = ConfigDict(strict=True, extra="forbid", frozen=True)
+    test: dict[str, Any]
+    matrix: dict[str, list[Any]]
+
+    def size(self) -> int:
+        ''' Number of tests this template will make. '''
+        total = 1
+        for values in self.matrix.values():
+            total = total * len(values)
+        return total
+
+    def expand(self) -> Iterator[AssessType]:
+        ''' Generator of tests, one for each combination, only one test is made at a time. '''
+        names = list(self.matrix.keys())
+        for index, values in enumerate(itertools.product(*self.matrix.values())):
+            fill = {}
+            for name, value in zip(names, values):
+                fill[name] = value
+                if isinstance(value, dict):
+                    for key, item in value.items():
+                        fill[f"{name}.{key}"] = item
+            test = _fill(self.test, fill)
+            if test.get('name') == self.test.get('name'):
+                test['name'] = f"{self.test.get('name', 'template')}-{index}" # must be unique
+            yield AssessType(**test)
+
+def _fill(item:Any, fill:dict) -> Any:
+    ''' Swap placeholders in every string of a template with values. '''
+    if isinstance(item, dict):
+        return {key: _fill(value, fill) for key, value in item.items()}
+    if isinstance(item, list):
+        return [_fill(value, fill) for value in item]
+    if isinstance(item, str):
+        whole = item.strip()
+        if whole.startswith('${') and whole.endswith('}') and whole[2:-1] in fill:
+            return fill[whole[2:-1]] # keep the type of the value
+        return Placeholder(item).safe_substitute(
+            {key: _text(value) for key, value in fill.items()})
+    return item
+
+def _text(value:Any) -> str:
+    ''' Text version of a value for use inside a larger string. '''
+    if isinstance(value, list):
+        return ','.join(str(item) for item in value)
+    return str(value)
+
 class AssessConfig(BaseModel):
     ''' The entire test suite. '''
     model_config = ConfigDict(strict=True, extra="forbid", frozen=True)
@@ -73,8 +139,17 @@ class AssessConfig(BaseModel):
     name: str = None
     inputs: list[str] = None
     setup: dict[str, str] = None
-    tests: list[AssessType]
+    tests: list[AssessType] = []
+    templates: list[TemplateType] = None
     takedown: dict[str, str] = None
+    # hive layout of the data as written by analyze/hive.py, name to column or column:strftime
+    hive_partitioning: dict[str, str] = None
+
+    def each_test(self) -> Iterator[AssessType]:
+        ''' Generator of the listed tests followed by all the tests made from templates. '''
+        yield from self.tests
+        for template in self.templates or []:
+            yield from template.expand()
 
 # ################################################################################################ #
 
@@ -93,7 +168,7 @@ def from_file(path:str) -> dict:
     config = None
     with open(path, 'r', encoding='utf-8') as file:
         config = file.read()
-        if path[:5] == '.yaml':
+        if path.endswith(('.yaml', '.yml')):
             return from_yaml(config)
         return from_json(config)
     return config
@@ -154,6 +229,30 @@ tests:
       value: 11208
 '''
 
+# Template Test Data, 3 boxes by 2 time windows by 2 column lists
+unit_test_data_template = {
+    'name': 'Template tests',
+    'templates': [
+        {
+            'test': {
+                'name': 'box-${box.name}-after-${after}-${columns}',
+                'columns': '${columns}',
+                'operations': [{'ands': [
+                    {'type_of': 'bbox', 'xmin': '${box.xmin}', 'ymin': '${box.ymin}',
+                        'xmax': '${box.xmax}', 'ymax': '${box.ymax}'},
+                    {'type_of': 'time', 'option': 'greater-then', 'value': '${after}'}]}],
+                'source': '{data}'
+            },
+            'matrix': {
+                'box': [{'name': f"{size}", 'xmin': -size, 'ymin': -size, 'xmax': size,
+                    'ymax': size} for size in [1.0, 10.0, 90.0]],
+                'after': ['2015-01-01', '2020-01-01'],
+                'columns': [['GranuleUR'], ['*']]
+            }
+        }
+    ]
+}
+
 if __name__ == "__main__":
     # do the tests
     unit_test_data_pydamic1 = AssessConfig(**unit_test_data_json)
@@ -161,3 +260,12 @@ if __name__ == "__main__":
 
     unit_test_data_pydamic2 = from_yaml(unit_test_data_yaml)
     assert unit_test_data_pydamic2.tests[0].operations[0].ands[0].type_of == 'geometry'
+
+    unit_test_data_pydamic3 = AssessConfig(**unit_test_data_template)
+    assert unit_test_data_pydamic3.templates[0].size() == 12
+    unit_test_data_expanded = list(unit_test_data_pydamic3.each_test())
+    assert len(unit_test_data_expanded) == 12
+    assert unit_test_data_expanded[0].name == 'box-1.0-after-2015-01-01-GranuleUR'
+    assert unit_test_data_expanded[0].columns == ['GranuleUR']
+    assert unit_test_data_expanded[0].operations[0].ands[0].xmin == -1.0
+    assert unit_test_data_expanded[-1].source == '{data}'
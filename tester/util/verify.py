@@ -0,0 +1,62 @@
+'''
+Check test results once per test, outside of the timed runs. Counts and checksums are computed by
+the engine with an aggregate over the result so large results are never sent back to python.
+
+Expected values come from the test configuration or from a golden file, a JSON object of test names
+to {"count": rows, "checksum": hash} which can be recorded from a known good run.
+'''
+
+import json
+
+from util import file
+from util import test_config
+
+def load_golden(path:str) -> dict:
+    ''' Read in a golden file, a missing path gives no golden values. '''
+    if not path or not file.exists(path):
+        return {}
+    return json.loads(file.read(path))
+
+def save_golden(path:str, golden:dict):
+    ''' Write out recorded golden values, sorted so runs can be compared with diff. '''
+    file.write(json.dumps(golden, indent=4, sort_keys=True), path)
+
+def golden_expected(golden:dict, name:str) -> test_config.ExpectedType:
+    ''' Turn a recorded golden value into a checksum rule. '''
+    if name not in golden:
+        return None
+    return test_config.ExpectedType(action='checksum',
+        value=golden[name]['count'],
+        checksum=golden[name]['checksum'])
+
+def as_text(rows:list) -> str:
+    ''' Rows as the text exact and contain rules are written against, one line per row. '''
+    return '\n'.join(','.join(str(value) for value in row) for row in rows)
+
+def verify_test(engine, sql:str, name:str, expected:test_config.ExpectedType = None,
+    golden:dict = None, record:dict = None) -> bool:
+    '''
+    Run sql one more time to check it, returns None if there was nothing to check against.
+    Parameters:
+        engine: TargetSystem to run the check with
+        expected: rule from the test configuration, used before any golden value
+        golden: golden values to check against, keyed by name
+        record: if given, the count and checksum for this test are stored here by name
+    '''
+    if expected is None:
+        expected = golden_expected(golden or {}, name)
+    if expected is None and record is None:
+        return None
+
+    valid = None
+    if expected is not None and expected.action in ['exact', 'contain']:
+        # these rules look at the data itself, so it has to come back to python
+        valid = engine.verify(expected, as_text(engine.run_test(sql)))
+
+    if record is not None or (expected is not None and valid is None):
+        summary = engine.summarize(sql)
+        if record is not None:
+            record[name] = summary
+        if expected is not None and valid is None:
+            valid = engine.verify_summary(expected, summary)
+    return valid